@@ -0,0 +1,110 @@
+# Copyright (c) 2019 - 2024 Elie Michel
+#
+# This file is part of LilySurfaceScraper, a Blender add-on to import
+# materials from a single URL. It is released under the terms of the GPLv3
+# license. See the LICENSE.md file for the full text.
+
+"""
+Measure the throughput and CPU cost of writing a download to disk. A large
+file is served by a local server, running in another process so that its
+CPU time is not counted, and downloaded:
+ - with shutil.copyfileobj(r.raw, f) then hashed by reading the file again,
+ - with iter_content() and the hash computed on the fly, as Downloader did,
+ - with Downloader, that reads into a reused buffer and preallocates the file.
+
+Usage: python benchmarks/bench_download_writer.py [--size-mb 512] [--repeat 3]
+"""
+
+import argparse
+import hashlib
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+# the helpers of the tests are shared with the benchmarks
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), "tests"))
+from addon import importAddonModule, RangeServer
+
+
+def serve(size, queue):
+    block = os.urandom(1 << 20)
+    data = (block * (size // len(block) + 1))[:size]
+    with RangeServer({"/file.bin": data}) as server:
+        queue.put(server.url)
+        queue.get()  # wait for the end of the benchmark
+
+
+def copyfileobjThenHash(session_handler, url, path):
+    with session_handler.get(url, stream=True, headers={"Accept-Encoding": "identity"}) as r:
+        with open(path, "wb") as f:
+            shutil.copyfileobj(r.raw, f)
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def iterContentHashing(session_handler, url, path):
+    hasher = hashlib.sha256()
+    with session_handler.get(url, stream=True, headers={"Accept-Encoding": "identity"}) as r:
+        with open(path, "wb") as f:
+            for chunk in r.iter_content(1 << 20):
+                f.write(chunk)
+                hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def run(label, method, url, size, repeat):
+    best = None
+    digests = set()
+    for _ in range(repeat):
+        work_dir = tempfile.mkdtemp(prefix="lily_writer_")
+        path = os.path.join(work_dir, "file.bin")
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        digests.add(method(url, path))
+        cpu = time.process_time() - cpu_start
+        wall = time.perf_counter() - wall_start
+        shutil.rmtree(work_dir)
+        if best is None or wall < best[0]:
+            best = (wall, cpu)
+    wall, cpu = best
+    print("{:<24} {:>8.1f} MB/s {:>8.2f} CPU s/GB".format(label, size / wall / (1 << 20), cpu / (size / (1 << 30))))
+    return digests
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size-mb", type=int, default=512, help="size of the downloaded file, in MB")
+    parser.add_argument("--repeat", type=int, default=3, help="runs of each method, the fastest one is reported")
+    args = parser.parse_args()
+    size = args.size_mb << 20
+
+    sessionHandler = importAddonModule("sessionHandler")
+    downloadHandler = importAddonModule("downloadHandler")
+    handler = sessionHandler.SessionHandler()
+    downloader = downloadHandler.Downloader(handler, segments=1)
+
+    queue = multiprocessing.Queue()
+    server = multiprocessing.Process(target=serve, args=(size, queue), daemon=True)
+    server.start()
+    url = queue.get() + "/file.bin"
+    try:
+        digests = set()
+        digests |= run("copyfileobj + re-read", lambda url, path: copyfileobjThenHash(handler, url, path), url, size, args.repeat)
+        digests |= run("iter_content + hash", lambda url, path: iterContentHashing(handler, url, path), url, size, args.repeat)
+        digests |= run("Downloader", downloader.download, url, size, args.repeat)
+        print("connections opened: {}, digests {}".format(
+            handler.connectionCount(), "match" if len(digests) == 1 else "DIFFER"))
+    finally:
+        queue.put(None)
+        server.join()
+        handler.close()
+
+
+if __name__ == "__main__":
+    main()
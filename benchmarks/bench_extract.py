@@ -0,0 +1,104 @@
+# Copyright (c) 2019 - 2024 Elie Michel
+#
+# This file is part of LilySurfaceScraper, a Blender add-on to import
+# materials from a single URL. It is released under the terms of the GPLv3
+# license. See the LICENSE.md file for the full text.
+
+"""
+Compare ZipFile.extractall with the parallel extractor used for texture zips
+that had to be downloaded as a whole. The synthetic archive mimics an 8K set
+from ambientCG: a few large deflated maps, plus previews and material files
+that the scrapers do not select.
+
+Usage: python benchmarks/bench_extract.py [--maps 8] [--map-mb 48] [--repeat 3]
+"""
+
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import zipfile
+
+# the helpers of the tests are shared with the benchmarks
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), "tests"))
+from addon import importAddonModule
+
+
+def makeArchive(path, map_count, map_size):
+    """Maps are made of random runs, so that they deflate about as well as
+    real 8K PNG/EXR maps (i.e. poorly) and inflating them costs real work"""
+    rng = random.Random(0)
+    map_types = ["Color", "NormalGL", "NormalDX", "Roughness", "Displacement", "AmbientOcclusion", "Metalness", "Opacity"]
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED, compresslevel=1) as zip_ref:
+        for i in range(map_count):
+            chunks = []
+            size = 0
+            while size < map_size:
+                chunk = rng.randbytes(rng.randint(64, 4096)) * rng.randint(1, 4)
+                chunks.append(chunk)
+                size += len(chunk)
+            name = "Asset_8K-PNG_{}.png".format(map_types[i % len(map_types)] + ("" if i < len(map_types) else str(i)))
+            zip_ref.writestr(name, b"".join(chunks)[:map_size])
+        zip_ref.writestr("Asset.png", rng.randbytes(256 * 1024))
+        zip_ref.writestr("Asset_8K-PNG.usdc", rng.randbytes(64 * 1024))
+        zip_ref.writestr("Asset_8K-PNG.mtlx", b"<materialx/>" * 100)
+
+
+def run(label, extract, zip_path, repeat):
+    best = None
+    for _ in range(repeat):
+        target_dir = tempfile.mkdtemp(prefix="lily_extract_")
+        start = time.perf_counter()
+        with zipfile.ZipFile(zip_path, "r") as zip_ref:
+            extract(zip_ref, target_dir)
+        elapsed = time.perf_counter() - start
+        shutil.rmtree(target_dir)
+        best = elapsed if best is None else min(best, elapsed)
+    print("{:<20} {:>8.3f} s".format(label, best))
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--maps", type=int, default=8, help="number of maps in the archive")
+    parser.add_argument("--map-mb", type=float, default=48.0, help="uncompressed size of each map, in MB")
+    parser.add_argument("--repeat", type=int, default=3, help="runs of each method, the best one is reported")
+    parser.add_argument("--workers", type=int, default=None, help="threads of the parallel extractor (default: CPU count)")
+    args = parser.parse_args()
+
+    remoteZip = importAddonModule("remoteZip")
+    scraper_maps = ("Color", "NormalGL", "Roughness", "Displacement", "AmbientOcclusion", "Metalness", "Opacity")
+
+    def is_wanted(name):
+        return os.path.splitext(name)[0].split("_")[-1] in scraper_maps
+
+    def parallel_all(zip_ref, target_dir):
+        remoteZip.extractEntries(zip_ref, [info for info in zip_ref.infolist() if not info.is_dir()],
+                                 target_dir, args.workers)
+
+    def parallel_selected(zip_ref, target_dir):
+        remoteZip.extractEntries(zip_ref, [info for info in zip_ref.infolist() if is_wanted(info.filename)],
+                                 target_dir, args.workers)
+
+    work_dir = tempfile.mkdtemp(prefix="lily_bench_")
+    try:
+        zip_path = os.path.join(work_dir, "textures.zip")
+        makeArchive(zip_path, args.maps, int(args.map_mb * (1 << 20)))
+        print("archive: {} maps of {:.0f} MB, {:.0f} MB zipped, {} CPUs".format(
+            args.maps, args.map_mb, os.path.getsize(zip_path) / (1 << 20), os.cpu_count()))
+
+        reference = run("extractall", lambda zip_ref, target_dir: zip_ref.extractall(target_dir), zip_path, args.repeat)
+        parallel = run("parallel (all)", parallel_all, zip_path, args.repeat)
+        selected = run("parallel (selected)", parallel_selected, zip_path, args.repeat)
+    finally:
+        shutil.rmtree(work_dir)
+
+    print("speedup: {:.2f}x on all entries, {:.2f}x on the selected maps".format(
+        reference / parallel, reference / selected))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+# Copyright (c) 2019 - 2024 Elie Michel
+#
+# This file is part of LilySurfaceScraper, a Blender add-on to import
+# materials from a single URL. It is released under the terms of the GPLv3
+# license. See the LICENSE.md file for the full text.
+
+"""
+Measure the time taken to build the search index of a large library and to
+search it as the user types: prefixes of growing length, several words, and
+words with a typo. Asset names and tags are generated like those of the
+providers (e.g. "WoodFloor041" tagged "wood", "floor", "parquet").
+
+Usage: python benchmarks/bench_search.py [--assets 100000]
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+# the helpers of the tests are shared with the benchmarks
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), "tests"))
+from addon import importAddonModule
+
+WORDS = ["wood", "floor", "bricks", "tiles", "metal", "plates", "rock", "ground", "fabric", "leather",
+         "concrete", "marble", "paint", "rust", "gravel", "sand", "snow", "grass", "bark", "roof",
+         "planks", "paving", "stones", "asphalt", "carpet", "wallpaper", "plaster", "terrazzo", "moss", "ice"]
+TAGS = ["outdoor", "indoor", "rough", "clean", "dirty", "old", "new", "red", "white", "dark", "natural",
+        "man made", "pattern", "seamless", "damaged", "wet", "polished", "painted", "floor", "wall"]
+
+QUERIES = ["w", "wo", "woo", "wood", "woodf", "woodfloor", "wood fl", "wood floor dirty",
+           "bircks", "marbel", "concrte 04", "outdoor rough", "zzz"]
+
+
+def makeLibrary(count, seed=0):
+    rng = random.Random(seed)
+    assets = []
+    for i in range(count):
+        words = rng.sample(WORDS, rng.choice((1, 2)))
+        name = "".join(word.capitalize() for word in words) + "{:03d}".format(i % 1000)
+        asset_name = "{}_{}".format(name, i)
+        tags = rng.sample(TAGS, 4) + words
+        assets.append((asset_name, [asset_name, name], [rng.choice(("ambientCG", "polyhaven")), *tags]))
+    return assets
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--assets", type=int, default=100000, help="number of indexed assets")
+    parser.add_argument("--repeat", type=int, default=20, help="runs of each query, the fastest one is reported")
+    args = parser.parse_args()
+
+    searchIndex = importAddonModule("searchIndex")
+    library = makeLibrary(args.assets)
+
+    start = time.perf_counter()
+    index = searchIndex.SearchIndex()
+    for key, names, tags in library:
+        index.add(key, names, tags)
+    index.search("wood")  # sorts the vocabulary
+    print("built index of {} assets in {:.2f} s".format(len(index), time.perf_counter() - start))
+
+    for query in QUERIES:
+        best = None
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            results = index.search(query)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        print("{:<20} {:>7} results {:>8.2f} ms   {}".format(repr(query), len(results), best * 1000, results[:2]))
+
+
+if __name__ == "__main__":
+    main()
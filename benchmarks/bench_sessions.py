@@ -0,0 +1,89 @@
+# Copyright (c) 2019 - 2024 Elie Michel
+#
+# This file is part of LilySurfaceScraper, a Blender add-on to import
+# materials from a single URL. It is released under the terms of the GPLv3
+# license. See the LICENSE.md file for the full text.
+
+"""
+Measure the handshakes saved by the pooled SessionHandler on a multi-map
+import. The request pattern mimics PolyHavenTextureScraper: two sequential
+API calls (info, files), one thumbnail, then all maps in parallel, as
+fetchImages does. It is replayed against a local server that charges a delay
+for each new connection, once with bare requests.get() and once with the
+shared session.
+
+Usage: python benchmarks/bench_sessions.py [--maps 6] [--imports 3] [--handshake-ms 60]
+"""
+
+import argparse
+import concurrent.futures
+import os
+import sys
+import time
+
+import requests
+
+# the helpers of the tests are shared with the benchmarks
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), "tests"))
+from addon import importAddonModule, RangeServer
+
+
+def makeFiles(map_count, map_size):
+    files = {
+        "/info/asset": b'{"type": 1, "name": "Asset"}',
+        "/files/asset": b"{}" * 512,
+        "/thumbs/asset.png": b"\x89PNG" + bytes(64 * 1024),
+    }
+    for i in range(map_count):
+        files["/maps/map_{}.png".format(i)] = bytes(map_size)
+    return files
+
+
+def simulateImport(base_url, get, map_count):
+    for path in ("/info/asset", "/files/asset", "/thumbs/asset.png"):
+        get(base_url + path).content
+    map_urls = [base_url + "/maps/map_{}.png".format(i) for i in range(map_count)]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=map_count) as executor:
+        for r in executor.map(get, map_urls):
+            r.content
+
+
+def run(label, server, get, args):
+    server.resetCounters()
+    start = time.perf_counter()
+    for _ in range(args.imports):
+        simulateImport(server.url, get, args.maps)
+    elapsed = time.perf_counter() - start
+    print("{:<8} {:>5} requests {:>5} connections {:>8.3f} s".format(
+        label, len(server.requests), server.connections, elapsed))
+    return server.connections, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--maps", type=int, default=6, help="number of maps per import")
+    parser.add_argument("--map-size", type=int, default=1 << 20, help="size of each map, in bytes")
+    parser.add_argument("--imports", type=int, default=3, help="number of successive imports")
+    parser.add_argument("--handshake-ms", type=float, default=60.0,
+                        help="delay charged per new connection, emulating TCP + TLS round trips")
+    args = parser.parse_args()
+
+    sessionHandler = importAddonModule("sessionHandler")
+    handler = sessionHandler.SessionHandler()
+
+    def bare_get(url):
+        return requests.get(url, headers=sessionHandler.DEFAULT_HEADERS, timeout=handler.timeout)
+
+    with RangeServer(makeFiles(args.maps, args.map_size), args.handshake_ms / 1000.0) as server:
+        bare_connections, bare_time = run("bare", server, bare_get, args)
+        pooled_connections, pooled_time = run("pooled", server, handler.get, args)
+    handler.close()
+
+    print("handshakes saved: {} ({:.0%}), time saved: {:.3f} s".format(
+        bare_connections - pooled_connections,
+        1 - pooled_connections / max(bare_connections, 1),
+        bare_time - pooled_time))
+
+
+if __name__ == "__main__":
+    main()
@@ -23,6 +23,7 @@
 
 from .settings import UNSUPPORTED_PROVIDER_ERR
 from .ScrapersManager import ScrapersManager
+from .metadataHandler import Metadata
 
 
 class ScrapedData():
@@ -54,6 +55,7 @@ class ScrapedData():
         self.metadata = None
         self._scraper = type(self).makeScraper(self.url)
         self.reinstall = False
+        self.resync = False
 
         if self._scraper is None:
             self.error = scraping_type.capitalize() + " " + UNSUPPORTED_PROVIDER_ERR
@@ -84,13 +86,31 @@ class ScrapedData():
             return False
         if self.metadata is None:
             self.getVariantList()
-        if not self._scraper.fetchVariant(variant_index, self):
-            return False
+        # the metadata of the asset is written once, however many steps update it
+        with Metadata.batchedWrites():
+            if self.resync and self._scraper.refreshVariantList() is None:
+                self.error = self._scraper.error
+                return False
+            if not self._scraper.loadResolvedVariant(variant_index, self):
+                # filled from scratch to know which maps the scraper set, even to None
+                defaults, self.maps = self.maps, dict()
+                try:
+                    fetched = self._scraper.fetchVariant(variant_index, self)
+                finally:
+                    maps, self.maps = self.maps, {**defaults, **self.maps}
+                if not fetched:
+                    return False
+                self._scraper.saveResolvedVariant(variant_index, self.name, maps)
+        self._scraper.markUsed(self.name)
         return True
 
     def setReinstall(self, value):
         self.reinstall = value
         self._scraper.reinstall = value
 
+    def setResync(self, value):
+        self.resync = value
+        self._scraper.resync = value
+
     def isDownloaded(self, variant):
         return self._scraper.isDownloaded(variant)
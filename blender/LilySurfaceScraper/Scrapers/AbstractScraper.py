@@ -22,6 +22,7 @@
 # from a single URL
 import concurrent.futures
 import os
+import zipfile
 import string
 
 import sys
@@ -31,12 +32,25 @@ sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__
 from lxml import etree
 
 import requests
-import shutil
 import re
 
 from ..metadataHandler import Metadata
-from ..settings import TEXTURE_DIR
+from ..sessionHandler import SessionHandler
+from ..responseCache import ResponseCache
+from ..downloadHandler import Downloader, DownloadError, RangeNotSupported
+from ..remoteZip import extractRemoteZip, streamExtractZip, extractEntries, entryPath
+from ..contentStore import fileDigest
+from ..peerCache import PeerClient
+from ..extractionManifest import ExtractionManifest
+from ..assetIndex import AssetIndex
+from ..libraryIndex import LibraryIndex, isDownloaded
+from ..textureCache import markUsed
+from ..fileLock import FileLock, LOCK_SUFFIX
+from ..singleFlight import SingleFlight
+from ..downloadScheduler import DownloadScheduler, hostOf, PRIORITY_INTERACTIVE, PRIORITY_THUMBNAIL
+from ..settings import HTTP_CACHE_DIR
 from ..preferences import getPreferences
+from ..cache_utils import getTextureRoot, getSharedStore
 
 
 class AbstractScraper():
@@ -48,6 +62,9 @@ class AbstractScraper():
     home_url = None
     # directory of textures
     home_dir = None
+    # seconds during which API responses (fetchHtml, fetchJson, fetchXml) are
+    # reused without asking the server, None to disable caching
+    cache_ttl = 3600
 
     # partaining to previews
     show_preview = True
@@ -69,27 +86,76 @@ class AbstractScraper():
         self.error = None
         self.texture_root = texture_root
         self.reinstall = False
+        # download again only the files that changed upstream
+        self.resync = False
+        # revalidate cached API responses even within their time to live
+        self.bypass_cache_ttl = False
+        # lane of the download scheduler used for this scraper's downloads
+        self.priority = PRIORITY_INTERACTIVE
+
+    @staticmethod
+    def getTimeout():
+        """(connect, read) timeouts, in seconds, used for all requests"""
+        pref = getPreferences()
+        return (pref.connect_timeout, pref.read_timeout)
+
+    @staticmethod
+    def getRetries():
+        """Number of times a failed request or download is tried again"""
+        return getPreferences().http_retries
 
     @classmethod
     def _fetch(cls, url):
-        headers = {"User-Agent":"Mozilla/5.0"}  # fake user agent
-        r = requests.get(url if "https://" in url else "https://" + url, headers=headers)
+        url = url if "https://" in url else "https://" + url
+        try:
+            # concurrent requests of the same URL share a single transfer
+            r = SingleFlight.getInstance("fetch").do(url, SessionHandler.getInstance().get, url,
+                                                   timeout=cls.getTimeout(), retries=cls.getRetries())
+        except requests.exceptions.RequestException as err:
+            print("Could not fetch {}: {}".format(url, err))
+            return None
         if r.status_code != 200:
             return None
         else:
             return r
 
+    def getResponseCache(self):
+        pref = getPreferences()
+        cache_dir = self.getTextureDirectory(HTTP_CACHE_DIR)
+        return ResponseCache.getInstance(cache_dir, pref.http_cache_size * 1024 * 1024)
+
+    def _fetchCached(self, url):
+        """Same as _fetch, but going through the on-disk response cache.
+        Within cache_ttl the cached response is used as is, afterwards it is
+        revalidated with a conditional request."""
+        if self.cache_ttl is None:
+            return self._fetch(url)
+        url = url if "https://" in url else "https://" + url
+        # callers with another time to live must not get a response they would not use
+        key = ("cached", url, self.cache_ttl, self.bypass_cache_ttl)
+        return SingleFlight.getInstance("fetch").do(key, self._fetchThroughCache, url)
+
+    def _fetchThroughCache(self, url):
+        session_handler = SessionHandler.getInstance()
+        # metadata requests are small and latency bound, so worth hedging
+        get = session_handler.hedgedGet if getPreferences().hedge_requests else session_handler.get
+
+        def send(headers):
+            return get(url, headers=headers, timeout=self.getTimeout(), retries=self.getRetries())
+
+        return self.getResponseCache().fetch(url, send, self.cache_ttl, self.bypass_cache_ttl)
+
     def fetchHtml(self, url):
         """Get a lxml.etree object representing the scraped page.
         Use xpath queries to browse it."""
-        r = self._fetch(url)
+        r = self._fetchCached(url)
         if r is not None:
             return etree.HTML(r.text)
         else:
             self.error = "URL not found: {}".format(url)
 
     def fetchJson(self, url):
-        r = self._fetch(url)
+        r = self._fetchCached(url)
         if r is not None:
             return r.json()
         else:
@@ -98,68 +164,196 @@ class AbstractScraper():
     def fetchXml(self, url):
         """Get a lxml.etree object representing the scraped page.
         Use xpath queries to browse it."""
-        r = self._fetch(url)
+        r = self._fetchCached(url)
         if r is not None:
             return etree.fromstring(r.text)
         else:
             self.error = "URL not found: {}".format(url)
 
     def getRedirection(self, url):
-        headers = {"User-Agent":"Mozilla/5.0"}  # fake user agent
         url = url if "https://" in url else "https://" + url
-        r = requests.get(url, headers=headers, allow_redirects=False)
+        try:
+            r = SessionHandler.getInstance().get(url, allow_redirects=False,
+                                                 timeout=AbstractScraper.getTimeout(), retries=AbstractScraper.getRetries())
+        except requests.exceptions.RequestException as err:
+            print("Could not fetch {}: {}".format(url, err))
+            return None
         if r.status_code == 302:
             return r.headers.get("Location")
         else:
             return None
 
-    def getTextureDirectory(self, material_name):
+    def getTextureRoot(self):
+        """Return the texture dir set in preferences, made absolute relative to the blend file"""
+        return getTextureRoot(self.texture_root)
+
+    def getTextureDirectory(self, material_name, create=True):
         """Return the texture dir, relative to the blend file, dependent on material's name"""
-        texture_dir = getPreferences().texture_dir
-        if texture_dir == "":
-            texture_dir = TEXTURE_DIR
-        if texture_dir.startswith("//"):
-            texture_dir = texture_dir[2:]
-        if not os.path.isabs(texture_dir):
-            texture_dir = os.path.realpath(os.path.join(self.texture_root, texture_dir))
-        name_path = material_name.replace('/', os.path.sep)
-        dirpath = os.path.join(texture_dir, name_path)
-        os.makedirs(dirpath, exist_ok=True)
+        texture_dir = self.getTextureRoot()
+        parts = material_name.split('/')
+        if self.home_dir is not None and len(parts) > 1 and parts[0] == self.home_dir:
+            # <home_dir>/<asset>/..., the asset directory may be sharded
+            asset_dir = AssetIndex.getInstance(os.path.join(texture_dir, self.home_dir)).assetPath(
+                parts[1], getPreferences().shard_assets, create)
+            dirpath = os.path.join(asset_dir, *parts[2:])
+        else:
+            dirpath = os.path.join(texture_dir, material_name.replace('/', os.path.sep))
+        if create:
+            os.makedirs(dirpath, exist_ok=True)
         return dirpath
 
-    def _downloadFunc(self, url):
+    def getAssetDirectory(self, asset_name, create=True):
+        """Return the directory of an asset of this scraper's provider"""
+        return self.getTextureDirectory(f"{self.home_dir}/{asset_name}", create)
+
+    def getLibraryIndex(self):
+        """The index of the assets downloaded into the texture directory"""
+        return LibraryIndex.getInstance(self.getTextureRoot())
+
+    def listLibrary(self):
+        """Records of the assets of this scraper's provider that have been
+        downloaded, with their metadata, read from the library index
+        (that cache_utils.refreshLibraryIndex keeps up to date)"""
+        return self.getLibraryIndex().assets(self.home_dir)
+
+    def searchLibrary(self, query):
+        """Names of the downloaded assets of this scraper's provider matching
+        query, best matches first"""
+        return self.getLibraryIndex().search(self.home_dir, query)
+
+    def markUsed(self, material_name):
+        """Record that the variant stored for material_name has just been
+        used, for the quota of the texture directory"""
+        if self.home_dir is None:
+            return  # nothing downloaded
+        parts = material_name.split('/')
+        variant_path = self.getTextureDirectory(material_name, create=False)
+        record = self.metadata.getVariant(parts[2]) if len(parts) == 3 else None
+        if record is not None:
+            # the variant may be a single file, like an HDRI
+            variant_path = os.path.join(os.path.dirname(variant_path), record.path)
+        if os.path.exists(variant_path):
+            markUsed(variant_path)
+        if len(parts) == 3 and parts[0] == self.home_dir and self.isDownloaded(parts[2]):
+            self.getLibraryIndex().setDownloaded(*parts)
+
+    @staticmethod
+    def getContentStore():
+        """The store shared by all projects, or None if disabled"""
+        return getSharedStore()
+
+    @staticmethod
+    def getPeerClient():
+        """Client of the stores of other workstations, or None if no peer or secret is set"""
+        pref = getPreferences()
+        peers = [peer.strip() for peer in pref.peer_cache_peers.split(",") if peer.strip()]
+        if not peers or not pref.peer_cache_secret:
+            return None
+        return PeerClient(SessionHandler.getInstance(), peers, pref.peer_cache_secret)
+
+    def _fetchFromPeers(self, url, path, size=None, md5=None):
+        """Get the file at url from another workstation that downloaded it
+        already. Return True on success."""
+        client = self.getPeerClient()
+        if client is None or self.reinstall:
+            return False
+        found = client.findRecord(url)
+        if found is None or "hash" not in found[1]:
+            return False
+        peer, record = found
+        if size is not None and record.get("size") != size:
+            return False  # the peer has an outdated version
+        if not client.fetchObject(peer, record["hash"], path):
+            return False
+        if not self.isUpToDate(path, size, md5):
+            os.remove(path)
+            return False
+        print("Got {} from peer {}".format(path, peer))
+        store = self.getContentStore()
+        if store is not None:
+            store.add(path, record["hash"], url)
+        return True
+
+    def _fetchZipEntriesFromPeers(self, url, root, wanted_paths):
+        """Same as ContentStore.linkZipEntries, getting the entries from
+        another workstation. Return the paths of the entries, or None."""
+        client = self.getPeerClient()
+        if client is None or self.reinstall:
+            return None
+        found = client.findRecord(url)
+        if found is None or "names" not in found[1]:
+            return None
+        peer, record = found
+        paths = wanted_paths(record["names"])
+        if not all(path in record["entries"] for path in paths):
+            return None
+        for path in paths:
+            target = os.path.join(root, path)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            if not client.fetchObject(peer, record["entries"][path], target):
+                return None
+        print("Got the content of {} from peer {}".format(url, peer))
+        store = self.getContentStore()
+        if store is not None:
+            store.addZipEntries(url, root, record["names"], paths)
+        return paths
+
+    def _downloadFunc(self, url, use_store=True, size=None, md5=None):
+        """use_store: whether to look for url in the content store before
+        downloading it, and to add it to the store afterwards
+        size, md5: expected size and MD5 hash of the file, if known"""
+        store = self.getContentStore() if use_store else None
+        scheduler = DownloadScheduler.getInstance()
+        pref = getPreferences()
+        downloader = Downloader(SessionHandler.getInstance(), timeout=self.getTimeout(),
+                                segments=pref.download_segments,
+                                progress_callback=scheduler.recordBytes,
+                                retries=pref.http_retries,
+                                stall_time=pref.stall_time,
+                                scheduler=scheduler, priority=self.priority)
         def func(path):
-            headers = {"User-Agent": "Mozilla/5.0"}  # fake user agent
-            r = requests.get(url, stream=True, headers=headers)
-            if r.status_code == 200:
-                with open(path, 'wb') as f:
-                    r.raw.decode_content = True
-                    shutil.copyfileobj(r.raw, f)
-            else:
-                self.error = "URL not found: {}".format(url)
+            if store is not None and not self.reinstall and store.linkUrl(url, path, size):
+                if self.isUpToDate(path, size, md5):
+                    print("Linked {} from the shared store".format(path))
+                    return
+            if use_store and self._fetchFromPeers(url, path, size, md5):
+                return
+            try:
+                digest = scheduler.run(downloader.download, url, path, host=hostOf(url), priority=self.priority)
+            except DownloadError as err:
+                self.error = str(err)
                 return -1
+            if not self.isUpToDate(path, size, md5):
+                os.remove(path)
+                self.error = "Corrupted download of {}".format(url)
+                return -1
+            if store is not None:
+                store.add(path, digest, url)
         return func
 
-    def fetchImage(self, url, material_name, map_name, force_ext=False):
-        """Utility helper for download textures"""
+    def fetchImage(self, url, material_name, map_name, force_ext=False, size=None, md5=None):
+        """Utility helper for download textures
+        size, md5: expected size and MD5 hash of the file, when the provider gives them"""
         root = self.getTextureDirectory(material_name)
         if not force_ext:
             ext = os.path.splitext(url)[1]
             map_name = map_name + ext
         path = os.path.join(root, map_name)
-        return self.saveFile(path, self._downloadFunc(url))
+        return self.saveFile(path, self._downloadFunc(url, size=size, md5=md5), size, md5)
 
     def fetchImages(self, arg_tuples):
+        """Download several images in parallel, through the download scheduler.
+        Yield (map_name, path) pairs as downloads complete."""
+        scheduler = DownloadScheduler.getInstance()
         futures = dict()
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            for args in arg_tuples:
-                future = executor.submit(self.fetchImage, *args)
-                futures[future] = args[2]
+        for args in arg_tuples:
+            future = scheduler.submit(self.fetchImage, *args, host=hostOf(args[0]), priority=self.priority)
+            futures[future] = args[2]
 
-            for future in concurrent.futures.as_completed(futures):
-                name = futures[future]
-                path = future.result()
-                yield name, path
+        for future in concurrent.futures.as_completed(futures):
+            name = futures[future]
+            path = future.result()
+            yield name, path
 
     def fetchFile(self, url, material_name, filename):
         root = self.getTextureDirectory(material_name)
@@ -171,27 +365,184 @@ class AbstractScraper():
         """Utility helper for download textures"""
         root = self.getTextureDirectory(material_name)
         path = os.path.join(root, zip_name)
-        return self.saveFile(path, self._downloadFunc(url))
+        # zips are only kept until extracted
+        return self.saveFile(path, self._downloadFunc(url, use_store=False))
+
+    def fetchZipMaps(self, url, material_name, zip_name, map_name_of):
+        """Extract the maps contained in the remote zip into the texture
+        directory. map_name_of(name) returns the internal map name of an
+        entry, or None if it is not a map to extract. Only these entries are
+        downloaded when the server supports range requests, otherwise they are
+        extracted while the zip is streamed. The zip is only saved as a whole
+        if both fail, so that its download can be resumed. Entries already
+        extracted by another project are linked from the shared store instead.
+        Once done, a manifest of the maps is saved next to them so that they
+        are found again without listing the directory, and an interrupted
+        extraction is resumed. Return a dict mapping map names to paths, or None on error."""
+        root = self.getTextureDirectory(material_name)
+        if not self.reinstall:
+            maps = self._extractedMaps(root, url, zip_name, map_name_of)
+            if maps is not None:
+                return maps
+
+        return SingleFlight.getInstance("download").do(os.path.abspath(root) + "#maps", self._lockedExtractZip,
+                                                       url, material_name, zip_name, map_name_of)
+
+    def _extractedMaps(self, root, url, zip_name, map_name_of):
+        """Maps already extracted into root, None if they must be extracted"""
+        manifest = ExtractionManifest(root)
+        maps = manifest.maps(url)
+        if maps is not None:
+            return maps
+
+        zip_path = os.path.join(root, zip_name)
+        if os.path.isfile(zip_path) and os.path.getsize(zip_path) == 0:
+            # extracted by an older version, that left a 0-sized zip instead of a manifest
+            maps = {}
+            for name in os.listdir(root):
+                map_name = map_name_of(name)
+                if map_name is not None:
+                    maps[map_name] = name
+            os.remove(zip_path)
+            return manifest.complete(url, maps)
+        return None
+
+    def _lockedExtractZip(self, url, material_name, zip_name, map_name_of):
+        """Run _extractZip while holding a lock shared with other Blender instances"""
+        root = self.getTextureDirectory(material_name)
+        with FileLock(os.path.join(root, zip_name) + ".extract" + LOCK_SUFFIX) as lock:
+            if lock.waited and not self.reinstall:
+                maps = self._extractedMaps(root, url, zip_name, map_name_of)
+                if maps is not None:
+                    # extracted by another instance meanwhile
+                    return maps
+
+            manifest = ExtractionManifest(root)
+            if manifest.begin(url, restart=self.reinstall):
+                print("Resuming the extraction of {}".format(url))
+            namelist = self._extractZip(url, material_name, zip_name,
+                                        lambda name: map_name_of(name) is not None,
+                                        manifest.isExtracted)
+            if namelist is None:
+                return None
+            missing = [relpath for relpath in namelist if not os.path.isfile(os.path.join(root, relpath))]
+            if missing:
+                # the manifest stays incomplete, so that the extraction resumes next time
+                self.error = "Could not extract {} from {}".format(", ".join(missing), url)
+                print(self.error)
+                return None
+
+            # the zip is not needed anymore (removed rather than truncated, it may be a link)
+            zip_path = os.path.join(root, zip_name)
+            if os.path.exists(zip_path):
+                os.remove(zip_path)
+            return manifest.complete(url, {map_name_of(relpath): relpath for relpath in namelist})
+
+    def _extractZip(self, url, material_name, zip_name, is_wanted, is_extracted):
+        """Extract the wanted entries that is_extracted(relpath) does not
+        report as already there. Return the paths of all the wanted entries."""
+        root = self.getTextureDirectory(material_name)
+        store = self.getContentStore()
+        wanted_paths = lambda names: [entryPath(n) for n in names if is_wanted(n)]
+        if store is not None and not self.reinstall:
+            namelist = store.linkZipEntries(url, root, wanted_paths)
+            if namelist is not None:
+                print("Linked the content of {} from the shared store".format(url))
+                return namelist
+        namelist = self._fetchZipEntriesFromPeers(url, root, wanted_paths)
+        if namelist is not None:
+            return namelist
+
+        # the names of all entries are recorded for the shared store
+        all_names = []
+        def record_name(name):
+            all_names.append(name)
+            return is_wanted(name) and not is_extracted(entryPath(name))
+
+        if self._extractRemoteZip(url, root, record_name) is None:
+            del all_names[:]
+            zip_path = self.fetchZip(url, material_name, zip_name)
+            if zip_path is None:
+                return None
+            with zipfile.ZipFile(zip_path, "r") as zip_ref:
+                extractEntries(zip_ref, [info for info in zip_ref.infolist()
+                                         if not info.is_dir() and record_name(info.filename)], root)
+
+        all_names = list(dict.fromkeys(all_names))
+        namelist = list(dict.fromkeys(entryPath(name) for name in all_names if is_wanted(name)))
+        if store is not None:
+            store.addZipEntries(url, root, all_names, namelist)
+        return namelist
+
+    def _extractRemoteZip(self, url, root, is_wanted):
+        """Extract the wanted entries without writing the zip to disk: only
+        these entries are read when the server supports ranges, otherwise the
+        zip is extracted while it is streamed. Return None when the zip must
+        be downloaded as a whole instead."""
+        scheduler = DownloadScheduler.getInstance()
+        kwargs = dict(timeout=self.getTimeout(), retries=self.getRetries(),
+                      progress_callback=scheduler.recordBytes,
+                      host=hostOf(url), priority=self.priority)
+        try:
+            return scheduler.run(extractRemoteZip, SessionHandler.getInstance(), url, root, is_wanted, **kwargs)
+        except RangeNotSupported:
+            pass
+        except (DownloadError, requests.exceptions.RequestException, zipfile.BadZipFile) as err:
+            print("Could not extract {} remotely, downloading it: {}".format(url, err))
+            return None
 
-    def saveFile(self, path, data_callback_function):
+        try:
+            return scheduler.run(streamExtractZip, SessionHandler.getInstance(), url, root, is_wanted,
+                                 stall_time=getPreferences().stall_time, **kwargs)
+        except (DownloadError, requests.exceptions.RequestException, zipfile.BadZipFile) as err:
+            print("Could not extract {} while streaming it, downloading it: {}".format(url, err))
+            return None
+
+    def saveFile(self, path, data_callback_function, size=None, md5=None):
         """function for saving data, path is the location
-        dataCallbackFunction is a function that is used if file is not already present, return -1 if error occurred"""
-        if os.path.isfile(path) and not self.reinstall:
+        dataCallbackFunction is a function that is used if file is not already present, return -1 if error occurred
+        size, md5: if known, a present file is only used if it has this size (and this hash when checked)
+        Concurrent calls for the same path, from this Blender instance or from another one sharing
+        the texture directory, wait for the first one instead of writing the file twice."""
+        if os.path.isfile(path) and not self.reinstall and self.isUpToDate(path, size, md5):
             print("Using cached {}.".format(path))
         else:
             print("Downloading {}...".format(path))
-            r = data_callback_function(path)
+            r = SingleFlight.getInstance("download").do(os.path.abspath(path), self._lockedSave, path, data_callback_function,
+                                                        size, md5)
             if r == -1:
+                if self.error is None:
+                    self.error = "Download failed: {}".format(path)
                 return None
         return path
 
+    def isUpToDate(self, path, size=None, md5=None):
+        """Check a downloaded file against its expected size. Its MD5 hash is
+        also checked, when known, in re-sync mode or if enabled in preferences."""
+        if size is not None and os.path.getsize(path) != size:
+            print("{} does not have the expected size.".format(path))
+            return False
+        if md5 is not None and (self.resync or getPreferences().verify_checksums):
+            if fileDigest(path, "md5") != md5:
+                print("{} does not have the expected checksum.".format(path))
+                return False
+        return True
+
+    def _lockedSave(self, path, data_callback_function, size=None, md5=None):
+        with FileLock(path + LOCK_SUFFIX) as lock:
+            # the file found may also be the outdated one that is being replaced
+            if lock.waited and os.path.isfile(path) and not self.reinstall and self.isUpToDate(path, size, md5):
+                print("{} was downloaded by another instance.".format(path))
+                return
+            return data_callback_function(path)
+
     def clearString(self, s):
         """Remove non printable characters"""
         printable = set(string.printable)
         return ''.join(filter(lambda x: x in printable, s))
 
     def getVariantData(self, asset_name):
-        root = self.getTextureDirectory(os.path.join(self.home_dir, asset_name))
+        root = self.getAssetDirectory(asset_name)
         metadata_file = os.path.join(root, self.metadata_filename)
         self.metadata.load(metadata_file)
 
@@ -215,9 +566,10 @@ class AbstractScraper():
         if self.metadata.id == "":
             self.metadata.id = asset_name
 
-        root = self.getTextureDirectory(os.path.join(self.home_dir, asset_name))
+        root = self.getAssetDirectory(asset_name)
         metadata_file = os.path.join(root, self.metadata_filename)
 
+        self.metadata.keepResolvedVariants(Metadata.open(metadata_file))
         self._downloadThumbnail(root)
 
         self.metadata.save(metadata_file)
@@ -230,7 +582,8 @@ class AbstractScraper():
         if thumbnail_url is None:
             print("no thumbnail found, not downloading")
         else:
-            thumbnail_req = self._fetch(thumbnail_url)
+            scheduler = DownloadScheduler.getInstance()
+            thumbnail_req = scheduler.run(self._fetch, thumbnail_url, host=hostOf(thumbnail_url), priority=PRIORITY_THUMBNAIL)
             if thumbnail_req is None:
                 return
             thumbnail_type = thumbnail_req.headers["Content-Type"]
@@ -248,6 +601,16 @@ class AbstractScraper():
             f.write(thumbnail_req.content)
         self.metadata.thumbnail = thumbnail_name
 
+    def refreshVariantList(self):
+        """Fetch the list of variants again, revalidating cached API
+        responses, before a re-sync"""
+        url = self.metadata.fetchUrl or self.getUrlFromName(self.metadata.name)
+        self.bypass_cache_ttl = True
+        try:
+            return self.fetchVariantList(url)
+        finally:
+            self.bypass_cache_ttl = False
+
     def getVariantList(self, url):
         """Get a list of available variants.
         also fill self.metadata.name for metadata, otherwise implement fetchVariantList
@@ -260,6 +623,43 @@ class AbstractScraper():
         Return a boolean status, and fill self.error to add error messages."""
         raise NotImplementedError
 
+    def variantOptions(self):
+        """Options, like preferences, that change the result of fetchVariant,
+        as a string. The result of a previous import of a variant is only
+        reused if they did not change."""
+        return ""
+
+    def loadResolvedVariant(self, variant_index, material_data):
+        """Fill material_data with the result of the previous import of the
+        variant, if all the files it refers to are still there, so that
+        importing it again requires no scraping. Return True if it did."""
+        if self.home_dir is None or self.reinstall or self.resync or getPreferences().verify_checksums:
+            return False
+        if variant_index < 0 or variant_index >= len(self.metadata.records):
+            return False
+        record = self.metadata.records[variant_index]
+        if record.resolved is None or not self.isDownloaded(record.name):
+            return False
+        root = self.getAssetDirectory(self.metadata.name, create=False)
+        resolved = record.resolvedMaps(root, self.variantOptions())
+        if resolved is None:
+            return False
+        material_data.name, maps = resolved
+        material_data.maps.update(maps)
+        return True
+
+    def saveResolvedVariant(self, variant_index, material_name, maps):
+        """Record the result of fetchVariant, given the maps it set, in the
+        metadata of the asset, for loadResolvedVariant to reuse it. Nothing is
+        recorded if some of them failed."""
+        if self.home_dir is None or variant_index < 0 or variant_index >= len(self.metadata.records):
+            return
+        if self.error is not None:
+            return
+        root = self.getAssetDirectory(self.metadata.name, create=False)
+        if self.metadata.records[variant_index].resolve(root, material_name, maps, self.variantOptions()):
+            self.metadata.save(os.path.join(root, self.metadata_filename))
+
     def getThumbnail(self):
         """Function for getting a url for a thumbnail for the texture, preferably using only self.assetName
          but you can pass more arguments with self.metadata.custom as its called after getVariantList.
@@ -270,8 +670,10 @@ class AbstractScraper():
 
     def isDownloaded(self, target_variation):
         """takes the asset and a variation name and checks if its installed, returns a boolean"""
-        root = self.getTextureDirectory(os.path.join(self.home_dir, self.metadata.name))
-        return os.path.exists(os.path.join(root, target_variation))
+        root = self.getAssetDirectory(self.metadata.name)
+        record = self.metadata.getVariant(target_variation)
+        variant_path = os.path.join(root, record.path if record is not None else target_variation)
+        return isDownloaded(variant_path)
 
     def getUrlFromName(self, asset_name):
         """get a url for an asset from a name"""
@@ -21,17 +21,38 @@
 # This file is part of LilySurfaceScraper, a Blender add-on to import materials
 # from a single URL
 
-import zipfile
 import os
 import re
 from urllib.parse import urlparse, parse_qs
 from .AbstractScraper import AbstractScraper
+from ..metadataHandler import VariantRecord, FileRecord, parseResolution, parseFormat
 
 
 class AmbientCgScraper(AbstractScraper):
     source_name = "ambientCG"
     home_url = "https://ambientcg.com/list"
     home_dir = "ambientCG"
+    cache_ttl = 24 * 3600
+
+    # Translate cc0textures map names into our internal map names
+    maps_tr = {
+        # Names of the old website
+        'col': 'baseColor',
+        'nrm': 'normalInvertedY',
+        'mask': 'opacity',
+        'rgh': 'roughness',
+        'met': 'metallic',
+        'AO': 'ambientOcclusion',
+        'disp': 'height',
+        # New names
+        'Color': 'baseColor',
+        'Normal': 'normalInvertedY',
+        'Opacity': 'opacity',
+        'Roughness': 'roughness',
+        'Metalness': 'metallic',
+        'AmbientOcclusion': 'ambientOcclusion',
+        'Displacement': 'height'
+    }
 
     @classmethod
     def canHandleUrl(cls, url):
@@ -55,10 +76,14 @@ class AmbientCgScraper(AbstractScraper):
         variants_data = asset_data["Downloads"]
         variants = sorted(list(variants_data.keys()),
                           key=lambda x: self.sortTextWithNumbers(" ".join(x.split("-")[::-1])))
-        variants_urls = [ variants_data[v]["RawDownloadLink"] for v in variants ]
+        # each variant is a zip, extracted into a directory named after the variant
+        self.metadata.records = [VariantRecord(v, parseResolution(v), parseFormat(v),
+                                               {"zip": FileRecord(variants_data[v]["RawDownloadLink"])})
+                                 for v in variants]
 
-        self.metadata.setCustom("variants_urls", variants_urls)
         self.metadata.name = asset_id
+        category = asset_data.get("DisplayCategory") or asset_data.get("Category")
+        self.metadata.tags = sorted(set(asset_data.get("Tags", [])) | ({category} if category else set()))
         self.metadata.setCustom("thumbnail_url", asset_data["PreviewSphere"]["512-PNG"])
         return variants
 
@@ -70,55 +95,28 @@ class AmbientCgScraper(AbstractScraper):
         Must fill material_data.name and material_data.maps.
         Return a boolean status, and fill self.error to add error messages."""
         # Get data saved in fetchVariantList
-        variants = self.metadata.variants
-        variants_urls = self.metadata.getCustom("variants_urls")
+        records = self.metadata.records
 
-        if variant_index < 0 or variant_index >= len(variants):
+        if variant_index < 0 or variant_index >= len(records):
             self.error = "Invalid variant index: {}".format(variant_index)
             return False
         
-        variant = variants[variant_index]
-        zip_url = variants_urls[variant_index]
+        record = records[variant_index]
+        zip_url = record.files["zip"].url
 
-        material_data.name = f"{self.home_dir}/{self.metadata.name}/{variant}"
-        zip_path = self.fetchZip(zip_url, material_data.name, "textures.zip")
-        zip_dir = os.path.dirname(zip_path)
-        if os.path.getsize(zip_path) == 0:
-            # maps already exist
-            namelist = os.listdir(zip_dir)
-        else:
-            with zipfile.ZipFile(zip_path,"r") as zip_ref:
-                namelist = zip_ref.namelist()
-                zip_ref.extractall(zip_dir)
-            # wipe zip to leave only a 0-sized file:
-            open(zip_path, 'wb').close()
-        
-        # Translate cc0textures map names into our internal map names
-        maps_tr = {
-            # Names of the old website
-            'col': 'baseColor',
-            'nrm': 'normalInvertedY',
-            'mask': 'opacity',
-            'rgh': 'roughness',
-            'met': 'metallic',
-            'AO': 'ambientOcclusion',
-            'disp': 'height',
-            # New names
-            'Color': 'baseColor',
-            'Normal': 'normalInvertedY',
-            'Opacity': 'opacity',
-            'Roughness': 'roughness',
-            'Metalness': 'metallic',
-            'AmbientOcclusion': 'ambientOcclusion',
-            'Displacement': 'height'
-        }
-        for name in namelist:
-            base = os.path.splitext(name)[0]
-            map_type = base.split('_')[-1]
-            if map_type in maps_tr:
-                map_name = maps_tr[map_type]
-                material_data.maps[map_name] = os.path.join(zip_dir, name)
+        material_data.name = f"{self.home_dir}/{self.metadata.name}/{record.name}"
+        maps = self.fetchZipMaps(zip_url, material_data.name, "textures.zip", self.getMapName)
+        if maps is None:
+            return False
+
+        material_data.maps.update(maps)
         return True
 
+    def getMapName(self, filename):
+        """Internal map name of a file of the zip, None if it is not a map"""
+        base = os.path.splitext(filename)[0]
+        map_type = base.split('_')[-1]
+        return self.maps_tr.get(map_type)
+
     def getUrlFromName(self, asset_name):
         return f"https://ambientcg.com/view?id={asset_name}"
@@ -22,8 +22,8 @@
 # from a single URL
 
 from .AbstractScraper import AbstractScraper
+from ..metadataHandler import VariantRecord, FileRecord, parseResolution
 
-import zipfile
 import os
 from urllib.parse import urlparse
 
@@ -32,6 +32,21 @@ class CgbookcaseScraper(AbstractScraper):
     source_name = "cgbookcase.com"
     home_url = "https://www.cgbookcase.com/textures/"
     home_dir = "cgbookcase"
+    cache_ttl = 24 * 3600
+
+    # Translate cgbookcase map names into our internal map names
+    maps_tr = {
+        'BaseColor': 'baseColor',
+        'Normal': 'normal',
+        'Opacity': 'opacity',
+        'Roughness': 'roughness',
+        'Metallic': 'metallic',
+        'Height': 'height',
+        'AO': 'ambientOcclusion',
+    }
+
+    # Variants of double-sided textures, in this order for each resolution
+    sides = ("double-sided", "front only", "back only")
 
     @classmethod
     def canHandleUrl(cls, url):
@@ -50,24 +65,22 @@ class CgbookcaseScraper(AbstractScraper):
         api_url = f"https://www.cgbookcase.com/textures/{identifier}/LilySurfaceScraper.json"
 
         data = self.fetchJson(api_url)
+        if data is None:
+            return None
 
         resolutions = sorted(data['files'].keys(), key=lambda x: x.zfill(3))
 
         if data["doublesided"]:
-            variants = (
-                [ x + " (double-sided)" for x in resolutions ] +
-                [ x + " (front only)"   for x in resolutions ] +
-                [ x + " (back only)"    for x in resolutions ]
-            )
+            variants = [(f"{res} ({side})", res) for side in self.sides for res in resolutions]
         else:
-            variants = resolutions
-        
+            variants = [(res, res) for res in resolutions]
+        # all the variants of a resolution are extracted from the same zip
+        self.metadata.records = [VariantRecord(name, parseResolution(res), "", {"zip": FileRecord(data['files'][res])})
+                                 for name, res in variants]
+
         self.metadata.name = data['title']
         self.metadata.id = identifier
-        self.metadata.setCustom("resolutions", resolutions)
-        self.metadata.setCustom("files", data['files'])
-        self.metadata.setCustom("doublesided", data['doublesided'])
-        return variants
+        return [name for name, _ in variants]
 
     def getThumbnail(self):
         parse = self.fetchHtml(f"https://www.cgbookcase.com/textures/{self.metadata.id}")
@@ -86,70 +99,57 @@ class CgbookcaseScraper(AbstractScraper):
         Must fill material_data.name and material_data.maps.
         Return a boolean status, and fill self.error to add error messages."""
         # Get data saved in fetchVariantList
-        title = self.metadata.name
-        resolutions = self.metadata.getCustom("resolutions")
-        variants = self.metadata.variants
-        files = self.metadata.getCustom("files")
-        doublesided = self.metadata.getCustom("doublesided")
-        
-        if variant_index < 0 or variant_index >= len(variants):
+        records = self.metadata.records
+
+        if variant_index < 0 or variant_index >= len(records):
             self.error = "Invalid variant index: {}".format(variant_index)
             return False
 
-        variant_name = variants[variant_index]
-        material_data.name = f"{self.home_dir}/{title}/{variant_name}"
+        record = records[variant_index]
+        material_data.name = f"{self.home_dir}/{self.metadata.name}/{record.name}"
+        sideness = self.getSideness(record.name)
 
-        res = resolutions[variant_index % len(resolutions)]
-        sideness = variant_index // len(resolutions)
-        zip_url = files[res]
+        maps = self.fetchZipMaps(record.files["zip"].url, material_data.name, "textures.zip",
+                                 lambda name: self.getMapName(name, sideness))
+        if maps is None:
+            return False
 
-        zip_path = self.fetchZip(zip_url, material_data.name, "textures.zip")
-        zip_dir = os.path.dirname(zip_path)
-        if os.path.getsize(zip_path) == 0:
-            # maps already exist
-            namelist = os.listdir(zip_dir)
-        else:
-            with zipfile.ZipFile(zip_path,"r") as zip_ref:
-                namelist = zip_ref.namelist()
-                zip_ref.extractall(zip_dir)
-            # wipe zip to leave only a 0-sized file:
-            open(zip_path, 'wb').close()
-
-        # Translate cgbookcase map names into our internal map names
-        maps_tr = {
-            'BaseColor': 'baseColor',
-            'Normal': 'normal',
-            'Opacity': 'opacity',
-            'Roughness': 'roughness',
-            'Metallic': 'metallic',
-            'Height': 'height',
-            'AO': 'ambientOcclusion',
-        }
-        for name in namelist:
-            base = os.path.splitext(name)[0]
-            tokens = base.split('_')
-            map_type = tokens[-1]
-
-            if map_type not in maps_tr:
-                continue
-
-            map_name = maps_tr[map_type]
-
-            if doublesided:
-                map_side = tokens[-2]
-
-                if map_side == "front" and sideness == 2:
-                    continue  # back only
-                elif map_side == "back" and sideness == 1:
-                    continue  # front only
-
-                if map_side == "back":
-                    map_name += "_back"
-            
-            material_data.maps[map_name] = os.path.join(zip_dir, name)
-        
+        material_data.maps.update(maps)
         return True
 
+    def getSideness(self, variant_name):
+        """Index in self.sides of the side of a variant, None if the texture
+        is not double-sided"""
+        for i, side in enumerate(self.sides):
+            if variant_name.endswith(f" ({side})"):
+                return i
+        return None
+
+    def getMapName(self, filename, sideness):
+        """Internal map name of a file of the zip, None if it is not a map
+        used by the variant"""
+        base = os.path.splitext(filename)[0]
+        tokens = base.split('_')
+        map_type = tokens[-1]
+
+        if map_type not in self.maps_tr:
+            return None
+
+        map_name = self.maps_tr[map_type]
+
+        if sideness is not None:
+            map_side = tokens[-2]
+
+            if map_side == "front" and sideness == 2:
+                return None  # back only
+            elif map_side == "back" and sideness == 1:
+                return None  # front only
+
+            if map_side == "back":
+                map_name += "_back"
+
+        return map_name
+
     def getUrlFromName(self, asset_name):
         # should be enough
         name = asset_name.lower().replace(' ', '-')
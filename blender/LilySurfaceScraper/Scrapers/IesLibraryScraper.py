@@ -7,6 +7,7 @@
 import os
 import re
 from .AbstractScraper import AbstractScraper
+from ..metadataHandler import VariantRecord
 from ..preferences import getPreferences
 
 
@@ -15,6 +16,7 @@ class IesLibraryScraper(AbstractScraper):
     source_name = "IES Library"
     home_url = "https://ieslibrary.com"
     home_dir = "ieslibrary"
+    cache_ttl = 7 * 24 * 3600
 
     pattern = r"https://ieslibrary\.com/.*#ies-(.+)"
 
@@ -51,6 +53,8 @@ class IesLibraryScraper(AbstractScraper):
         self.metadata.setCustom("blender_energy", data["energy"])
         self.metadata.name = asset_id
         self.metadata.setCustom("thumbnailURL", data["preview"])
+        # a single file, in the asset directory
+        self.metadata.records = [VariantRecord(variant, fmt="ies", path=f"{variant}.ies")]
         return [variant]
 
     def getThumbnail(self):
@@ -72,6 +76,8 @@ class IesLibraryScraper(AbstractScraper):
         material_data.name = f"{self.home_dir}/{self.metadata.name}/{variant}"
 
         data_file = self.fetchFile(download_url, f"{self.home_dir}/{self.metadata.name}", f"{variant}.ies")
+        if data_file is None:
+            return False
         data_dir = os.path.dirname(data_file)
 
         material_data.maps["ies"] = os.path.join(data_dir, f"{variant}.ies")
@@ -79,7 +85,7 @@ class IesLibraryScraper(AbstractScraper):
         return True
 
     def isDownloaded(self, target_variation):
-        root = self.getTextureDirectory(os.path.join(self.home_dir, self.metadata.name))
+        root = self.getAssetDirectory(self.metadata.name)
         return os.path.isfile(os.path.join(root, f"{target_variation}.ies"))
 
     def getUrlFromName(self, asset_name):
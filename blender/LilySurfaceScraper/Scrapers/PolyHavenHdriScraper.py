@@ -22,9 +22,9 @@
 # from a single URL
 
 from .AbstractScraper import AbstractScraper
+from ..metadataHandler import VariantRecord, FileRecord, parseResolution
 import re
 import os
-from collections import defaultdict
 
 
 class PolyHavenHdriScraper(AbstractScraper):
@@ -32,6 +32,7 @@ class PolyHavenHdriScraper(AbstractScraper):
     source_name = "Poly Haven HDRI"
     home_url = "https://polyhaven.com/hdris"
     home_dir = "hdrihaven"
+    cache_ttl = 24 * 3600
 
     polyHavenUrl = re.compile(r"(?:https:\/\/)?polyhaven\.com\/a\/([^\/]+)")
 
@@ -65,6 +66,7 @@ class PolyHavenHdriScraper(AbstractScraper):
             return None
 
         name = data["name"]
+        tags = sorted(set(data.get("tags", [])) | set(data.get("categories", [])))
 
         api_url = f"https://api.polyhaven.com/files/{identifier}"
         data = self.fetchJson(api_url)
@@ -72,19 +74,19 @@ class PolyHavenHdriScraper(AbstractScraper):
             self.error = "API error"
             return None
 
-        variant_data = defaultdict(dict)
+        records = []
         for res, maps in data["hdri"].items():
             for fmt, dat in maps.items():
-                variant_data[(res, fmt)] = dat['url']
-
-        variant_data = [(*k, v) for k, v in variant_data.items()]
-        variant_data.sort(key=lambda x: self.sortTextWithNumbers(f"{x[1]} {x[0]}"))
-        variants = [f"{res} ({fmt})" for res, fmt, _ in variant_data]
+                # a single file, named after its resolution
+                hdri = FileRecord(dat["url"], dat.get("size"), dat.get("md5"))
+                records.append(VariantRecord(f"{res} ({fmt})", parseResolution(res), fmt, {"hdri": hdri}, f"{res}.{fmt}"))
+        records.sort(key=lambda r: (r.format, r.resolution))
 
         self.metadata.name = name
         self.metadata.id = identifier
-        self.metadata.setCustom("variant_data", variant_data)
-        return variants
+        self.metadata.tags = tags
+        self.metadata.records = records
+        return self.metadata.variants
 
     def getThumbnail(self):
         return f"https://cdn.polyhaven.com/asset_img/thumbs/{self.metadata.id}.png?width=512&height=512"
@@ -95,27 +97,21 @@ class PolyHavenHdriScraper(AbstractScraper):
         Return a boolean status, and fill self.error to add error messages."""
         # Get data saved in fetchVariantList
         name = self.metadata.name
-        variant_data = self.metadata.getCustom("variant_data")
-        variants = self.metadata.variants
+        records = self.metadata.records
         
-        if variant_index < 0 or variant_index >= len(variants):
+        if variant_index < 0 or variant_index >= len(records):
             self.error = "Invalid variant index: {}".format(variant_index)
             return False
         
-        var_name = variants[variant_index]
-        var_data = variant_data[variant_index]
-        material_data.name = f"{self.home_dir}/{name}/{var_name}"
+        record = records[variant_index]
+        material_data.name = f"{self.home_dir}/{name}/{record.name}"
 
-        map_url = var_data[2]
-        material_data.maps['sky'] = self.fetchImage(map_url, f"{self.home_dir}/{name}", var_data[0])
+        hdri = record.files["hdri"]
+        material_data.maps['sky'] = self.fetchImage(hdri.url, f"{self.home_dir}/{name}", os.path.splitext(record.path)[0],
+                                                    size=hdri.size, md5=hdri.md5)
         
         return True
 
-    def isDownloaded(self, target_variation):
-        root = self.getTextureDirectory(os.path.join(self.home_dir, self.metadata.name))
-        name, ext = target_variation.split(" (")
-        return os.path.isfile(os.path.join(root, f"{name}.{ext[:-1]}"))
-
     def getUrlFromName(self, asset_name):
         # data = self.fetchJson(f"https://api.polyhaven.com/assets?s={asset_name.replace()}")
 
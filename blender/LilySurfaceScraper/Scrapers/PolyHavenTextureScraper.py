@@ -23,15 +23,16 @@
 
 from .AbstractScraper import AbstractScraper
 from ..preferences import getPreferences
+from ..metadataHandler import VariantRecord, FileRecord, parseResolution
 
 import re
-from collections import defaultdict
 
 
 class PolyHavenTextureScraper(AbstractScraper):
     source_name = "Poly Haven Texture"
     home_url = "https://polyhaven.com/textures"
     home_dir = "texturehaven"
+    cache_ttl = 24 * 3600
 
     # Translate TextureHaven map names into our internal map names
     # (sorted by priority)
@@ -103,6 +104,7 @@ class PolyHavenTextureScraper(AbstractScraper):
             return None
 
         name = data["name"]
+        tags = sorted(set(data.get("tags", [])) | set(data.get("categories", [])))
 
         api_url = f"https://api.polyhaven.com/files/{identifier}"
         data = self.fetchJson(api_url)
@@ -110,23 +112,22 @@ class PolyHavenTextureScraper(AbstractScraper):
             self.error = "API error"
             return None
 
-        variant_data = defaultdict(dict)
+        records = dict()
         for map_type, maps in data.items():
             map_type = map_type.lower()
             if map_type not in self.maps_tr.keys():
                 continue
             for res, formats in maps.items():
                 for fmt, map_data in formats.items():
-                    variant_data[(res, fmt)][map_type] = map_data['url']
-
-        variant_data = [(*k, v) for k, v in variant_data.items()]
-        variant_data.sort(key=lambda x: self.sortTextWithNumbers(f"{x[1]} {x[0]}"))
-        variants = [f"{res} ({fmt})" for res, fmt, _ in variant_data]
+                    if (res, fmt) not in records:
+                        records[(res, fmt)] = VariantRecord(f"{res} ({fmt})", parseResolution(res), fmt)
+                    records[(res, fmt)].files[map_type] = FileRecord(map_data["url"], map_data.get("size"), map_data.get("md5"))
 
         self.metadata.name = name
         self.metadata.id = identifier
-        self.metadata.setCustom("variant_data", variant_data)
-        return variants
+        self.metadata.tags = tags
+        self.metadata.records = sorted(records.values(), key=lambda r: (r.format, r.resolution))
+        return self.metadata.variants
 
     def getThumbnail(self):
         return f"https://cdn.polyhaven.com/asset_img/thumbs/{self.metadata.id}.png?width=512&height=512"
@@ -137,23 +138,22 @@ class PolyHavenTextureScraper(AbstractScraper):
         Return a boolean status, and fill self.error to add error messages."""
         # Get data saved in fetchVariantList
         name = self.metadata.name
-        variant_data = self.metadata.getCustom("variant_data")
-        variants = self.metadata.variants
+        records = self.metadata.records
         pref = getPreferences()
         
-        if variant_index < 0 or variant_index >= len(variants):
+        if variant_index < 0 or variant_index >= len(records):
             self.error = "Invalid variant index: {}".format(variant_index)
             return False
         
-        var_name = variants[variant_index]
-        material_data.name = f"{self.home_dir}/{name}/{var_name}"
+        record = records[variant_index]
+        material_data.name = f"{self.home_dir}/{name}/{record.name}"
         
-        maps = variant_data[variant_index][2]
+        maps = dict(record.files)
         if "displacement" in maps and "bump" in maps:
             del maps["bump"]
 
         fetchImage_args = list()
-        for map_name, map_url in maps.items():
+        for map_name, map_info in maps.items():
             map_name = map_name.lower()
             if map_name in self.maps_tr:
                 map_name = self.maps_tr[map_name]
@@ -164,13 +164,17 @@ class PolyHavenTextureScraper(AbstractScraper):
                 if map_name in skip:
                     continue
 
-                fetchImage_args.append((map_url, material_data.name, map_name))
+                fetchImage_args.append((map_info.url, material_data.name, map_name, False,
+                                        map_info.size, map_info.md5))
 
         for name, path in self.fetchImages(fetchImage_args):
             material_data.maps[name] = path
 
         return True
 
+    def variantOptions(self):
+        return "arm" if getPreferences().use_arm else ""
+
     def getUrlFromName(self, asset_name):
         # same as hdri one, works well enough
         name = asset_name.lower().replace(' ', '_').replace("'", "")
@@ -22,6 +22,7 @@
 from .TexturesOneScraper import TexturesOneMaterialScraper
 from random import choice
 import requests
+from ..sessionHandler import SessionHandler
 
 
 class TexturesOneSearchScraper(TexturesOneMaterialScraper):
@@ -29,6 +30,7 @@ class TexturesOneSearchScraper(TexturesOneMaterialScraper):
     home_url = None  # Prevent double with TexturesOneMaterialScraper in UI
     scraped_type_name = ""
     supported_creators = []
+    cache_ttl = None  # search results are picked randomly
 
     @classmethod
     def findSource(cls, search_term: str) -> str:
@@ -50,7 +52,10 @@ class TexturesOneSearchScraper(TexturesOneMaterialScraper):
         if not url.startswith("http"):
             url = "https://www.3dassets.one" + url
 
-        r = requests.get(url, headers={"User-Agent":"Mozilla/5.0"}, allow_redirects=False)
+        try:
+            r = SessionHandler.getInstance().get(url, allow_redirects=False, timeout=cls.getTimeout(), retries=cls.getRetries())
+        except requests.exceptions.RequestException:
+            return None
         if r.status_code == 200:
             return url
         elif 'Location' in r.headers:
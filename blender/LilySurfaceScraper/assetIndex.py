@@ -0,0 +1,232 @@
+# Copyright (c) 2019 - 2024 Elie Michel
+#
+# This file is part of LilySurfaceScraper, a Blender add-on to import
+# materials from a single URL. It is released under the terms of the GPLv3
+# license. See the LICENSE.md file for the full text.
+
+"""
+Location of the asset directories of a provider, e.g. <texture_dir>/ambientCG.
+
+By default each asset is a direct child of this home directory. With tens of
+thousands of assets, especially on a network drive, a single directory that
+large is slow to list and to look up into, so assets can instead be sharded
+into 256 subdirectories named after the first two hex digits of the SHA-1 of
+their name, e.g. ambientCG/3f/Bricks054. Since assets may also be named
+like that, shards hold a marker file.
+
+An index saved in the home directory maps each asset name to its location,
+so that listing assets reads a single file. It is built by scanning the home
+directory once, the first time it is needed. Assets that are not indexed yet,
+e.g. copied by hand, are still found by looking at both possible locations.
+
+The index is shared by all Blender instances using the texture directory,
+so it is updated under a lock file and replaced atomically.
+
+migrate() moves existing assets to the other layout, leaving symbolic links
+at their former location so that blend files referencing them keep working.
+
+This module must not use the Blender API.
+"""
+
+import hashlib
+import json
+import os
+import re
+import threading
+
+from .fileLock import FileLock, LOCK_SUFFIX
+
+INDEX_NAME = ".assets.json"
+INDEX_VERSION = 1
+
+SHARD_PATTERN = re.compile(r"^[0-9a-f]{2}$")
+SHARD_MARKER = ".shard"
+
+
+def shardOf(asset_name):
+    return hashlib.sha1(asset_name.encode("utf-8")).hexdigest()[:2]
+
+
+def isShardDir(path):
+    """True if the subdirectory of a home directory at path is a shard
+    rather than an asset. Shards created before they were marked are
+    recognized by their content, which only contains assets of this shard."""
+    name = os.path.basename(path)
+    if SHARD_PATTERN.match(name) is None:
+        return False
+    if os.path.isfile(os.path.join(path, SHARD_MARKER)):
+        return True
+    children = [entry.name for entry in AssetIndex._subdirs(path)]
+    return bool(children) and all(shardOf(child) == name for child in children)
+
+
+def markShardDir(path):
+    """Create the marker telling that the directory at path is a shard"""
+    marker = os.path.join(path, SHARD_MARKER)
+    if not os.path.isfile(marker):
+        open(marker, "a").close()
+
+
+class AssetIndex():
+    _instances = {}
+    _instances_lock = threading.Lock()
+
+    @classmethod
+    def getInstance(cls, home_path):
+        """Get the index of the home directory home_path, shared by all threads"""
+        with cls._instances_lock:
+            if home_path not in cls._instances:
+                cls._instances[home_path] = cls(home_path)
+            return cls._instances[home_path]
+
+    def __init__(self, home_path):
+        self.home_path = home_path
+        self.index_path = os.path.join(home_path, INDEX_NAME)
+        self._assets = None  # asset name -> path relative to home_path, using '/'
+        self._mtime = None
+        self._lock = threading.Lock()
+
+    def assetPath(self, asset_name, sharded=False, create=True):
+        """Absolute path of the directory of asset_name. A new asset is placed
+        according to the sharded layout if sharded is True, and recorded in
+        the index if create is True."""
+        with self._lock:
+            self._refresh()
+            relpath = self._assets.get(asset_name)
+            if relpath is None:
+                for candidate in (asset_name, shardOf(asset_name) + "/" + asset_name):
+                    candidate_path = os.path.join(self.home_path, candidate)
+                    if os.path.isdir(candidate_path) and not (candidate == asset_name and isShardDir(candidate_path)):
+                        relpath = candidate
+                        break
+                if relpath is None:
+                    relpath = shardOf(asset_name) + "/" + asset_name if sharded else asset_name
+                if create:
+                    self._record({asset_name: relpath})
+            path = os.path.join(self.home_path, relpath.replace("/", os.path.sep))
+        if create:
+            os.makedirs(path, exist_ok=True)
+            if "/" in relpath:
+                markShardDir(os.path.dirname(path))
+        return path
+
+    def assets(self):
+        """Names of all the assets of the home directory"""
+        with self._lock:
+            self._refresh()
+            return sorted(self._assets.keys())
+
+    def rebuild(self):
+        """Scan the home directory to index it again, e.g. after assets were
+        removed by hand"""
+        with self._lock, FileLock(self.index_path + LOCK_SUFFIX):
+            self._assets = self._scan()
+            self._write(self._assets)
+
+    def migrate(self, sharded, keep_links=True):
+        """Move all the assets to the sharded layout if sharded is True, to
+        the flat one otherwise. Return the list of (old path, new path) of
+        the directories moved."""
+        moves = []
+        os.makedirs(self.home_path, exist_ok=True)
+        with self._lock, FileLock(self.index_path + LOCK_SUFFIX):
+            assets = self._scan()
+            for asset_name, relpath in sorted(assets.items()):
+                target = shardOf(asset_name) + "/" + asset_name if sharded else asset_name
+                if relpath == target:
+                    continue
+                old_path = os.path.join(self.home_path, relpath.replace("/", os.path.sep))
+                new_path = os.path.join(self.home_path, target.replace("/", os.path.sep))
+                if os.path.lexists(new_path):
+                    if not os.path.islink(new_path):
+                        print("Not moving {}: {} already exists".format(old_path, new_path))
+                        continue
+                    os.remove(new_path)  # link left by a previous migration
+                os.makedirs(os.path.dirname(new_path), exist_ok=True)
+                if sharded:
+                    markShardDir(os.path.dirname(new_path))
+                os.rename(old_path, new_path)
+                if keep_links:
+                    try:
+                        os.symlink(os.path.relpath(new_path, os.path.dirname(old_path)), old_path,
+                                   target_is_directory=True)
+                    except OSError:
+                        pass  # e.g. not allowed on Windows
+                assets[asset_name] = target
+                moves.append((old_path, new_path))
+            self._removeEmptyShards()
+            self._assets = assets
+            self._write(assets)
+        return moves
+
+    def _refresh(self):
+        """Load the index if it changed on disk, building it if it does not exist"""
+        try:
+            mtime = os.path.getmtime(self.index_path)
+        except OSError:
+            if self._assets is None or self._mtime is not None:
+                self._assets = self._scan()
+                if os.path.isdir(self.home_path):
+                    self._write(self._assets)
+            return
+        if mtime != self._mtime:
+            self._assets = self._load()
+            self._mtime = mtime
+
+    def _record(self, entries):
+        os.makedirs(self.home_path, exist_ok=True)
+        # the lock file keeps other Blender instances from updating the index meanwhile
+        with FileLock(self.index_path + LOCK_SUFFIX):
+            # reloaded so that assets added by other Blender instances are kept
+            assets = self._load() if os.path.isfile(self.index_path) else self._scan()
+            assets.update(entries)
+            self._assets = assets
+            self._write(assets)
+
+    def _load(self):
+        try:
+            with open(self.index_path, "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return self._scan()
+        if not isinstance(data, dict) or data.get("version") != INDEX_VERSION:
+            return self._scan()
+        return data["assets"]
+
+    def _write(self, assets):
+        os.makedirs(self.home_path, exist_ok=True)
+        tmp_path = "{}.{}.tmp".format(self.index_path, threading.get_ident())
+        with open(tmp_path, "w") as f:
+            json.dump({"version": INDEX_VERSION, "assets": assets}, f)
+        os.replace(tmp_path, self.index_path)
+        self._mtime = os.path.getmtime(self.index_path)
+
+    def _scan(self):
+        """Index the asset directories, in both layouts. Links left by a
+        migration are ignored."""
+        assets = {}
+        for entry in self._subdirs(self.home_path):
+            if isShardDir(entry.path):
+                for asset in self._subdirs(entry.path):
+                    assets[asset.name] = entry.name + "/" + asset.name
+            else:
+                assets.setdefault(entry.name, entry.name)
+        return assets
+
+    def _removeEmptyShards(self):
+        for entry in self._subdirs(self.home_path):
+            if isShardDir(entry.path) and os.listdir(entry.path) == [SHARD_MARKER]:
+                try:
+                    os.remove(os.path.join(entry.path, SHARD_MARKER))
+                    os.rmdir(entry.path)
+                except OSError:
+                    pass
+
+    @staticmethod
+    def _subdirs(directory):
+        try:
+            entries = list(os.scandir(directory))
+        except OSError:
+            return []
+        # hidden directories like the HTTP cache are not assets
+        return [e for e in entries if e.is_dir(follow_symlinks=False) and not e.name.startswith(".")]
@@ -0,0 +1,285 @@
+# Copyright (c) 2019 - 2024 Elie Michel
+#
+# This file is part of LilySurfaceScraper, a Blender add-on to import
+# materials from a single URL. It is released under the terms of the GPLv3
+# license. See the LICENSE.md file for the full text.
+
+import fnmatch
+import os
+import sqlite3
+import threading
+import time
+
+import bpy
+
+from .assetIndex import AssetIndex, isShardDir
+from .contentStore import ContentStore
+from .libraryBundle import listAssetDirectories, exportBundle, importBundle
+from .libraryIndex import LibraryIndex
+from .peerCache import PeerCacheServer, parseNetworks
+from .preferences import getPreferences
+from .settings import TEXTURE_DIR, TEXTURE_QUOTA_CHECK_INTERVAL, LIBRARY_REFRESH_INTERVAL
+from .textureCache import TextureCache, formatSize
+
+
+def getTextureRoot(blend_dir=None):
+    """Absolute path of the texture directory set in preferences. A relative
+    path is relative to blend_dir, by default the directory of the open blend
+    file, and None is returned if it has not been saved yet."""
+    texture_dir = getPreferences().texture_dir
+    if texture_dir == "":
+        texture_dir = TEXTURE_DIR
+    if texture_dir.startswith("//"):
+        texture_dir = texture_dir[2:]
+    if os.path.isabs(texture_dir):
+        return texture_dir
+    if blend_dir is None:
+        if bpy.data.filepath == '':
+            return None
+        blend_dir = os.path.dirname(bpy.data.filepath)
+    return os.path.realpath(os.path.join(blend_dir, texture_dir))
+
+
+def getTextureCache():
+    """Quota manager of the texture directory, with the images of the open
+    blend file and the pinned assets protected from eviction"""
+    pref = getPreferences()
+    root = getTextureRoot()
+    if root is None:
+        return None
+    in_use = [bpy.path.abspath(img.filepath) for img in bpy.data.images if img.filepath]
+    return TextureCache(root, pref.texture_cache_quota * 1024 ** 3, in_use, pref.pinned_assets.split(","))
+
+
+def getSharedStore():
+    """The store shared by all projects, or None if disabled"""
+    pref = getPreferences()
+    if not pref.use_content_store:
+        return None
+    return ContentStore.getInstance(os.path.abspath(os.path.expanduser(pref.content_store_dir)))
+
+
+def cleanTextureCache(home_dirs, dry_run=False):
+    """Enforce the quota of the texture directory, then remove the files of
+    the shared store that are not used anymore, and index the given provider
+    directories again, e.g. after assets were removed by hand. Return a
+    report, as a list of lines, or None if the texture directory is not
+    known. Unlike the automatic quota checks, this scans the whole shared
+    store."""
+    cache = getTextureCache()
+    if cache is None:
+        return None
+    report = enforceQuota(cache, getSharedStore(), dry_run)
+    if not dry_run:
+        for home_dir in home_dirs:
+            home_path = os.path.join(cache.texture_dir, home_dir)
+            if os.path.isdir(home_path):
+                AssetIndex.getInstance(home_path).rebuild()
+    return report
+
+
+def enforceQuota(cache, store=None, dry_run=False):
+    """Same as cleanTextureCache, given the texture cache and the shared
+    store, that is only pruned if given. It does not use the Blender API, so
+    it can run in a worker thread."""
+    report = cache.evict(dry_run)
+    if store is not None:
+        count, size = store.prune(dry_run)
+        if count > 0:
+            report.append("{} {} unused files ({}) from the shared store".format(
+                "Would remove" if dry_run else "Removed", count, formatSize(size)))
+    return report
+
+
+def migrateTextureLibrary(home_dirs):
+    """Move the assets of the given provider directories to the layout set
+    in preferences, and update the images of the open file that pointed to
+    them. Return the number of assets moved, or None if the texture
+    directory is not known."""
+    root = getTextureRoot()
+    if root is None:
+        return None
+    sharded = getPreferences().shard_assets
+    moves = []
+    for home_dir in home_dirs:
+        moves.extend(AssetIndex.getInstance(os.path.join(root, home_dir)).migrate(sharded))
+
+    for img in bpy.data.images:
+        if not img.filepath:
+            continue
+        path = os.path.normpath(bpy.path.abspath(img.filepath))
+        for old_path, new_path in moves:
+            if path.startswith(old_path + os.path.sep):
+                new_filepath = new_path + path[len(old_path):]
+                if img.filepath.startswith("//"):
+                    new_filepath = bpy.path.relpath(new_filepath)
+                img.filepath = new_filepath
+                break
+    return len(moves)
+
+
+def usedAssets(home_dirs):
+    """Names of the assets, as "<home_dir>/<asset>", of which the open file
+    uses images"""
+    root = getTextureRoot()
+    used = set()
+    for img in bpy.data.images:
+        if not img.filepath:
+            continue
+        path = os.path.normpath(bpy.path.abspath(img.filepath))
+        if not path.startswith(root + os.path.sep):
+            continue
+        parts = path[len(root) + 1:].split(os.path.sep)
+        if len(parts) < 3 or parts[0] not in home_dirs:
+            continue
+        asset_name = parts[2] if len(parts) > 3 and isShardDir(os.path.join(root, parts[0], parts[1])) else parts[1]
+        used.add(f"{parts[0]}/{asset_name}")
+    return used
+
+
+def exportLibraryBundle(filepath, home_dirs, only_used=True, patterns=""):
+    """Write a bundle of the assets of the texture directory. only_used
+    restricts it to the assets used by the open file, patterns (comma
+    separated, like 'ambientCG/Bricks*') to the assets matching one of them.
+    Return the number of assets, files and bytes bundled, or None if the
+    texture directory is not known."""
+    root = getTextureRoot()
+    if root is None:
+        return None
+    patterns = [p.strip() for p in patterns.split(",") if p.strip()]
+    used = usedAssets(home_dirs) if only_used else None
+    assets = []
+    for home_dir, asset_name, path in listAssetDirectories(root, home_dirs):
+        name = f"{home_dir}/{asset_name}"
+        if used is not None and name not in used:
+            continue
+        if patterns and not any(fnmatch.fnmatch(name, p) for p in patterns):
+            continue
+        assets.append((home_dir, asset_name, path))
+    file_count, size = exportBundle(filepath, assets)
+    return len(assets), file_count, size
+
+
+def importLibraryBundle(filepath):
+    """Extract a bundle into the texture directory. Return the names of the
+    imported assets, or None if the texture directory is not known."""
+    root = getTextureRoot()
+    if root is None:
+        return None
+    return importBundle(filepath, root, getPreferences().shard_assets)
+
+
+peer_cache_server = None
+peer_cache_config = None  # preferences the server was started with
+
+
+def updatePeerCacheServer():
+    """Start or stop serving the shared store to other workstations,
+    according to preferences"""
+    global peer_cache_server, peer_cache_config
+    pref = getPreferences()
+    enabled = pref.peer_cache_serve and pref.use_content_store
+    root = os.path.abspath(os.path.expanduser(pref.content_store_dir))
+    config = (root, pref.peer_cache_address, pref.peer_cache_port, pref.peer_cache_allowed, pref.peer_cache_secret)
+    if peer_cache_server is not None:
+        if enabled and peer_cache_config == config:
+            return None
+        stopPeerCacheServer()
+    if enabled:
+        if not pref.peer_cache_secret:
+            print("Not sharing downloads with other workstations: no shared secret is set")
+            return None
+        try:
+            peer_cache_server = PeerCacheServer(ContentStore.getInstance(root), pref.peer_cache_port,
+                                                pref.peer_cache_secret, pref.peer_cache_address,
+                                                parseNetworks(pref.peer_cache_allowed))
+        except (OSError, ValueError) as err:
+            print("Could not share downloads on {}:{}: {}".format(pref.peer_cache_address, pref.peer_cache_port, err))
+            return None
+        peer_cache_config = config
+        peer_cache_server.start()
+        print("Sharing downloads with other workstations on {}:{}".format(peer_cache_server.host, peer_cache_server.port))
+    return None  # do not repeat when used as a timer
+
+
+def stopPeerCacheServer():
+    global peer_cache_server
+    if peer_cache_server is not None:
+        peer_cache_server.stop()
+        peer_cache_server = None
+
+
+quota_check_thread = None
+last_quota_check = None  # time.monotonic() when the quota was last checked
+
+
+def checkTextureQuota():
+    """Timer callback enforcing the quota, if any, after textures were
+    loaded. The images in use are listed here, since the Blender API can only
+    be used from the main thread, then the texture directory is scanned and
+    cleaned by a worker thread."""
+    global quota_check_thread, last_quota_check
+    if getPreferences().texture_cache_quota <= 0:
+        return None
+    if quota_check_thread is not None and quota_check_thread.is_alive():
+        return None  # still scanning
+    cache = getTextureCache()
+    if cache is None:
+        return None
+
+    def check():
+        # the shared store is only pruned when cleaning explicitly
+        for line in enforceQuota(cache):
+            print(line)
+
+    last_quota_check = time.monotonic()
+    quota_check_thread = threading.Thread(target=check, name="LilyTextureQuota", daemon=True)
+    quota_check_thread.start()
+    return None  # do not repeat
+
+
+library_refresh_thread = None
+library_changed = False  # set by the worker thread, areas are redrawn from the main thread
+
+
+def refreshLibraryIndex(home_dirs):
+    """Timer callback catching the library index up with the changes made
+    to the texture directory by others. The index is refreshed by a worker
+    thread, so that drawing the asset browser only ever reads it, then the
+    areas are redrawn if anything changed."""
+    global library_refresh_thread, library_changed
+    if library_refresh_thread is not None and library_refresh_thread.is_alive():
+        return 0.5  # poll until it is done
+    if library_changed:
+        library_changed = False
+        for window in bpy.context.window_manager.windows:
+            for area in window.screen.areas:
+                area.tag_redraw()
+    root = getTextureRoot()
+    if root is None:
+        return LIBRARY_REFRESH_INTERVAL
+
+    def refresh():
+        global library_changed
+        index = LibraryIndex.getInstance(root)
+        for home_dir in home_dirs:
+            try:
+                if index.refresh(home_dir):
+                    library_changed = True
+            except (OSError, sqlite3.Error) as err:
+                print("Could not refresh the library index of {}: {}".format(home_dir, err))
+
+    library_refresh_thread = threading.Thread(target=refresh, name="LilyLibraryRefresh", daemon=True)
+    library_refresh_thread.start()
+    return 0.5
+
+
+def scheduleTextureQuotaCheck(delay=5.0):
+    """Check the quota after delay seconds, unless it was checked less than
+    TEXTURE_QUOTA_CHECK_INTERVAL seconds ago, in which case the check is
+    postponed rather than run after each image is loaded"""
+    if bpy.app.timers.is_registered(checkTextureQuota):
+        return
+    if last_quota_check is not None:
+        delay = max(delay, last_quota_check + TEXTURE_QUOTA_CHECK_INTERVAL - time.monotonic())
+    bpy.app.timers.register(checkTextureQuota, first_interval=delay)
@@ -0,0 +1,224 @@
+# Copyright (c) 2019 - 2024 Elie Michel
+#
+# This file is part of LilySurfaceScraper, a Blender add-on to import
+# materials from a single URL. It is released under the terms of the GPLv3
+# license. See the LICENSE.md file for the full text.
+
+"""
+Machine wide store of downloaded texture files, shared by all projects.
+
+The texture directory is relative to the .blend file by default, so without
+it each project downloads its own copy of the same maps. Files are instead
+stored once, under objects/<2 first digits>/<sha256>, and texture directories
+get hard links to them (symbolic links when the store is on another drive,
+copies as a last resort). Identical files, e.g. maps shared by several
+variants, are hence stored only once.
+
+An index maps each URL to the content it served, so that importing an asset
+that another project already imported costs no download at all. For zips,
+the index records the names of all entries and the content of the entries
+that were extracted. Like in the response cache, URLs are only stored hashed.
+
+Files in texture directories may be links to the store: they must never be
+modified in place, only replaced (see ContentStore.link). An object that is
+no longer hard linked from any texture directory is removed by prune(),
+unless symbolic links were ever used since those cannot be counted.
+
+This module must not use the Blender API.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+
+from .fileLock import FileLock, LOCK_SUFFIX
+
+HASH_NAME = "sha256"
+# Present in the store once symbolic links were used
+SYMLINK_MARKER = ".symlinks"
+
+
+def fileDigest(path, hash_name=HASH_NAME):
+    """Hash of the content of a file, by default the one used by the content store"""
+    hasher = hashlib.new(hash_name)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+class ContentStore():
+    _instances = {}
+    _instances_lock = threading.Lock()
+
+    @classmethod
+    def getInstance(cls, root):
+        """Get the store located in root, shared by all threads"""
+        with cls._instances_lock:
+            if root not in cls._instances:
+                cls._instances[root] = cls(root)
+            return cls._instances[root]
+
+    def __init__(self, root):
+        self.root = root
+        self.index_path = os.path.join(root, "index.json")
+        self._lock = threading.Lock()
+        os.makedirs(os.path.join(root, "objects"), exist_ok=True)
+
+    @staticmethod
+    def _key(url):
+        return hashlib.sha1(url.encode("utf-8")).hexdigest()
+
+    def objectPath(self, digest):
+        return os.path.join(self.root, "objects", digest[:2], digest)
+
+    def has(self, digest):
+        return os.path.isfile(self.objectPath(digest))
+
+    # Index
+
+    def lookup(self, url):
+        """Return the index record of url, or None"""
+        return self.lookupKey(self._key(url))
+
+    def lookupKey(self, key):
+        """Same as lookup, given the hash of the url"""
+        with self._lock:
+            return self._loadIndex().get(key)
+
+    def record(self, url, record):
+        self._updateRecord(url, lambda previous: record)
+
+    def _updateRecord(self, url, update):
+        """Replace the record of url with update(previous record or None)"""
+        # the lock file keeps other Blender instances from updating the index meanwhile
+        with self._lock, FileLock(self.index_path + LOCK_SUFFIX):
+            # reloaded so that records added by other Blender instances are kept
+            index = self._loadIndex()
+            key = self._key(url)
+            index[key] = update(index.get(key))
+            tmp_path = "{}.{}.tmp".format(self.index_path, threading.get_ident())
+            with open(tmp_path, "w") as f:
+                json.dump(index, f)
+            os.replace(tmp_path, self.index_path)
+
+    def _loadIndex(self):
+        try:
+            with open(self.index_path, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    # Files
+
+    def add(self, path, digest=None, url=None):
+        """Move the file at path into the store and replace it with a link.
+        digest may be given when it was computed while downloading. If url is
+        given, the index records that it served this content. Return the digest."""
+        if digest is None:
+            digest = fileDigest(path)
+        object_path = self.objectPath(digest)
+        if not os.path.isfile(object_path):
+            os.makedirs(os.path.dirname(object_path), exist_ok=True)
+            try:
+                os.replace(path, object_path)
+            except OSError:
+                # the store is on another drive
+                tmp_path = "{}.{}.tmp".format(object_path, threading.get_ident())
+                shutil.copyfile(path, tmp_path)
+                os.replace(tmp_path, object_path)
+        self.link(digest, path)
+        if url is not None:
+            self.record(url, {"hash": digest, "size": os.path.getsize(object_path)})
+        return digest
+
+    def link(self, digest, path):
+        """Make path point to the stored content digest, replacing any file
+        already at path rather than writing into it, since it may itself be
+        a link to another object."""
+        object_path = self.objectPath(digest)
+        tmp_path = "{}.{}.link".format(path, threading.get_ident())
+        if os.path.lexists(tmp_path):
+            os.remove(tmp_path)
+        try:
+            os.link(object_path, tmp_path)
+        except OSError:
+            try:
+                os.symlink(object_path, tmp_path)
+                open(os.path.join(self.root, SYMLINK_MARKER), "a").close()
+            except OSError:
+                shutil.copyfile(object_path, tmp_path)
+        os.replace(tmp_path, path)
+
+    def prune(self, dry_run=False, min_age=3600):
+        """Remove the objects that no texture directory links to anymore.
+        Objects more recent than min_age seconds are kept, since they may be
+        about to get linked by another Blender instance. Return their number
+        and total size."""
+        if os.path.exists(os.path.join(self.root, SYMLINK_MARKER)):
+            return 0, 0
+        count = 0
+        size = 0
+        for root, _, files in os.walk(os.path.join(self.root, "objects")):
+            for filename in files:
+                path = os.path.join(root, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                if stat.st_nlink > 1 or time.time() - stat.st_mtime < min_age:
+                    continue
+                count += 1
+                size += stat.st_size
+                if not dry_run:
+                    os.remove(path)
+        return count, size
+
+    def linkUrl(self, url, path, size=None):
+        """Fill path with the content previously downloaded from url, if it
+        is in the store and, when size is given, has the expected size.
+        Return True on success."""
+        record = self.lookup(url)
+        if record is None or "hash" not in record or not self.has(record["hash"]):
+            return False
+        if size is not None and record.get("size") != size:
+            return False  # changed upstream
+        self.link(record["hash"], path)
+        return True
+
+    # Zips
+
+    def addZipEntries(self, url, target_dir, names, extracted):
+        """Store the files extracted from the zip at url into target_dir.
+        names: names of all the entries of the zip
+        extracted: paths of the extracted files, relative to target_dir"""
+        added = {relpath: self.add(os.path.join(target_dir, relpath)) for relpath in extracted}
+
+        def update(record):
+            entries = record.get("entries", {}) if record is not None else {}
+            entries.update(added)
+            return {"names": names, "entries": entries}
+
+        self._updateRecord(url, update)
+
+    def linkZipEntries(self, url, target_dir, wanted_paths):
+        """Fill target_dir with entries previously extracted from the zip at
+        url. wanted_paths is a function that, given the names of all the
+        entries of the zip, returns the paths (relative to target_dir) of
+        the files needed. Return these paths, or None if some are missing
+        from the store."""
+        record = self.lookup(url)
+        if record is None or "names" not in record:
+            return None
+        paths = wanted_paths(record["names"])
+        entries = record["entries"]
+        if not all(path in entries and self.has(entries[path]) for path in paths):
+            return None
+        for path in paths:
+            target = os.path.join(target_dir, path)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            self.link(entries[path], target)
+        return paths
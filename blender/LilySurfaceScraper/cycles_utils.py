@@ -11,8 +11,13 @@ from itertools import repeat
 import bpy
 from mathutils import Vector
 
+from .cache_utils import scheduleTextureQuotaCheck
+from .textureCache import markFileUsed
+
 def getCyclesImage(imgpath):
     """Avoid reloading an image that has already been loaded"""
+    if markFileUsed(imgpath):
+        scheduleTextureQuotaCheck()
     for img in bpy.data.images:
         if os.path.abspath(img.filepath) == os.path.abspath(imgpath):
             return img
@@ -0,0 +1,526 @@
+# Copyright (c) 2019 - 2024 Elie Michel
+#
+# This file is part of LilySurfaceScraper, a Blender add-on to import
+# materials from a single URL. It is released under the terms of the GPLv3
+# license. See the LICENSE.md file for the full text.
+
+"""
+Download of texture files. Data is first written to a <path>.part file, that
+is renamed to its final path only once complete, so that a file present at
+the final path is always a complete one. When a .part file is left over by an
+interrupted download, the download resumes from where it stopped using an
+HTTP Range request. The ETag (or Last-Modified date) of the remote file is
+kept next to the .part file, in <path>.part.json, and sent as If-Range so that
+the server restarts from scratch if the file changed in between.
+
+Large files (HDRIs, texture zips) are split into several byte ranges that are
+downloaded in parallel, over several connections, into a preallocated .part
+file. When a download scheduler is given, segments are run as jobs of this
+scheduler, so that they count against the connections allowed to the host.
+The progress of each segment is recorded in <path>.part.json so that
+failed segments are fetched again, from where they stopped, when the download
+is retried. When the server turns out not
+to support ranges, the download falls back to a single stream.
+
+Bodies are read straight into a reusable buffer and written to a file
+preallocated from the Content-Length, and the hash of the file is computed
+in the same pass. Since a preallocated .part file is larger than the data it
+holds, the number of bytes received is saved along with the ETag.
+
+A watchdog aborts transfers whose throughput stays below a floor for too long,
+and interrupted transfers are restarted (hence resumed) after a backoff delay.
+Transfers are only retried here: requests are sent to the session without
+retries, so that a failure is not retried at several levels.
+
+This module must not use the Blender API.
+"""
+
+import concurrent.futures
+import hashlib
+import http.client
+import json
+import os
+import re
+import socket
+import threading
+import time
+
+import requests
+
+from .sessionHandler import backoffDelay, CircuitOpenError, RETRY_STATUSES
+from .downloadScheduler import hostOf, PRIORITY_INTERACTIVE
+from .contentStore import fileDigest, HASH_NAME
+from .settings import (
+    DOWNLOAD_SEGMENTS, SEGMENTED_DOWNLOAD_THRESHOLD,
+    HTTP_RETRIES, STALL_MIN_SPEED, STALL_TIME,
+)
+
+PART_SUFFIX = ".part"
+
+
+def preallocate(f, size):
+    """Reserve size bytes on disk for the file f, open for writing, so that
+    it does not get fragmented while written. This extends the file to size."""
+    if size is None or size <= 0:
+        return
+    try:
+        os.posix_fallocate(f.fileno(), 0, size)
+    except (AttributeError, OSError):
+        # not available on Windows, nor supported by all file systems
+        pass
+
+
+def iterBody(response, chunk_size):
+    """Iterate over the body of a streamed response, reading it directly into
+    a buffer of chunk_size bytes rather than allocating each chunk. The
+    chunks are views of this buffer, so each one must be consumed before
+    asking for the next one."""
+    fp = getattr(response.raw, "_fp", None)  # the http.client response, not buffered by urllib3
+    if response.headers.get("Content-Encoding", "identity") != "identity" or not hasattr(fp, "readinto"):
+        yield from response.iter_content(chunk_size)
+        return
+    view = memoryview(bytearray(chunk_size))
+    while True:
+        try:
+            byte_count = fp.readinto(view)
+        except (http.client.HTTPException, OSError, ValueError) as err:
+            raise requests.exceptions.ConnectionError(err)
+        if not byte_count:
+            if fp.length:
+                # http.client does not raise IncompleteRead from readinto
+                raise requests.exceptions.ConnectionError("Connection closed with {} bytes left".format(fp.length))
+            # let requests notice the end of the body, so that the connection returns to the pool
+            for _ in response.iter_content(chunk_size):
+                pass
+            return
+        yield view[:byte_count]
+
+
+class DownloadError(Exception):
+    pass
+
+
+class TransientDownloadError(DownloadError):
+    """Interrupted or stalled transfer, worth trying again"""
+    pass
+
+
+class RangeNotSupported(DownloadError):
+    pass
+
+
+class StallWatchdog():
+    """Abort a streamed response whose throughput stays below min_speed (in
+    bytes per second) for stall_time seconds. Call feed() with the size of
+    each chunk received."""
+
+    def __init__(self, response, min_speed=STALL_MIN_SPEED, stall_time=STALL_TIME):
+        self.response = response
+        self.min_speed = min_speed
+        self.stall_time = stall_time
+        self.stalled = False
+        self._received = 0
+        self._stop = threading.Event()
+
+    def feed(self, byte_count):
+        self._received += byte_count
+
+    def __enter__(self):
+        if self.stall_time > 0:
+            threading.Thread(target=self._watch, daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self._stop.set()
+
+    def _watch(self):
+        window_start = time.monotonic()
+        window_received = self._received
+        while not self._stop.wait(1.0):
+            now = time.monotonic()
+            if now - window_start < self.stall_time:
+                continue
+            speed = (self._received - window_received) / (now - window_start)
+            if speed < self.min_speed:
+                self.stalled = True
+                self._abort()
+                return
+            window_start = now
+            window_received = self._received
+
+    def _abort(self):
+        # Closing a socket does not wake up a thread blocked reading from it, shutting it down does
+        try:
+            self.response.raw._connection.sock.shutdown(socket.SHUT_RDWR)
+        except (AttributeError, OSError):
+            pass
+        self.response.close()
+
+
+class Downloader():
+    chunk_size = 1 << 20
+    # Progress of segments is saved every time this many bytes were received
+    state_save_interval = 16 << 20
+
+    def __init__(self, session_handler, timeout=None, segments=DOWNLOAD_SEGMENTS, segment_threshold=SEGMENTED_DOWNLOAD_THRESHOLD,
+                 progress_callback=None, retries=HTTP_RETRIES, stall_time=STALL_TIME,
+                 scheduler=None, priority=PRIORITY_INTERACTIVE):
+        """session_handler: the SessionHandler used to send requests
+        timeout: (connect, read) timeouts, in seconds, or None for the session's default
+        segments: maximum number of parallel connections used for a large file
+        segment_threshold: size in bytes above which a file is downloaded in segments
+        progress_callback: function called with the number of bytes received each time a chunk arrives
+        retries: number of times an interrupted or failed transfer is restarted
+        stall_time: seconds of throughput below STALL_MIN_SPEED after which a transfer is restarted (0 to disable)
+        scheduler: the DownloadScheduler through which segments are fetched, None to use threads of their own
+        priority: lane of the scheduler used for segments"""
+        self.session_handler = session_handler
+        self.timeout = timeout
+        self.retries = retries
+        self.stall_time = stall_time
+        self.segments = segments
+        self.segment_threshold = segment_threshold
+        self.progress_callback = progress_callback if progress_callback is not None else lambda byte_count: None
+        self.scheduler = scheduler
+        self.priority = priority
+        self._state_lock = threading.Lock()
+
+    def download(self, url, path):
+        """Download url into path, resuming a previous attempt if any, and
+        return the hash of the file (see contentStore).
+        Raise DownloadError on failure, in which case the partial data is
+        kept for the next attempt."""
+        for attempt in range(self.retries + 1):
+            try:
+                return self._download(url, path)
+            except TransientDownloadError as err:
+                if attempt == self.retries:
+                    raise
+                delay = backoffDelay(attempt)
+                print("{}, retrying in {:.1f}s".format(err, delay))
+                time.sleep(delay)
+
+    def _download(self, url, path, allow_segments=True):
+        part_path = path + PART_SUFFIX
+        state = self._loadState(part_path)
+        has_part = os.path.isfile(part_path)
+
+        if has_part and state is not None and "segments" in state:
+            if not allow_segments:
+                self._discard(part_path)
+                return self._download(url, path, allow_segments)
+            try:
+                self._downloadSegments(url, part_path, state)
+            except RangeNotSupported:
+                return self._fallbackToSingleStream(url, path)
+            return self._finalize(url, part_path, path, state["size"])
+
+        validator = state.get("validator") if state is not None else None
+        offset = os.path.getsize(part_path) if has_part else 0
+        if state is not None and "received" in state:
+            # the part file was preallocated, only this many bytes are valid
+            offset = min(offset, state["received"])
+
+        # Compressed transfers would make sizes and ranges meaningless
+        headers = {"Accept-Encoding": "identity"}
+        if offset > 0 and validator is not None:
+            headers["Range"] = "bytes={}-".format(offset)
+            headers["If-Range"] = validator
+
+        segmented = False
+        # a file written in one go is hashed while it downloads
+        hasher = hashlib.new(HASH_NAME)
+        try:
+            with self.session_handler.get(url, stream=True, headers=headers, timeout=self.timeout, retries=0) as r:
+                total = self._expectedSize(r)
+                if r.status_code == 206 and offset > 0 and self._rangeStart(r) == offset:
+                    print("Resuming download of {} at {} bytes".format(path, offset))
+                    mode = "r+b"
+                    self._hashPrefix(hasher, part_path, offset)
+                elif r.status_code == 200:
+                    mode = "wb"
+                    offset = 0
+                    state = {"validator": self._validator(r), "received": 0}
+                    if allow_segments and self._canSplit(r, total):
+                        state["size"] = total
+                        state["segments"] = self._splitRanges(total)
+                        segmented = True
+                    self._saveState(part_path, state)
+                elif r.status_code in (206, 416) and offset > 0:
+                    # Unexpected range or range not satisfiable: the part file is inconsistent
+                    mode = None
+                elif r.status_code in RETRY_STATUSES:
+                    raise TransientDownloadError("Download of {} failed (HTTP {})".format(url, r.status_code))
+                else:
+                    raise DownloadError("URL not found: {} (HTTP {})".format(url, r.status_code))
+
+                if segmented:
+                    self._preallocate(part_path, total)
+                    # The response to this first request feeds the first segment
+                    self._downloadSegments(url, part_path, state, first_response=r)
+                elif mode is not None:
+                    with open(part_path, mode) as f, StallWatchdog(r, stall_time=self.stall_time) as watchdog:
+                        f.seek(offset)
+                        f.truncate()
+                        preallocate(f, total)
+                        try:
+                            self._writeBody(r, f, hasher, watchdog, part_path, state)
+                        except requests.exceptions.RequestException as err:
+                            self._raiseInterrupted(url, err, watchdog)
+                        finally:
+                            # drop the preallocated space that was not written
+                            f.truncate()
+                            state["received"] = f.tell()
+                            self._saveState(part_path, state)
+        except RangeNotSupported:
+            return self._fallbackToSingleStream(url, path)
+        except CircuitOpenError as err:
+            raise DownloadError("Download of {} skipped: {}".format(url, err))
+        except requests.exceptions.RequestException as err:
+            raise TransientDownloadError("Download of {} interrupted: {}".format(url, err))
+
+        if mode is None:
+            print("Invalid partial download of {}, restarting".format(path))
+            self._discard(part_path)
+            return self._download(url, path, allow_segments)
+
+        return self._finalize(url, part_path, path, total, None if segmented else hasher)
+
+    def _finalize(self, url, part_path, path, total, hasher=None):
+        size = os.path.getsize(part_path)
+        if total is not None and size != total:
+            raise DownloadError("Incomplete download of {}: got {} bytes out of {}".format(url, size, total))
+        # resumed and segmented downloads are hashed once complete
+        digest = hasher.hexdigest() if hasher is not None else fileDigest(part_path)
+        os.replace(part_path, path)
+        self._discardState(part_path)
+        return digest
+
+    def _writeBody(self, response, f, hasher, watchdog, part_path, state):
+        """Write the body of response at the current position of f"""
+        unsaved = 0
+        for chunk in iterBody(response, self.chunk_size):
+            f.write(chunk)
+            hasher.update(chunk)
+            watchdog.feed(len(chunk))
+            self.progress_callback(len(chunk))
+            unsaved += len(chunk)
+            if unsaved >= self.state_save_interval:
+                f.flush()
+                state["received"] = f.tell()
+                self._saveState(part_path, state)
+                unsaved = 0
+        if watchdog.stalled:
+            raise TransientDownloadError("Download of {} stalled".format(response.url))
+
+    @staticmethod
+    def _hashPrefix(hasher, part_path, size):
+        """Feed hasher with the first size bytes of the part file, before
+        resuming its download"""
+        with open(part_path, "rb") as f:
+            while size > 0:
+                chunk = f.read(min(size, 1 << 20))
+                if not chunk:
+                    break
+                hasher.update(chunk)
+                size -= len(chunk)
+
+    def _fallbackToSingleStream(self, url, path):
+        print("Server does not support ranges, downloading {} in a single stream".format(path))
+        self._discard(path + PART_SUFFIX)
+        return self._download(url, path, allow_segments=False)
+
+    # Segmented downloads
+
+    def _canSplit(self, response, total):
+        return (
+            self.segments > 1
+            and total is not None
+            and total >= self.segment_threshold
+            and response.headers.get("Accept-Ranges", "none").lower() == "bytes"
+            and self._validator(response) is not None
+        )
+
+    def _splitRanges(self, total):
+        """Split [0, total) into segments, given as [start, end, received]
+        where end is inclusive"""
+        min_segment_size = max(1, self.segment_threshold // self.segments)
+        count = max(1, min(self.segments, total // min_segment_size))
+        step = -(-total // count)
+        return [[start, min(start + step, total) - 1, 0] for start in range(0, total, step)]
+
+    @staticmethod
+    def _preallocate(part_path, size):
+        with open(part_path, "wb") as f:
+            f.truncate(size)
+            preallocate(f, size)
+
+    def _downloadSegments(self, url, part_path, state, first_response=None):
+        """Fetch all the missing segments in parallel. The segments that
+        failed are fetched again when the whole download is retried.
+        first_response, if provided, is a response to a request starting at
+        the beginning of the file."""
+        pending = [seg for seg in state["segments"] if seg[0] + seg[2] <= seg[1]]
+
+        def fetch(segment, response):
+            try:
+                self._fetchSegment(url, part_path, state, segment, response)
+            except CircuitOpenError as err:
+                raise DownloadError("Download of {} skipped: {}".format(url, err))
+            except requests.exceptions.RequestException as err:
+                raise TransientDownloadError("Segment {}-{} of {} failed: {}".format(segment[0], segment[1], url, err))
+
+        jobs = [(seg, first_response if seg[0] == 0 and seg[2] == 0 else None) for seg in pending]
+        if self.scheduler is not None:
+            errors = self._runScheduled(url, fetch, jobs)
+        else:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, len(jobs))) as executor:
+                futures = [executor.submit(fetch, seg, response) for seg, response in jobs]
+                errors = [f.exception() for f in futures]
+        errors = [err for err in errors if err is not None]
+        self._saveState(part_path, state)
+
+        for err in errors:
+            if isinstance(err, RangeNotSupported):
+                raise err
+        # retrying is useless if any segment failed for good
+        final = [err for err in errors if not isinstance(err, TransientDownloadError)]
+        if errors:
+            raise (final or errors)[0]
+
+    def _runScheduled(self, url, fetch, jobs):
+        """Run fetch(segment, response) for each job, the first one in the
+        calling thread and the others as jobs of the scheduler, that caps the
+        connections to the host. Those that did not start by the time the
+        first one is done are run in the calling thread too, since it may
+        hold the only slot of the host. Return the exception of each job."""
+        futures = [self.scheduler.submit(fetch, seg, response, host=hostOf(url), priority=self.priority)
+                   for seg, response in jobs[1:]]
+        errors = [self._exceptionOf(fetch, *jobs[0])] if jobs else []
+        for (seg, response), future in zip(jobs[1:], futures):
+            if future.cancel():
+                errors.append(self._exceptionOf(fetch, seg, response))
+            else:
+                errors.append(future.exception())
+        return errors
+
+    @staticmethod
+    def _exceptionOf(fn, *args):
+        try:
+            fn(*args)
+        except Exception as err:
+            return err
+        return None
+
+    def _fetchSegment(self, url, part_path, state, segment, response=None):
+        """Download the missing bytes of segment into the part file"""
+        if response is not None:
+            try:
+                return self._writeSegment(response, part_path, state, segment)
+            finally:
+                # the rest of its body belongs to other segments, release the connection now
+                response.close()
+
+        start, end, received = segment
+        headers = {
+            "Accept-Encoding": "identity",
+            "Range": "bytes={}-{}".format(start + received, end),
+            "If-Range": state["validator"],
+        }
+        with self.session_handler.get(url, stream=True, headers=headers, timeout=self.timeout, retries=0) as r:
+            if r.status_code == 200:
+                raise RangeNotSupported("Server ignored range request for {}".format(url))
+            if r.status_code in RETRY_STATUSES:
+                raise TransientDownloadError("Segment {}-{} of {} failed (HTTP {})".format(
+                    start, end, url, r.status_code))
+            if r.status_code != 206 or self._rangeStart(r) != start + received:
+                raise DownloadError("Unexpected response to range request for {} (HTTP {})".format(url, r.status_code))
+            self._writeSegment(r, part_path, state, segment)
+
+    def _writeSegment(self, response, part_path, state, segment):
+        start, end, _ = segment
+        unsaved = 0
+        with open(part_path, "r+b") as f, StallWatchdog(response, stall_time=self.stall_time) as watchdog:
+            f.seek(start + segment[2])
+            try:
+                for chunk in iterBody(response, self.chunk_size):
+                    chunk = chunk[:end + 1 - (start + segment[2])]
+                    f.write(chunk)
+                    watchdog.feed(len(chunk))
+                    self.progress_callback(len(chunk))
+                    segment[2] += len(chunk)
+                    unsaved += len(chunk)
+                    if start + segment[2] > end:
+                        break
+                    if unsaved >= self.state_save_interval:
+                        f.flush()
+                        self._saveState(part_path, state)
+                        unsaved = 0
+            except requests.exceptions.RequestException as err:
+                self._raiseInterrupted(response.url, err, watchdog)
+            finally:
+                f.flush()
+                self._saveState(part_path, state)
+        if start + segment[2] <= end:
+            raise TransientDownloadError("Segment {}-{} ended prematurely".format(start, end))
+
+    # Utils
+
+    @staticmethod
+    def _raiseInterrupted(url, err, watchdog):
+        if watchdog.stalled:
+            raise TransientDownloadError("Download of {} stalled".format(url))
+        raise TransientDownloadError("Download of {} interrupted: {}".format(url, err))
+
+    @staticmethod
+    def _rangeStart(response):
+        match = re.match(r"bytes (\d+)-", response.headers.get("Content-Range", ""))
+        return int(match.group(1)) if match is not None else None
+
+    @staticmethod
+    def _expectedSize(response):
+        """Total size of the remote file, or None if unknown"""
+        if response.headers.get("Content-Encoding", "identity") != "identity":
+            return None
+        if response.status_code == 206:
+            match = re.match(r"bytes \d+-\d+/(\d+)", response.headers.get("Content-Range", ""))
+            return int(match.group(1)) if match is not None else None
+        length = response.headers.get("Content-Length")
+        return int(length) if length is not None and length.isdigit() else None
+
+    @staticmethod
+    def _validator(response):
+        validator = response.headers.get("ETag", response.headers.get("Last-Modified"))
+        # Weak ETags cannot be used in If-Range
+        if validator is None or validator.startswith("W/"):
+            return None
+        return validator
+
+    @staticmethod
+    def _loadState(part_path):
+        try:
+            with open(part_path + ".json", "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _saveState(self, part_path, state):
+        with self._state_lock:
+            if state.get("validator") is None:
+                self._discardState(part_path)
+                return
+            tmp_path = part_path + ".json.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(state, f)
+            os.replace(tmp_path, part_path + ".json")
+
+    @staticmethod
+    def _discardState(part_path):
+        if os.path.isfile(part_path + ".json"):
+            os.remove(part_path + ".json")
+
+    @staticmethod
+    def _discard(part_path):
+        if os.path.isfile(part_path):
+            os.remove(part_path)
+        Downloader._discardState(part_path)
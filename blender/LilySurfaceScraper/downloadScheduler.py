@@ -0,0 +1,187 @@
+# Copyright (c) 2019 - 2024 Elie Michel
+#
+# This file is part of LilySurfaceScraper, a Blender add-on to import
+# materials from a single URL. It is released under the terms of the GPLv3
+# license. See the LICENSE.md file for the full text.
+
+"""
+Process wide scheduler through which all downloads go, whichever scraper or
+operator they come from, so that concurrent imports and thumbnail fetches
+neither overload a single provider nor leave bandwidth unused.
+
+ - At most per_host jobs run at the same time for a given host, and at most
+   `limit` jobs overall.
+ - Jobs are picked by priority lane. Running jobs are never interrupted, but
+   lower lanes (thumbnails) may only use a share of the slots, so
+   that an interactive import always starts right away.
+ - `limit` is tuned AIMD-style from the measured throughput: it grows by one
+   while throughput keeps improving, and shrinks multiplicatively when
+   throughput drops or transfers fail.
+
+This module must not use the Blender API.
+"""
+
+import bisect
+import concurrent.futures
+import itertools
+import threading
+import time
+from collections import defaultdict
+from urllib.parse import urlparse
+
+from .settings import SCHEDULER_MAX_WORKERS, SCHEDULER_PER_HOST
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_THUMBNAIL = 1
+
+
+def hostOf(url):
+    return urlparse(url if "://" in url else "https://" + url).netloc
+
+
+class DownloadScheduler():
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    # Share of the slots that lanes other than interactive may use
+    background_share = 0.5
+    # Duration over which throughput is measured before adapting the limit, in seconds
+    adapt_window = 2.0
+    # Multiplicative decrease factor
+    decrease_factor = 0.5
+
+    @classmethod
+    def getInstance(cls):
+        """Return the process wide scheduler, creating it on first use"""
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    cls._instance = cls()
+        return cls._instance
+
+    def __init__(self, max_workers=SCHEDULER_MAX_WORKERS, per_host=SCHEDULER_PER_HOST, min_workers=2):
+        self.max_workers = max_workers
+        self.min_workers = min_workers
+        self.per_host = per_host
+        self.limit = max(min_workers, max_workers // 2)
+
+        self._cond = threading.Condition()
+        self._queue = []  # sorted list of (priority, seq, job)
+        self._seq = itertools.count()
+        self._running = 0
+        self._running_background = 0
+        self._running_per_host = defaultdict(int)
+        self._local = threading.local()
+
+        self._window_start = time.monotonic()
+        self._window_bytes = 0
+        self._window_errors = 0
+        self._last_throughput = None
+
+        for i in range(max_workers):
+            thread = threading.Thread(target=self._work, name="LilyDownload-{}".format(i), daemon=True)
+            thread.start()
+
+    def submit(self, fn, *args, host=None, priority=PRIORITY_INTERACTIVE, **kwargs):
+        """Schedule fn(*args, **kwargs) and return a concurrent.futures.Future"""
+        future = concurrent.futures.Future()
+        job = (fn, args, kwargs, host, priority, future)
+        with self._cond:
+            bisect.insort(self._queue, (priority, next(self._seq), job))
+            self._cond.notify_all()
+        return future
+
+    def run(self, fn, *args, host=None, priority=PRIORITY_INTERACTIVE, **kwargs):
+        """Run fn(*args, **kwargs) through the scheduler and wait for its result.
+        When called from a job that is already running in the scheduler, fn
+        is run directly in the same slot to avoid deadlocks."""
+        if getattr(self._local, "in_job", False):
+            try:
+                return fn(*args, **kwargs)
+            except Exception:
+                self.recordError()
+                raise
+        return self.submit(fn, *args, host=host, priority=priority, **kwargs).result()
+
+    def recordBytes(self, byte_count):
+        """Report bytes received by a job, used to measure throughput"""
+        with self._cond:
+            self._window_bytes += byte_count
+
+    def recordError(self):
+        with self._cond:
+            self._window_errors += 1
+
+    def _pickJob(self):
+        """Pop the first job, in priority order, that can start now"""
+        if self._running >= self.limit:
+            return None
+        background_limit = max(1, int(self.limit * self.background_share))
+        for i, (priority, _, job) in enumerate(self._queue):
+            host = job[3]
+            if host is not None and self._running_per_host[host] >= self.per_host:
+                continue
+            if priority != PRIORITY_INTERACTIVE and self._running_background >= background_limit:
+                continue
+            del self._queue[i]
+            return job
+        return None
+
+    def _work(self):
+        while True:
+            with self._cond:
+                job = self._pickJob()
+                while job is None:
+                    self._cond.wait()
+                    job = self._pickJob()
+                fn, args, kwargs, host, priority, future = job
+                self._acquire(host, priority, +1)
+
+            if future.set_running_or_notify_cancel():
+                self._local.in_job = True
+                try:
+                    future.set_result(fn(*args, **kwargs))
+                except BaseException as err:
+                    self.recordError()
+                    future.set_exception(err)
+                finally:
+                    self._local.in_job = False
+
+            with self._cond:
+                self._acquire(host, priority, -1)
+                self._adapt()
+                self._cond.notify_all()
+
+    def _acquire(self, host, priority, delta):
+        self._running += delta
+        if priority != PRIORITY_INTERACTIVE:
+            self._running_background += delta
+        if host is not None:
+            self._running_per_host[host] += delta
+            if self._running_per_host[host] == 0:
+                del self._running_per_host[host]
+
+    def _adapt(self):
+        """Additive increase / multiplicative decrease of the concurrency limit"""
+        now = time.monotonic()
+        elapsed = now - self._window_start
+        if elapsed < self.adapt_window:
+            return
+
+        throughput = self._window_bytes / elapsed
+        saturated = len(self._queue) > 0
+        if self._window_errors > 0:
+            self.limit = max(self.min_workers, int(self.limit * self.decrease_factor))
+        elif saturated and self._last_throughput is not None:
+            if throughput > self._last_throughput * 1.05:
+                self.limit = min(self.max_workers, self.limit + 1)
+            elif throughput < self._last_throughput * 0.8:
+                self.limit = max(self.min_workers, int(self.limit * self.decrease_factor))
+        elif saturated:
+            self.limit = min(self.max_workers, self.limit + 1)
+
+        # Throughput is only meaningful when there was work waiting
+        self._last_throughput = throughput if saturated else None
+        self._window_start = now
+        self._window_bytes = 0
+        self._window_errors = 0
@@ -0,0 +1,114 @@
+# Copyright (c) 2019 - 2024 Elie Michel
+#
+# This file is part of LilySurfaceScraper, a Blender add-on to import
+# materials from a single URL. It is released under the terms of the GPLv3
+# license. See the LICENSE.md file for the full text.
+
+"""
+Manifest of the maps extracted from a texture zip into a variant directory.
+
+Once an extraction is complete, the manifest records the map type, file name,
+size and modification time of each map, so that importing the variant again
+reads this single small file instead of listing the directory and telling
+maps apart again. Maps that were modified or removed since then invalidate it.
+
+The manifest is written, incomplete, before anything gets extracted. Entries
+are extracted to a temporary file then renamed, so a file of the directory
+more recent than an incomplete manifest is a fully extracted entry and an
+interrupted extraction can resume with the entries that are missing.
+
+The manifest is always replaced atomically, never modified in place.
+
+This module must not use the Blender API.
+"""
+
+import json
+import os
+import threading
+
+MANIFEST_NAME = ".manifest.json"
+MANIFEST_VERSION = 1
+
+
+class ExtractionManifest():
+    def __init__(self, directory):
+        """directory: variant directory into which the zip is extracted"""
+        self.directory = directory
+        self.path = os.path.join(directory, MANIFEST_NAME)
+
+    def load(self):
+        """Return the content of the manifest, None if missing or unreadable"""
+        try:
+            with open(self.path, "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not isinstance(data, dict) or data.get("version") != MANIFEST_VERSION:
+            return None
+        return data
+
+    def maps(self, url):
+        """Return the maps extracted from the zip at url, as a dict mapping
+        map types to absolute paths, or None if the extraction is not
+        complete or a map file changed since."""
+        data = self.load()
+        if data is None or not data.get("complete") or data.get("url") != url:
+            return None
+        maps = {}
+        for map_type, entry in data["maps"].items():
+            path = os.path.join(self.directory, entry["file"])
+            try:
+                stat = os.stat(path)
+            except OSError:
+                return None
+            if stat.st_size != entry["size"] or stat.st_mtime != entry["mtime"]:
+                return None
+            maps[map_type] = path
+        return maps
+
+    def isIncomplete(self):
+        """True if an extraction was started in the directory and did not end"""
+        data = self.load()
+        return data is not None and not data.get("complete")
+
+    def begin(self, url, restart=False):
+        """Record that the extraction of the zip at url starts, unless an
+        interrupted extraction of the same zip can be resumed. Return True
+        when resuming."""
+        data = self.load()
+        if not restart and data is not None and not data.get("complete") and data.get("url") == url:
+            return True
+        self._write({"version": MANIFEST_VERSION, "url": url, "complete": False, "maps": {}})
+        return False
+
+    def isExtracted(self, relpath):
+        """True if the entry extracted at relpath was fully written during
+        the current extraction"""
+        try:
+            return os.path.getmtime(os.path.join(self.directory, relpath)) >= os.path.getmtime(self.path)
+        except OSError:
+            return False
+
+    def complete(self, url, maps):
+        """Record the end of the extraction. maps: dict mapping map types to
+        paths relative to the directory. Return them as absolute paths."""
+        entries = {}
+        for map_type, relpath in maps.items():
+            stat = os.stat(os.path.join(self.directory, relpath))
+            entries[map_type] = {"file": relpath, "size": stat.st_size, "mtime": stat.st_mtime}
+        self._write({"version": MANIFEST_VERSION, "url": url, "complete": True, "maps": entries})
+        return {map_type: os.path.join(self.directory, relpath) for map_type, relpath in maps.items()}
+
+    def refresh(self):
+        """Record the current size and date of the maps of a complete
+        extraction, after they were copied from elsewhere"""
+        data = self.load()
+        if data is None or not data.get("complete"):
+            return
+        self.complete(data["url"], {map_type: entry["file"] for map_type, entry in data["maps"].items()})
+
+    def _write(self, data):
+        tmp_path = "{}.{}.tmp".format(self.path, threading.get_ident())
+        with open(tmp_path, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,140 @@
+# Copyright (c) 2019 - 2024 Elie Michel
+#
+# This file is part of LilySurfaceScraper, a Blender add-on to import
+# materials from a single URL. It is released under the terms of the GPLv3
+# license. See the LICENSE.md file for the full text.
+
+"""
+Lock files coordinating Blender instances, possibly on different machines,
+that share a texture directory (e.g. over NFS). When a scene opens on many
+render nodes at once, a single node downloads each file while the others
+wait for the lock, then reuse the finished file.
+
+A lock is a file created with O_EXCL, holding the owner's host, pid and a
+random token. The owner renews a lease on it by touching it regularly. A lock
+whose modification time did not change for a whole lease, as observed by the
+waiter itself so that clocks of different machines need not agree, belongs
+to a crashed owner and is broken. On the same machine, the lock of a process
+that no longer exists is broken right away.
+
+This module must not use the Blender API.
+"""
+
+import json
+import os
+import random
+import socket
+import threading
+import time
+import uuid
+
+from .settings import LOCK_LEASE, LOCK_POLL_INTERVAL
+
+LOCK_SUFFIX = ".lock"
+
+
+class FileLock():
+    def __init__(self, path, lease=LOCK_LEASE, poll_interval=LOCK_POLL_INTERVAL):
+        """path: path of the lock file
+        lease: seconds after which a lock that is not renewed is considered stale"""
+        self.path = path
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self.token = uuid.uuid4().hex
+        # True if the lock was held by someone else when acquire() was called
+        self.waited = False
+        self._stop_renewing = threading.Event()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+    def acquire(self):
+        observed = None  # (mtime, token) of the lock held by someone else, and when it was first seen
+        while not self._tryCreate():
+            self.waited = True
+            owner = self._readOwner()
+            try:
+                mtime = os.path.getmtime(self.path)
+            except OSError:
+                continue  # just released
+            if observed is None or observed[0] != (mtime, owner.get("token")):
+                observed = ((mtime, owner.get("token")), time.monotonic())
+            if time.monotonic() - observed[1] > self.lease or self._ownerIsDead(owner):
+                print("Breaking stale lock {}".format(self.path))
+                self._breakStale(owner.get("token"))
+                observed = None
+                continue
+            time.sleep(self.poll_interval * random.uniform(0.5, 1.5))
+
+        threading.Thread(target=self._renew, daemon=True).start()
+
+    def release(self):
+        self._stop_renewing.set()
+        if self._readOwner().get("token") == self.token:
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+    def _tryCreate(self):
+        try:
+            fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, "w") as f:
+            json.dump({"host": socket.gethostname(), "pid": os.getpid(), "token": self.token}, f)
+        return True
+
+    def _readOwner(self):
+        try:
+            with open(self.path, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            # the owner may not have written it yet
+            return {}
+
+    def _renew(self):
+        while not self._stop_renewing.wait(self.lease / 4):
+            try:
+                os.utime(self.path)
+            except OSError:
+                pass
+
+    @staticmethod
+    def _ownerIsDead(owner):
+        if owner.get("host") != socket.gethostname() or "pid" not in owner or os.name == "nt":
+            return False
+        try:
+            os.kill(owner["pid"], 0)
+        except ProcessLookupError:
+            return True
+        except OSError:
+            pass
+        return False
+
+    def _breakStale(self, stale_token):
+        """Remove the lock if it still is the stale one"""
+        moved_path = "{}.stale-{}".format(self.path, self.token)
+        try:
+            os.rename(self.path, moved_path)
+        except OSError:
+            return  # already broken by another waiter
+        try:
+            with open(moved_path, "r") as f:
+                token = json.load(f).get("token")
+        except (OSError, ValueError):
+            token = None
+        if token is not None and token != stale_token:
+            # another waiter broke it and took the lock in between: give it back
+            try:
+                os.link(moved_path, self.path)
+            except OSError:
+                pass
+        try:
+            os.remove(moved_path)
+        except OSError:
+            pass
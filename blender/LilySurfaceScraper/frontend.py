@@ -5,6 +5,7 @@
 # license. See the LICENSE.md file for the full text.
 
 import os
+import tarfile
 import bpy
 
 from .CyclesLightData import CyclesLightData
@@ -12,9 +13,13 @@ from .CyclesMaterialData import CyclesMaterialData
 from .CyclesWorldData import CyclesWorldData
 from .ScrapersManager import ScrapersManager
 from .callback import get_callback
-from .metadataHandler import Metadata
+from .cache_utils import cleanTextureCache, migrateTextureLibrary, exportLibraryBundle, importLibraryBundle
+from .cache_utils import updatePeerCacheServer, stopPeerCacheServer, refreshLibraryIndex
+from .libraryBundle import BundleError, BUNDLE_EXTENSION
+from .textureCache import formatSize
 from .preferences import getPreferences
 import bpy.utils.previews
+from bpy_extras.io_utils import ExportHelper, ImportHelper
 from bpy.props import EnumProperty
 
 
@@ -29,9 +34,6 @@ internal_states = {}
 registeredThumbnails = set()
 custom_icons = bpy.utils.previews.new()
 
-# spam prevention measure
-metadataGetFailed = list()
-
 
 class PopupOperator(bpy.types.Operator):
     bl_options = {'REGISTER', 'UNDO'}
@@ -190,6 +192,13 @@ class OBJECT_OT_LilySurfacePromptVariant(ObjectPopupOperator, CallbackProps):
         options={"SKIP_SAVE"}
     )
 
+    resync: bpy.props.BoolProperty(
+        name="Re-sync Texture",
+        description="Download again only the maps that changed on the provider's side since they were downloaded",
+        default=False,
+        options={"SKIP_SAVE"}
+    )
+
     internal_state: bpy.props.StringProperty(
         name="Internal State",
         description="System property used to transfer the state of the operator",
@@ -210,6 +219,7 @@ class OBJECT_OT_LilySurfacePromptVariant(ObjectPopupOperator, CallbackProps):
     def execute(self, context):
         data = internal_states[self.internal_state]
         data.setReinstall(bool(self.reisntall))
+        data.setResync(bool(self.resync))
         if data.selectVariant(int(self.variant)):
             if self.create_material:
                 mat = data.createMaterial()
@@ -357,6 +367,13 @@ class OBJECT_OT_LilyWorldPromptVariant(PopupOperator, CallbackProps):
         options={"SKIP_SAVE"}
     )
 
+    resync: bpy.props.BoolProperty(
+        name="Re-sync Texture",
+        description="Download again only the maps that changed on the provider's side since they were downloaded",
+        default=False,
+        options={"SKIP_SAVE"}
+    )
+
     internal_state: bpy.props.StringProperty(
         name="Internal State",
         description="System property used to transfer the state of the operator",
@@ -377,6 +394,7 @@ class OBJECT_OT_LilyWorldPromptVariant(PopupOperator, CallbackProps):
     def execute(self, context):
         data = internal_states[self.internal_state]
         data.setReinstall(bool(self.reisntall))
+        data.setResync(bool(self.resync))
         if data.selectVariant(int(self.variant)):
             if self.create_world:
                 world = data.createWorld()
@@ -476,6 +494,7 @@ class MATERIAL_PT_LilySurfaceScraper(bpy.types.Panel):
             layout.operator("object.lily_surface_import")
             layout.operator("object.lily_surface_import_from_clipboard")
             layout.label(text="Available sources:")
+            layout.prop(context.scene, "lily_asset_search", text="", icon='VIEWZOOM')
             urls = {None}  # avoid doubles
             for S in ScrapersManager.getScrapersList():
                 if 'MATERIAL' in S.scraped_type and S.home_url not in urls:
@@ -512,6 +531,7 @@ class WORLD_PT_LilySurfaceScraper(bpy.types.Panel):
             layout.operator("object.lily_world_import")
             layout.operator("object.lily_world_import_from_clipboard")
             layout.label(text="Available sources:")
+            layout.prop(context.scene, "lily_asset_search", text="", icon='VIEWZOOM')
             urls = {None}  # avoid doubles
             for S in ScrapersManager.getScrapersList():
                 if 'WORLD' in S.scraped_type and S.home_url not in urls:
@@ -553,6 +573,7 @@ class LIGHT_PT_LilySurfaceScraper(bpy.types.Panel):
             layout.operator("object.lily_light_import")
             layout.operator("object.lily_light_import_from_clipboard")
             layout.label(text="Available sources:")
+            layout.prop(context.scene, "lily_asset_search", text="", icon='VIEWZOOM')
             urls = {None}  # avoid doubles
             for S in ScrapersManager.getScrapersList():
                 if 'LIGHT' in S.scraped_type and S.home_url not in urls:
@@ -576,7 +597,8 @@ class LIGHT_PT_LilySurfaceScraper(bpy.types.Panel):
 
 def thumbnailGeneratorGenerator(scraper_cls):
     """
-    TODO: It is bad design to have Blender halt for downloading metadata while drawing the UI
+    Assets are listed from the library index, so that drawing the UI never
+    reads metadata files nor downloads anything
     """
     def generateThumbnailIcon(self, context):
         global custom_icons
@@ -595,46 +617,33 @@ def thumbnailGeneratorGenerator(scraper_cls):
             missingThumb = os.path.join(__file__, "Data", "missing_thumbnail.jpg")
             custom_icons.load("missing_thumbnail", missingThumb, 'IMAGE')
 
-        basedir = scraper.getTextureDirectory(scraper_cls.home_dir)
+        assets = scraper.listLibrary()
+        query = bpy.context.scene.lily_asset_search.strip()
+        if query:
+            by_name = {asset.asset: asset for asset in assets}
+            assets = [by_name[i] for i in scraper.searchLibrary(query) if i in by_name]
 
-        # iterate over assets in scrapers home dir
-        for i in os.listdir(basedir):
-            # these ones dont have a metadata file, so they will be fetched using the local scraper
-            if i in metadataGetFailed:
-                registeredThumbnails.add(i)
-                # it has a different name in case I give it a different thumbnail later, it will just default to missing
-                items[i] = "local_thumbnail"  # todo check for local thumbs
-                continue
-
-            if not os.path.isdir(os.path.join(basedir, i)):
-                continue
+        # iterate over assets in scrapers home dir, as recorded in the library index
+        for asset in assets:
+            i = asset.asset
             name = f"thumb_{scraper_cls.__name__}-{i.replace(' ', '_')}"
             if i in registeredThumbnails:
                 items[i] = name
                 continue
 
-            # get metadata
-            metadata_file = os.path.join(basedir, i, scraper_cls.metadata_filename)
-            metadata = Metadata.open(metadata_file)
-            # if no metadata file was found
-            if metadata.name == "":
-                # try to get info
-                print(f"No metadata ('{metadata_file}' not found)! getting for {i}")
-                scraper.getVariantData(i)
-                # if its still empty then just skip this
-                if scraper.metadata.name == "":
-                    print(f"!! failed to get metadata for {i} from {scraper.home_url} !!")
-                    metadataGetFailed.append(i)
-                    continue
-                metadata = scraper.metadata
-            thumb_name = metadata.thumbnail
-
-            if thumb_name is None:
+            # these ones dont have metadata, so they will be fetched using the local scraper
+            if not asset.name:
+                registeredThumbnails.add(i)
+                # it has a different name in case I give it a different thumbnail later, it will just default to missing
+                items[i] = "local_thumbnail"  # todo check for local thumbs
+                continue
+
+            if asset.thumbnail is None:
                 print("missing thumbnail", name)
                 registeredThumbnails.add(i)
                 items[i] = "missing_thumbnail"
                 continue
-            thumbnail = os.path.join(basedir, i, thumb_name)
+            thumbnail = os.path.join(scraper.getAssetDirectory(i, create=False), asset.thumbnail)
 
             registeredThumbnails.add(i)
             custom_icons.load(name, thumbnail, 'IMAGE')
@@ -654,6 +663,12 @@ def thumbnailGeneratorGenerator(scraper_cls):
     return generateThumbnailIcon
 
 
+def updateAssetSearch(self, context):
+    # list the matching assets again, for the panels to know which sources have some
+    for S in ScrapersManager.getScrapersList():
+        thumbnailGeneratorGenerator(S)(self, context)
+
+
 # to prevent it from spamming lights or other things with only 1 variant
 running = True
 
@@ -673,31 +688,124 @@ def enumResponseGenerator(scraper_cls):
 
         print(f"choose texture {scraper_cls.home_dir} / {asset}")
 
-        basedir = scraper.getTextureDirectory(scraper_cls.home_dir)
-
-        item_path = os.path.join(basedir, asset)
+        entry = scraper.getLibraryIndex().asset(scraper_cls.home_dir, asset)
 
-        metadata_file = os.path.join(item_path, scraper_cls.metadata_filename)
-        metadata = Metadata.open(metadata_file)
-
-        # use the local scraper
-        if not metadata.name:
-            metadata.fetchUrl = item_path
-            metadata.name = "LOCAL_FILE_SCRAPER-SUBDIR"
+        if entry is not None and entry.name:
+            url, name = entry.fetch_url, entry.name
+        else:
+            # use the local scraper
+            url, name = scraper.getAssetDirectory(asset, create=False), "LOCAL_FILE_SCRAPER-SUBDIR"
 
         # get material
         if "LIGHT" in scraper_cls.scraped_type:
-            bpy.ops.object.lily_light_import('EXEC_DEFAULT', url=metadata.fetchUrl, name=metadata.name)
+            bpy.ops.object.lily_light_import('EXEC_DEFAULT', url=url, name=name)
         elif 'MATERIAL' in scraper_cls.scraped_type:
-            bpy.ops.object.lily_surface_import('EXEC_DEFAULT', url=metadata.fetchUrl, name=metadata.name)
+            bpy.ops.object.lily_surface_import('EXEC_DEFAULT', url=url, name=name)
         elif 'WORLD' in scraper_cls.scraped_type:
-            bpy.ops.object.lily_world_import('EXEC_DEFAULT', url=metadata.fetchUrl, name=metadata.name)
+            bpy.ops.object.lily_world_import('EXEC_DEFAULT', url=url, name=name)
 
         running = True
 
     return enumResult
 
 
+# -------------------------------------------------------------------
+### Texture cache
+
+class OBJECT_OT_LilyCleanTextureCache(bpy.types.Operator):
+    """Remove the least recently used variants until the texture directory fits in its quota, and index the assets again"""
+    bl_idname = "object.lily_clean_texture_cache"
+    bl_label = "Clean Texture Directory"
+
+    dry_run: bpy.props.BoolProperty(
+        name="Dry Run",
+        description="Only list what would be removed",
+        default=True,
+    )
+
+    def execute(self, context):
+        report = cleanTextureCache(providerHomeDirs(), self.dry_run)
+        if report is None:
+            self.report({'ERROR'}, 'You must save the file to locate a relative texture directory')
+            return {'CANCELLED'}
+        for line in report:
+            print(line)
+        self.report({'INFO'}, report[-1])
+        return {'FINISHED'}
+
+
+class OBJECT_OT_LilyMigrateTextureLibrary(bpy.types.Operator):
+    """Move the downloaded assets to the directory layout set in preferences (sharded or not)"""
+    bl_idname = "object.lily_migrate_texture_library"
+    bl_label = "Migrate Library"
+
+    def execute(self, context):
+        count = migrateTextureLibrary(providerHomeDirs())
+        if count is None:
+            self.report({'ERROR'}, 'You must save the file to locate a relative texture directory')
+            return {'CANCELLED'}
+        self.report({'INFO'}, f"Moved {count} assets")
+        return {'FINISHED'}
+
+
+def providerHomeDirs():
+    return sorted({s.home_dir for s in ScrapersManager.getScrapersList() if s.home_dir})
+
+
+def refreshLibraryIndexTimer():
+    return refreshLibraryIndex(providerHomeDirs())
+
+
+class OBJECT_OT_LilyExportBundle(bpy.types.Operator, ExportHelper):
+    """Pack downloaded assets into a bundle, to import them on computers without internet access"""
+    bl_idname = "object.lily_export_bundle"
+    bl_label = "Export Texture Bundle"
+
+    filename_ext = BUNDLE_EXTENSION
+    filter_glob: bpy.props.StringProperty(default="*" + BUNDLE_EXTENSION, options={'HIDDEN'})
+
+    only_used: bpy.props.BoolProperty(
+        name="Only Used Assets",
+        description="Only bundle the assets of which the open file uses images",
+        default=True,
+    )
+
+    patterns: bpy.props.StringProperty(
+        name="Assets",
+        description="Only bundle the assets matching one of these comma separated patterns, like 'ambientCG/Bricks*' (empty for all)",
+        default="",
+    )
+
+    def execute(self, context):
+        result = exportLibraryBundle(self.filepath, providerHomeDirs(), self.only_used, self.patterns)
+        if result is None:
+            self.report({'ERROR'}, 'You must save the file to locate a relative texture directory')
+            return {'CANCELLED'}
+        asset_count, file_count, size = result
+        self.report({'INFO'}, f"Bundled {asset_count} assets ({file_count} files, {formatSize(size)})")
+        return {'FINISHED'}
+
+
+class OBJECT_OT_LilyImportBundle(bpy.types.Operator, ImportHelper):
+    """Add the assets of a bundle to the texture directory"""
+    bl_idname = "object.lily_import_bundle"
+    bl_label = "Import Texture Bundle"
+
+    filename_ext = BUNDLE_EXTENSION
+    filter_glob: bpy.props.StringProperty(default="*" + BUNDLE_EXTENSION, options={'HIDDEN'})
+
+    def execute(self, context):
+        try:
+            assets = importLibraryBundle(self.filepath)
+        except (BundleError, OSError, tarfile.TarError) as err:
+            self.report({'ERROR'}, str(err))
+            return {'CANCELLED'}
+        if assets is None:
+            self.report({'ERROR'}, 'You must save the file to locate a relative texture directory')
+            return {'CANCELLED'}
+        self.report({'INFO'}, f"Imported {len(assets)} assets")
+        return {'FINISHED'}
+
 ## Registration
 
 classes = (
@@ -715,9 +823,14 @@ classes = (
     MATERIAL_PT_LilySurfaceScraper,
     WORLD_PT_LilySurfaceScraper,
     LIGHT_PT_LilySurfaceScraper,
+
+    OBJECT_OT_LilyCleanTextureCache,
+    OBJECT_OT_LilyMigrateTextureLibrary,
+    OBJECT_OT_LilyExportBundle,
+    OBJECT_OT_LilyImportBundle,
 )
 
-rregister, unregister = bpy.utils.register_classes_factory(classes)
+rregister, runregister = bpy.utils.register_classes_factory(classes)
 
 def register():
     global custom_icons
@@ -727,3 +840,22 @@ def register():
         setattr(custom_icons, S.__name__, ())
         setattr(bpy.types.Scene, S.__name__, EnumProperty(options={"SKIP_SAVE"}, items=thumbnailGeneratorGenerator(S),
                                                            update=enumResponseGenerator(S)))
+    bpy.types.Scene.lily_asset_search = bpy.props.StringProperty(
+        name="Search",
+        description="Only show the downloaded assets matching these words (name, id or tags)",
+        options={"SKIP_SAVE", "TEXTEDIT_UPDATE"},
+        update=updateAssetSearch,
+    )
+    # preferences may not be available yet while the add-on is being enabled
+    bpy.app.timers.register(updatePeerCacheServer, first_interval=1.0)
+    # kept across files, that may have their own texture directory
+    bpy.app.timers.register(refreshLibraryIndexTimer, first_interval=1.0, persistent=True)
+
+
+def unregister():
+    if bpy.app.timers.is_registered(updatePeerCacheServer):
+        bpy.app.timers.unregister(updatePeerCacheServer)
+    if bpy.app.timers.is_registered(refreshLibraryIndexTimer):
+        bpy.app.timers.unregister(refreshLibraryIndexTimer)
+    stopPeerCacheServer()
+    runregister()
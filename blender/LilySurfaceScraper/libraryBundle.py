@@ -0,0 +1,188 @@
+# Copyright (c) 2019 - 2024 Elie Michel
+#
+# This file is part of LilySurfaceScraper, a Blender add-on to import
+# materials from a single URL. It is released under the terms of the GPLv3
+# license. See the LICENSE.md file for the full text.
+
+"""
+Bundles of downloaded assets, to stage them on machines without internet
+access such as render farm nodes.
+
+A bundle is an uncompressed tar archive (textures are compressed already)
+holding, for each asset, its directory as found in the texture directory:
+metadata, thumbnail, variants and extraction manifests. Its first member,
+bundle.json, indexes the assets and the size of their files. Assets are
+stored as <home_dir>/<asset>/..., whatever the layout (see assetIndex) of
+the texture directory they come from or are imported into.
+
+Both export and import stream the archive, one file at a time, so bundles
+larger than the available memory are fine. Imported files are written next
+to their target then renamed, like downloads, so that files that may be
+links to the shared store are replaced rather than overwritten.
+
+Once imported, assets are found by the scrapers as if they had been
+downloaded on this machine, so that importing them requires no network.
+
+This module must not use the Blender API.
+"""
+
+import io
+import json
+import os
+import shutil
+import tarfile
+import threading
+import time
+
+from .assetIndex import AssetIndex
+from .extractionManifest import ExtractionManifest, MANIFEST_NAME
+
+BUNDLE_INDEX = "bundle.json"
+BUNDLE_VERSION = 1
+BUNDLE_EXTENSION = ".lilybundle"
+
+# Files that are specific to a machine or to an ongoing operation
+EXCLUDED_SUFFIXES = (".part", ".part.json", ".tmp", ".lock", ".link")
+EXCLUDED_NAMES = (".last_used",)
+
+
+class BundleError(Exception):
+    pass
+
+
+def listAssetDirectories(texture_dir, home_dirs):
+    """List the (home_dir, asset name, directory) of all the assets
+    downloaded into texture_dir, for the given provider directories"""
+    assets = []
+    for home_dir in home_dirs:
+        index = AssetIndex.getInstance(os.path.join(texture_dir, home_dir))
+        for asset_name in index.assets():
+            path = index.assetPath(asset_name, create=False)
+            if os.path.isdir(path):
+                assets.append((home_dir, asset_name, path))
+    return assets
+
+
+def exportBundle(bundle_path, assets, progress_callback=None):
+    """Write the assets, given as (home_dir, asset name, directory), to a
+    bundle. progress_callback, if given, is called with the number of bytes
+    written after each file. Return the number of files and their total size."""
+    entries = []
+    index = {"version": BUNDLE_VERSION, "created": time.time(), "assets": []}
+    for home_dir, asset_name, path in assets:
+        files = _assetFiles(path)
+        index["assets"].append({
+            "home_dir": home_dir,
+            "name": asset_name,
+            "files": {relpath: size for relpath, _, size in files},
+        })
+        entries.extend(("{}/{}/{}".format(home_dir, asset_name, relpath), file_path) for relpath, file_path, _ in files)
+
+    tmp_path = "{}.{}.tmp".format(bundle_path, threading.get_ident())
+    total = 0
+    with open(tmp_path, "wb") as f, tarfile.open(fileobj=f, mode="w|", format=tarfile.PAX_FORMAT) as tar:
+        data = json.dumps(index, indent=1).encode("utf-8")
+        info = tarfile.TarInfo(BUNDLE_INDEX)
+        info.size = len(data)
+        info.mtime = index["created"]
+        tar.addfile(info, io.BytesIO(data))
+
+        for arcname, file_path in entries:
+            # always stored as regular files: links to the shared store are dereferenced
+            with open(file_path, "rb") as source:
+                stat = os.fstat(source.fileno())
+                info = tarfile.TarInfo(arcname)
+                info.size = stat.st_size
+                info.mtime = stat.st_mtime
+                info.mode = 0o644
+                tar.addfile(info, source)
+            total += stat.st_size
+            if progress_callback is not None:
+                progress_callback(stat.st_size)
+    os.replace(tmp_path, bundle_path)
+    return len(entries), total
+
+
+def importBundle(bundle_path, texture_dir, sharded=False, progress_callback=None):
+    """Extract a bundle into texture_dir, placing new assets according to
+    the sharded layout if sharded is True. Files already present with the
+    same size and date are kept. Return the names of the imported assets,
+    as "<home_dir>/<asset>"."""
+    asset_dirs = {}
+    written = []
+    with open(bundle_path, "rb") as f, tarfile.open(fileobj=f, mode="r|") as tar:
+        members = iter(tar)
+        first = next(members, None)
+        if first is None or first.name != BUNDLE_INDEX:
+            raise BundleError("{} is not a texture bundle".format(bundle_path))
+        try:
+            index = json.load(tar.extractfile(first))
+        except ValueError as err:
+            raise BundleError("Invalid bundle index: {}".format(err))
+        if index.get("version") != BUNDLE_VERSION:
+            raise BundleError("Unsupported bundle version {}".format(index.get("version")))
+        expected = {(a["home_dir"], a["name"]): a["files"] for a in index["assets"]}
+
+        for member in members:
+            if not member.isfile():
+                continue
+            home_dir, asset_name, relpath = _splitArcname(member.name)
+            files = expected.get((home_dir, asset_name))
+            if files is None or files.get(relpath) != member.size:
+                raise BundleError("Unexpected file {} in bundle".format(member.name))
+            key = (home_dir, asset_name)
+            if key not in asset_dirs:
+                asset_index = AssetIndex.getInstance(os.path.join(texture_dir, home_dir))
+                asset_dirs[key] = asset_index.assetPath(asset_name, sharded)
+            target = os.path.join(asset_dirs[key], relpath.replace("/", os.path.sep))
+            if not _isSame(target, member):
+                _extractMember(tar, member, target)
+            written.append(target)
+            if progress_callback is not None:
+                progress_callback(member.size)
+
+    # dates stored in the archive may be rounded, so manifests are updated
+    for target in written:
+        if os.path.basename(target) == MANIFEST_NAME:
+            ExtractionManifest(os.path.dirname(target)).refresh()
+    return ["{}/{}".format(*key) for key in asset_dirs]
+
+
+def _assetFiles(asset_dir):
+    """(relative path, path, size) of the files of an asset worth bundling"""
+    files = []
+    for root, dirs, filenames in os.walk(asset_dir):
+        dirs.sort()
+        for filename in sorted(filenames):
+            if filename in EXCLUDED_NAMES or filename.endswith(EXCLUDED_SUFFIXES):
+                continue
+            path = os.path.join(root, filename)
+            if not os.path.isfile(path):
+                continue  # e.g. broken link
+            relpath = os.path.relpath(path, asset_dir).replace(os.path.sep, "/")
+            files.append((relpath, path, os.path.getsize(path)))
+    return files
+
+
+def _splitArcname(arcname):
+    parts = arcname.split("/")
+    if len(parts) < 3 or any(part in ("", ".", "..") or ":" in part or "\\" in part for part in parts):
+        raise BundleError("Invalid path {} in bundle".format(arcname))
+    return parts[0], parts[1], "/".join(parts[2:])
+
+
+def _isSame(path, member):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return False
+    return stat.st_size == member.size and int(stat.st_mtime) == int(member.mtime)
+
+
+def _extractMember(tar, member, target):
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    tmp_path = "{}.{}.tmp".format(target, threading.get_ident())
+    with tar.extractfile(member) as source, open(tmp_path, "wb") as f:
+        shutil.copyfileobj(source, f, 1 << 20)
+    os.utime(tmp_path, (member.mtime, member.mtime))
+    os.replace(tmp_path, target)
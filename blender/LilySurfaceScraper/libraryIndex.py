@@ -0,0 +1,254 @@
+# Copyright (c) 2019 - 2024 Elie Michel
+#
+# This file is part of LilySurfaceScraper, a Blender add-on to import
+# materials from a single URL. It is released under the terms of the GPLv3
+# license. See the LICENSE.md file for the full text.
+
+"""
+Index of the assets downloaded into a texture directory, so that the asset
+browser never reads the metadata file of each asset while Blender draws it.
+
+The index is a SQLite database saved in the texture directory. It records,
+for each asset of each provider (named after its home directory), the name,
+id, source URL, thumbnail, variants and tags found in its metadata, and
+which variants have been downloaded. It is updated each time a metadata file is
+saved and each time a variant is imported or removed from the texture
+directory.
+
+Changes made by others, e.g. assets imported from a bundle or downloaded by
+another Blender instance sharing the texture directory, are caught up with by
+refresh(), when the asset index of the provider (see assetIndex) changed:
+missing assets are added by reading their metadata, removed ones are dropped,
+and the downloaded variants of all assets are checked again. Listing and
+searching only read the database, refresh() is called from a timer rather
+than while Blender draws. The database is only a cache: it is rebuilt from
+scratch when missing or of another version.
+
+Assets are searched through an inverted index (see searchIndex) kept in
+memory, built from the database the first time a provider is searched.
+
+The default rollback journal is used rather than WAL, that requires shared
+memory and hence does not work for texture directories on network drives.
+
+This module must not use the Blender API.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+from collections import namedtuple
+
+from .assetIndex import AssetIndex, isShardDir
+from .extractionManifest import ExtractionManifest
+from .searchIndex import SearchIndex
+
+LIBRARY_INDEX_NAME = ".library.sqlite"
+METADATA_NAME = ".meta"  # metadata_filename of the scrapers
+LIBRARY_INDEX_VERSION = 3
+
+# wait for other Blender instances writing into the same database
+LIBRARY_INDEX_TIMEOUT = 10.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS assets (
+    provider TEXT NOT NULL,
+    asset TEXT NOT NULL,
+    id TEXT NOT NULL,
+    name TEXT NOT NULL,
+    scraper TEXT NOT NULL,
+    fetch_url TEXT NOT NULL,
+    thumbnail TEXT,
+    variants TEXT NOT NULL,
+    tags TEXT NOT NULL,
+    paths TEXT NOT NULL,
+    PRIMARY KEY (provider, asset)
+);
+CREATE TABLE IF NOT EXISTS downloads (
+    provider TEXT NOT NULL,
+    asset TEXT NOT NULL,
+    variant TEXT NOT NULL,
+    PRIMARY KEY (provider, asset, variant)
+);
+CREATE TABLE IF NOT EXISTS providers (
+    provider TEXT PRIMARY KEY,
+    index_mtime REAL NOT NULL
+);
+"""
+
+LibraryAsset = namedtuple("LibraryAsset", ["asset", "id", "name", "scraper", "fetch_url", "thumbnail",
+                                           "variants", "tags", "downloaded"])
+
+
+def isDownloaded(variant_path):
+    """Whether the file or directory of a variant is there, and was not left
+    behind by an interrupted extraction"""
+    return os.path.exists(variant_path) and not ExtractionManifest(variant_path).isIncomplete()
+
+
+def locateMetadataFile(metadata_filepath):
+    """Return the texture directory, home directory and asset name of the
+    asset a metadata file belongs to, whatever the layout"""
+    asset_dir = os.path.dirname(os.path.abspath(metadata_filepath))
+    home_path = os.path.dirname(asset_dir)
+    if isShardDir(home_path):
+        home_path = os.path.dirname(home_path)
+    return os.path.dirname(home_path), os.path.basename(home_path), os.path.basename(asset_dir)
+
+
+class LibraryIndex():
+    _instances = {}
+    _instances_lock = threading.Lock()
+
+    @classmethod
+    def getInstance(cls, texture_dir):
+        """Get the index of the texture directory texture_dir, shared by all threads"""
+        with cls._instances_lock:
+            if texture_dir not in cls._instances:
+                cls._instances[texture_dir] = cls(texture_dir)
+            return cls._instances[texture_dir]
+
+    def __init__(self, texture_dir):
+        self.texture_dir = texture_dir
+        self.path = os.path.join(texture_dir, LIBRARY_INDEX_NAME)
+        # sqlite connections cannot be shared between threads
+        self._local = threading.local()
+        self._search_indices = {}  # provider -> SearchIndex, built when first searched
+        self._search_lock = threading.Lock()
+
+    def recordAsset(self, provider, asset_name, metadata):
+        """Record the content of the metadata of an asset"""
+        with self._connection() as db:
+            self._insertAsset(db, provider, asset_name, metadata)
+
+    def recordMetadataFile(self, metadata_filepath, metadata):
+        """Record metadata that has just been saved to metadata_filepath"""
+        self.recordMetadataFiles([(metadata_filepath, metadata)])
+
+    def recordMetadataFiles(self, saved):
+        """Record metadata saved to several files at once, given as
+        (metadata_filepath, metadata) pairs, in a single transaction"""
+        with self._connection() as db:
+            for metadata_filepath, metadata in saved:
+                _, provider, asset_name = locateMetadataFile(metadata_filepath)
+                self._insertAsset(db, provider, asset_name, metadata)
+
+    def setDownloaded(self, provider, asset_name, variant, downloaded=True):
+        """Record that a variant of an asset is (or is not anymore) present
+        in the texture directory"""
+        with self._connection() as db:
+            if downloaded:
+                db.execute("INSERT OR IGNORE INTO downloads VALUES (?, ?, ?)", (provider, asset_name, variant))
+            else:
+                db.execute("DELETE FROM downloads WHERE provider = ? AND asset = ? AND variant = ?",
+                           (provider, asset_name, variant))
+
+    def assets(self, provider):
+        """All the assets downloaded from a provider, as LibraryAsset
+        records sorted by asset name"""
+        db = self._connection()
+        downloaded = {}
+        for asset_name, variant in db.execute("SELECT asset, variant FROM downloads WHERE provider = ?", (provider,)):
+            downloaded.setdefault(asset_name, set()).add(variant)
+        rows = db.execute("SELECT asset, id, name, scraper, fetch_url, thumbnail, variants, tags FROM assets "
+                          "WHERE provider = ? ORDER BY asset", (provider,))
+        return [self._makeAsset(row, downloaded.get(row[0], set())) for row in rows]
+
+    def asset(self, provider, asset_name):
+        """The LibraryAsset record of an asset, or None if it is not indexed"""
+        db = self._connection()
+        row = db.execute("SELECT asset, id, name, scraper, fetch_url, thumbnail, variants, tags FROM assets "
+                         "WHERE provider = ? AND asset = ?", (provider, asset_name)).fetchone()
+        if row is None:
+            return None
+        downloaded = {variant for variant, in db.execute(
+            "SELECT variant FROM downloads WHERE provider = ? AND asset = ?", (provider, asset_name))}
+        return self._makeAsset(row, downloaded)
+
+    def search(self, provider, query, limit=None):
+        """Names of the assets of a provider matching query, best matches first"""
+        with self._search_lock:
+            index = self._search_indices.get(provider)
+            if index is None:
+                index = SearchIndex()
+                rows = self._connection().execute(
+                    "SELECT asset, id, name, scraper, tags FROM assets WHERE provider = ?", (provider,))
+                for asset_name, identifier, name, scraper, tags in rows:
+                    index.add(asset_name, [asset_name, identifier, name], [provider, scraper, *json.loads(tags)])
+                self._search_indices[provider] = index
+        return index.search(query, limit)
+
+    def refresh(self, provider):
+        """Catch up with the changes of the asset index of provider made by
+        others: add the assets that are missing, remove those that are not
+        there anymore, and check again which variants are downloaded.
+        This reads metadata files and writes the database, it must not be
+        called while drawing. Return whether the asset index had changed."""
+        asset_index = AssetIndex.getInstance(os.path.join(self.texture_dir, provider))
+        if not os.path.isdir(asset_index.home_path):
+            return False
+        names = asset_index.assets()  # builds the asset index if needed
+        try:
+            index_mtime = os.path.getmtime(asset_index.index_path)
+        except OSError:
+            return False
+        db = self._connection()
+        row = db.execute("SELECT index_mtime FROM providers WHERE provider = ?", (provider,)).fetchone()
+        if row is not None and row[0] == index_mtime:
+            return False
+
+        # imported here, metadataHandler records saved metadata in this index
+        from .metadataHandler import Metadata
+        indexed = {asset_name: (variants, paths) for asset_name, variants, paths in db.execute(
+            "SELECT asset, variants, paths FROM assets WHERE provider = ?", (provider,))}
+        with db:
+            for asset_name in names:
+                asset_dir = asset_index.assetPath(asset_name, create=False)
+                if asset_name in indexed:
+                    variants, paths = map(json.loads, indexed[asset_name])
+                else:
+                    metadata = Metadata.open(os.path.join(asset_dir, METADATA_NAME))
+                    self._insertAsset(db, provider, asset_name, metadata)
+                    variants = metadata.variants
+                    paths = [record.path for record in metadata.records]
+                db.execute("DELETE FROM downloads WHERE provider = ? AND asset = ?", (provider, asset_name))
+                db.executemany("INSERT OR IGNORE INTO downloads VALUES (?, ?, ?)", [
+                    (provider, asset_name, variant) for variant, path in zip(variants, paths)
+                    if isDownloaded(os.path.join(asset_dir, path))])
+            for asset_name in set(indexed).difference(names):
+                db.execute("DELETE FROM assets WHERE provider = ? AND asset = ?", (provider, asset_name))
+                db.execute("DELETE FROM downloads WHERE provider = ? AND asset = ?", (provider, asset_name))
+                index = self._search_indices.get(provider)
+                if index is not None:
+                    index.remove(asset_name)
+            db.execute("INSERT OR REPLACE INTO providers VALUES (?, ?)", (provider, index_mtime))
+        return True
+
+    def _connection(self):
+        db = getattr(self._local, "db", None)
+        if db is None:
+            os.makedirs(self.texture_dir, exist_ok=True)
+            db = sqlite3.connect(self.path, timeout=LIBRARY_INDEX_TIMEOUT)
+            if db.execute("PRAGMA user_version").fetchone()[0] != LIBRARY_INDEX_VERSION:
+                with db:
+                    for table in ("assets", "downloads", "providers"):
+                        db.execute("DROP TABLE IF EXISTS {}".format(table))
+                    db.executescript(SCHEMA)
+                    db.execute("PRAGMA user_version = {}".format(LIBRARY_INDEX_VERSION))
+            self._local.db = db
+        return db
+
+    def _insertAsset(self, db, provider, asset_name, metadata):
+        db.execute("INSERT OR REPLACE INTO assets VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", (
+            provider, asset_name, metadata.id, metadata.name, metadata.scraper, metadata.fetchUrl,
+            metadata.thumbnail, json.dumps(metadata.variants), json.dumps(metadata.tags),
+            json.dumps([record.path for record in metadata.records])))
+        index = self._search_indices.get(provider)
+        if index is not None:
+            index.add(asset_name, [asset_name, metadata.id, metadata.name], [provider, metadata.scraper, *metadata.tags])
+
+    @staticmethod
+    def _makeAsset(row, downloaded):
+        asset_name, identifier, name, scraper, fetch_url, thumbnail, variants, tags = row
+        return LibraryAsset(asset_name, identifier, name, scraper, fetch_url, thumbnail, json.loads(variants),
+                            json.loads(tags), downloaded)
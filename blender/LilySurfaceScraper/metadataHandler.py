@@ -4,11 +4,147 @@
 # materials from a single URL. It is released under the terms of the GPLv3
 # license. See the LICENSE.md file for the full text.
 
+import contextlib
 import json
 import os
+import re
+import threading
+
+from .libraryIndex import LibraryIndex, locateMetadataFile
+
+RESOLUTION_PATTERN = re.compile(r"(\d+)\s*k", re.IGNORECASE)
+FORMAT_PATTERN = re.compile(r"\((\w+)\)$|-([A-Za-z]+)$")
+
+
+def parseResolution(label):
+    """resolution in pixels of a label like '4k' or '2K-JPG', 0 if unknown"""
+    match = RESOLUTION_PATTERN.search(label)
+    return int(match.group(1)) * 1024 if match is not None else 0
+
+
+def parseFormat(label):
+    """file format of a label like '4k (exr)' or '2K-JPG', '' if unknown"""
+    match = FORMAT_PATTERN.search(label)
+    return (match.group(1) or match.group(2)).lower() if match is not None else ""
+
+
+class FileRecord:
+    """a file of a variant, as given by the provider"""
+    __slots__ = ("url", "size", "md5")
+
+    def __init__(self, url, size=None, md5=None):
+        self.url = url
+        self.size = size
+        self.md5 = md5
+
+    @classmethod
+    def fromJson(cls, data):
+        # older metadata stored dicts, or only the url
+        if isinstance(data, str):
+            return cls(data)
+        if isinstance(data, dict):
+            return cls(data["url"], data.get("size"), data.get("md5"))
+        return cls(*data)
+
+    def __eq__(self, other):
+        return isinstance(other, FileRecord) and (self.url, self.size, self.md5) == (other.url, other.size, other.md5)
+
+    def toJson(self):
+        data = [self.url, self.size, self.md5]
+        while data[-1] is None:
+            data.pop()
+        return data
+
+
+class VariantRecord:
+    """a variant of an asset
+    name: label shown to the user, also used in material names
+    resolution: in pixels, 0 if unknown
+    format: file format, like 'exr' or 'jpg'
+    files: dict mapping map types (or 'zip' for a texture zip) to FileRecord
+    path: file or directory of the variant, relative to the asset directory
+    resolved: result of the last import of the variant, None if not imported yet, as a dict with
+      'material': material name, 'maps': map paths relative to the asset directory,
+      'values': maps that are not files, 'expected': names of all the maps the import gave,
+      'options': scraper options it depends on"""
+    __slots__ = ("name", "resolution", "format", "files", "path", "resolved")
+
+    def __init__(self, name, resolution=0, fmt="", files=None, path=None, resolved=None):
+        self.name = name
+        self.resolution = resolution
+        self.format = fmt
+        self.files = files if files is not None else dict()
+        self.path = path if path is not None else name
+        self.resolved = resolved
+
+    @classmethod
+    def fromName(cls, name):
+        """record of a variant only known by its label"""
+        return cls(name, parseResolution(name), parseFormat(name))
+
+    @classmethod
+    def fromJson(cls, data):
+        if isinstance(data, str):
+            return cls.fromName(data)
+        name, resolution, fmt, path, files = data[:5]
+        resolved = data[5] if len(data) > 5 else None
+        return cls(name, resolution, fmt, {k: FileRecord.fromJson(v) for k, v in files.items()}, path, resolved)
+
+    def toJson(self):
+        data = [self.name, self.resolution, self.format, self.path, {k: v.toJson() for k, v in self.files.items()}]
+        if self.resolved is not None:
+            data.append(self.resolved)
+        return data
+
+    def resolve(self, asset_dir, material_name, maps, options):
+        """record the result of an import of the variant, given the maps it
+        set (paths or values). return false, leaving the record unchanged,
+        if a map is missing (None) or a file is outside of asset_dir"""
+        paths = dict()
+        values = dict()
+        for map_name, value in maps.items():
+            if value is None:
+                return False  # e.g. failed to download, to be tried again next time
+            if isinstance(value, str) and os.path.isabs(value):
+                try:
+                    relpath = os.path.relpath(value, asset_dir)
+                except ValueError:
+                    return False  # on another drive
+                if relpath.startswith(os.pardir):
+                    return False  # not stored in the asset directory
+                paths[map_name] = relpath.replace(os.path.sep, '/')
+            else:
+                values[map_name] = value
+        self.resolved = {
+            "material": material_name,
+            "maps": paths,
+            "values": values,
+            "expected": sorted(maps),
+            "options": options,
+        }
+        return True
+
+    def resolvedMaps(self, asset_dir, options):
+        """material name and maps of the last import of the variant, or
+        None if there is none, it depended on other options, or some of its
+        maps are missing"""
+        resolved = self.resolved
+        if resolved is None or resolved.get("options") != options:
+            return None
+        maps = {map_name: os.path.join(asset_dir, *relpath.split('/')) for map_name, relpath in resolved["maps"].items()}
+        # recorded by an older version, that also recorded partial imports
+        if "expected" not in resolved or set(resolved["expected"]) != set(maps) | set(resolved["values"]):
+            return None
+        if not all(os.path.isfile(path) for path in maps.values()):
+            return None
+        maps.update(resolved["values"])
+        return resolved["material"], maps
 
 
 class Metadata:
+    # metadata saved while writes are batched, see batchedWrites()
+    _batch = threading.local()
+
     def __init__(self, name, identifier, scraper_name, source_url, thumbnail_filename, variants_list):
         """class for storing metadata for scrapers about an asset"""
         self.name = name
@@ -16,8 +152,13 @@ class Metadata:
         self.scraper = scraper_name
         self.fetchUrl = source_url
         self.thumbnail = thumbnail_filename
+        self.records = list()  # VariantRecord
         self.variants = variants_list
+        # tags and categories given by the provider, for searching
+        self.tags = list()
         self.custom = dict()
+        # path and content of the metadata file as last read or written, to skip unchanged writes
+        self._saved = None
 
     def load(self, metadata_file):
         """load metadata file into current object"""
@@ -27,25 +168,92 @@ class Metadata:
         self.scraper = obj.scraper if self.scraper == "" else self.scraper
         self.fetchUrl = obj.fetchUrl
         self.thumbnail = obj.thumbnail
-        self.variants = obj.variants
+        self.records = obj.records
+        self.tags = obj.tags
         self.custom = obj.custom
+        self._saved = obj._saved
 
     @classmethod
     def open(cls, metadata_file):
         """open a metadata file and return a new object"""
         if not os.path.isfile(metadata_file):
             return cls.createBlank()
-        with open(metadata_file, "r") as f:
-            data = json.load(f)
+        try:
+            with open(metadata_file, "r") as f:
+                content = f.read()
+            data = json.loads(content)
+        except (OSError, ValueError) as err:
+            # e.g. truncated by a crash, before writes were atomic
+            print(f"Ignoring unreadable metadata file '{metadata_file}': {err}")
+            return cls.createBlank()
+        if not isinstance(data, dict):
+            return cls.createBlank()
         obj = cls(cls._defaultTo(data, "name", ""),
                    cls._defaultTo(data, "id", ""),
                    cls._defaultTo(data, "scraper", ""),
                    cls._defaultTo(data, "fetchUrl", ""),
                    cls._defaultTo(data, "thumbnail", None),
-                   cls._defaultTo(data, "variants", list()))
+                   list())
+        obj.records = [VariantRecord.fromJson(v) for v in cls._defaultTo(data, "variants", list())]
+        obj.tags = cls._defaultTo(data, "tags", list())
         obj.custom = cls._defaultTo(data, "custom", dict())
+        obj._upgradeLegacyVariants()
+        obj._saved = (metadata_file, content)
         return obj
 
+    def _upgradeLegacyVariants(self):
+        """move the variant data that scrapers used to save as custom variables into the records"""
+        variant_data = self.custom.pop("variant_data", None)  # Poly Haven: [res, fmt, files]
+        if variant_data is not None:
+            for record, (res, fmt, files) in zip(self.records, variant_data):
+                record.resolution = parseResolution(res)
+                record.format = fmt
+                if isinstance(files, str) or "url" in files:
+                    # HDRI, a single file named after its resolution
+                    record.files = {"hdri": FileRecord.fromJson(files)}
+                    record.path = f"{res}.{fmt}"
+                else:
+                    record.files = {k: FileRecord.fromJson(v) for k, v in files.items()}
+        variants_urls = self.custom.pop("variants_urls", None)  # ambientCG: zip urls
+        if variants_urls is not None:
+            for record, url in zip(self.records, variants_urls):
+                record.files = {"zip": FileRecord(url)}
+        if "resolutions" in self.custom:  # cgbookcase: zip urls by resolution, shared by the sides
+            resolutions = self.custom.pop("resolutions")
+            files = self.custom.pop("files", dict())
+            self.custom.pop("doublesided", None)
+            for i, record in enumerate(self.records):
+                res = resolutions[i % len(resolutions)] if resolutions else None
+                if res in files:
+                    record.resolution = parseResolution(res)
+                    record.files = {"zip": FileRecord(files[res])}
+
+    @property
+    def variants(self):
+        """labels of the variants"""
+        return [record.name for record in self.records]
+
+    @variants.setter
+    def variants(self, names):
+        """set the variants from their labels, keeping the records already known"""
+        known = {record.name: record for record in self.records}
+        self.records = [known.get(name) or VariantRecord.fromName(name) for name in names]
+
+    def keepResolvedVariants(self, previous):
+        """keep the import results of previous metadata of the same asset
+        for the variants whose files did not change"""
+        for record in self.records:
+            old = previous.getVariant(record.name)
+            if old is not None and old.resolved is not None and old.files == record.files:
+                record.resolved = old.resolved
+
+    def getVariant(self, name):
+        """the record of the variant labeled name, None if there is none"""
+        for record in self.records:
+            if record.name == name:
+                return record
+        return None
+
     @classmethod
     def createBlank(cls):
         """create an empty metadata object"""
@@ -55,19 +263,92 @@ class Metadata:
     def _defaultTo(dictionary, key, default):
         return dictionary[key] if key in dictionary else default
 
-    def save(self, metadata_filepath):
-        """save the metadata file"""
+    def serialize(self):
+        """content of the metadata file"""
         metadata = {
             "name": self.name,
             "id": self.id,
             "scraper": self.scraper,
             "fetchUrl": self.fetchUrl,
             "thumbnail": self.thumbnail,
-            "variants": self.variants,
+            "variants": [record.toJson() for record in self.records],
+            "tags": self.tags,
             "custom": self.custom
         }
-        with open(metadata_filepath, "w") as f:
-            json.dump(metadata, f, indent=4)
+        return json.dumps(metadata, separators=(",", ":"))
+
+    def isDirty(self, metadata_filepath):
+        """true if the metadata changed since it was last read from or written to metadata_filepath"""
+        return self._saved != (metadata_filepath, self.serialize())
+
+    def save(self, metadata_filepath):
+        """save the metadata file, unless it would not change.
+        return true if it was written (or will be, at the end of a batch)"""
+        content = self.serialize()
+        pending = getattr(self._batch, "pending", None)
+        if pending is not None and metadata_filepath in pending:
+            # replaces what was to be written, even if back to what was written last
+            pending[metadata_filepath] = (self, content)
+            return True
+        if self._saved == (metadata_filepath, content):
+            return False
+        if pending is not None:
+            pending[metadata_filepath] = (self, content)
+            return True
+        written = self._write(metadata_filepath, content)
+        self._saved = (metadata_filepath, content)
+        if written:
+            texture_dir, _, _ = locateMetadataFile(metadata_filepath)
+            LibraryIndex.getInstance(texture_dir).recordMetadataFile(metadata_filepath, self)
+        return written
+
+    @classmethod
+    @contextlib.contextmanager
+    def batchedWrites(cls):
+        """context in which metadata saved by the current thread is written
+        once, when leaving it, however many times it was saved. Metadata is
+        only considered saved once written: if a write fails, the others are
+        still written and the error is raised."""
+        if getattr(cls._batch, "pending", None) is not None:
+            yield  # nested
+            return
+        cls._batch.pending = {}
+        try:
+            yield
+        finally:
+            pending, cls._batch.pending = cls._batch.pending, None
+            records = {}
+            error = None
+            for metadata_filepath, (metadata, content) in pending.items():
+                try:
+                    written = cls._write(metadata_filepath, content)
+                except OSError as err:
+                    error = error or err
+                    continue
+                metadata._saved = (metadata_filepath, content)
+                if written:
+                    texture_dir, _, _ = locateMetadataFile(metadata_filepath)
+                    records.setdefault(texture_dir, []).append((metadata_filepath, metadata))
+            for texture_dir, saved in records.items():
+                LibraryIndex.getInstance(texture_dir).recordMetadataFiles(saved)
+            if error is not None:
+                raise error
+
+    @staticmethod
+    def _write(metadata_filepath, content):
+        """atomically write content to metadata_filepath if it differs from
+        what the file holds, e.g. written by another instance. return true if written"""
+        try:
+            with open(metadata_filepath, "r") as f:
+                if f.read() == content:
+                    return False
+        except (OSError, ValueError):
+            pass
+        tmp_path = "{}.{}.tmp".format(metadata_filepath, threading.get_ident())
+        with open(tmp_path, "w") as f:
+            f.write(content)
+        os.replace(tmp_path, metadata_filepath)
+        return True
 
     def getCustom(self, key):
         """get a custom variable"""
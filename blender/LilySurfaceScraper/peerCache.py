@@ -0,0 +1,233 @@
+# Copyright (c) 2019 - 2024 Elie Michel
+#
+# This file is part of LilySurfaceScraper, a Blender add-on to import
+# materials from a single URL. It is released under the terms of the GPLv3
+# license. See the LICENSE.md file for the full text.
+
+"""
+Sharing of downloaded files between workstations of a local network.
+
+Each workstation may serve its shared store (see contentStore) over HTTP:
+ - /lily/v1/record/<key> returns the index record of a provider URL, where
+   key is the SHA-1 of the URL, so that peers never see URLs themselves,
+ - /lily/v1/object/<sha256> returns a stored file.
+Nothing else is served, in particular no path chosen by the client.
+
+The server only listens on the address it is given, and only answers
+requests that come from an allowed network, if any is set, and carry the
+secret shared by the workstations in an Authorization header. Anything else
+gets a 403 answer.
+
+Before downloading a file from a provider, the add-on asks the configured
+peers for the record of its URL, then fetches the file from a peer that has
+it. Stored files are named after their SHA-256, so a file received from a
+peer is always checked against it, on top of the size and hash given by the
+provider, if any. Any failure simply falls back to the provider.
+
+This module must not use the Blender API.
+"""
+
+import concurrent.futures
+import hashlib
+import hmac
+import ipaddress
+import json
+import os
+import re
+import shutil
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import requests
+
+from .contentStore import HASH_NAME
+from .downloadHandler import PART_SUFFIX, iterBody
+from .settings import PEER_CONNECT_TIMEOUT, PEER_READ_TIMEOUT, PEER_LOOKUP_WORKERS
+
+API_PREFIX = "/lily/v1/"
+RECORD_PATH = re.compile(r"^/lily/v1/record/([0-9a-f]{40})$")
+OBJECT_PATH = re.compile(r"^/lily/v1/object/([0-9a-f]{64})$")
+
+
+def authorizationHeaders(secret):
+    return {"Authorization": "Bearer " + secret}
+
+
+def parseNetworks(text):
+    """Networks of a comma separated list of addresses or subnets, like
+    '192.168.1.0/24, 10.0.0.12'. Raise ValueError if one is invalid."""
+    return [ipaddress.ip_network(item.strip(), strict=False) for item in text.split(",") if item.strip()]
+
+
+class PeerCacheServer():
+    """Serve a ContentStore to other workstations"""
+
+    def __init__(self, store, port, secret, host="0.0.0.0", allowed_networks=None):
+        """secret: token that clients must send, it may not be empty
+        host: address on which to listen
+        allowed_networks: ipaddress networks from which requests are
+        accepted, None or empty to accept them from anywhere"""
+        if not secret:
+            raise ValueError("A shared secret is required to share downloads")
+        self.store = store
+        self._expected_authorization = authorizationHeaders(secret)["Authorization"].encode("utf-8")
+        self._allowed_networks = list(allowed_networks or [])
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                if not server._isAllowed(self.client_address[0], self.headers.get("Authorization", "")):
+                    return self._answer(403)
+                match = RECORD_PATH.match(self.path)
+                if match is not None:
+                    record = server.store.lookupKey(match.group(1))
+                    if record is None:
+                        return self._notFound()
+                    data = json.dumps(record).encode("utf-8")
+                    self.send_response(200)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+                    return
+
+                match = OBJECT_PATH.match(self.path)
+                if match is None or not server.store.has(match.group(1)):
+                    return self._notFound()
+                try:
+                    f = open(server.store.objectPath(match.group(1)), "rb")
+                except OSError:
+                    return self._notFound()
+                with f:
+                    self.send_response(200)
+                    self.send_header("Content-Type", "application/octet-stream")
+                    self.send_header("Content-Length", str(os.fstat(f.fileno()).st_size))
+                    self.end_headers()
+                    shutil.copyfileobj(f, self.wfile, 1 << 20)
+
+            def _notFound(self):
+                self._answer(404)
+
+            def _answer(self, status):
+                self.send_response(status)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True, name="LilyPeerCache")
+
+    @property
+    def port(self):
+        return self.httpd.server_address[1]
+
+    @property
+    def host(self):
+        return self.httpd.server_address[0]
+
+    def _isAllowed(self, client_host, authorization):
+        if self._allowed_networks:
+            try:
+                address = ipaddress.ip_address(client_host)
+            except ValueError:
+                return False
+            if not any(address in network for network in self._allowed_networks):
+                return False
+        return hmac.compare_digest(authorization.encode("utf-8"), self._expected_authorization)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class PeerClient():
+    """Fetch files from the stores served by other workstations"""
+    # threads asking peers for records, shared by all clients
+    _executor = None
+    _executor_lock = threading.Lock()
+
+    @classmethod
+    def getExecutor(cls):
+        with cls._executor_lock:
+            if cls._executor is None:
+                cls._executor = concurrent.futures.ThreadPoolExecutor(max_workers=PEER_LOOKUP_WORKERS,
+                                                                      thread_name_prefix="LilyPeerLookup")
+            return cls._executor
+
+    def __init__(self, session_handler, peers, secret, timeout=(PEER_CONNECT_TIMEOUT, PEER_READ_TIMEOUT)):
+        """session_handler: the SessionHandler used to send requests
+        peers: addresses of the peers, like 'host:port' or 'http://host:port'
+        secret: token shared by the workstations"""
+        self.session_handler = session_handler
+        self.peers = [peer if "://" in peer else "http://" + peer for peer in peers]
+        self.headers = authorizationHeaders(secret)
+        self.timeout = timeout
+
+    def findRecord(self, url):
+        """Ask all peers at once for the record of url. Return the address
+        of a peer that has it and the record, or None."""
+        if not self.peers:
+            return None
+        key = hashlib.sha1(url.encode("utf-8")).hexdigest()
+        executor = self.getExecutor()
+        futures = {executor.submit(self._getRecord, peer, key): peer for peer in self.peers}
+        try:
+            for future in concurrent.futures.as_completed(futures):
+                record = future.result()
+                if record is not None:
+                    return futures[future], record
+        finally:
+            # do not wait for slower peers
+            for future in futures:
+                future.cancel()
+        return None
+
+    def fetchObject(self, peer, digest, path):
+        """Download the stored file digest from peer into path, checking its
+        hash. Return True on success."""
+        # not the .part file of the download from the provider, that may be resumed later
+        part_path = path + ".peer" + PART_SUFFIX
+        hasher = hashlib.new(HASH_NAME)
+        try:
+            with self.session_handler.get(peer + API_PREFIX + "object/" + digest, stream=True,
+                                          headers=self.headers, timeout=self.timeout, retries=0) as r:
+                if r.status_code != 200:
+                    return False
+                with open(part_path, "wb") as f:
+                    for chunk in iterBody(r, 1 << 20):
+                        f.write(chunk)
+                        hasher.update(chunk)
+        except (requests.exceptions.RequestException, OSError) as err:
+            print("Could not get {} from {}: {}".format(digest, peer, err))
+            self._discard(part_path)
+            return False
+        if hasher.hexdigest() != digest:
+            print("Peer {} sent corrupted content for {}".format(peer, digest))
+            self._discard(part_path)
+            return False
+        os.replace(part_path, path)
+        return True
+
+    def _getRecord(self, peer, key):
+        try:
+            r = self.session_handler.get(peer + API_PREFIX + "record/" + key, headers=self.headers,
+                                         timeout=self.timeout, retries=0)
+            if r.status_code != 200:
+                return None
+            record = r.json()
+        except (requests.exceptions.RequestException, ValueError):
+            return None
+        return record if isinstance(record, dict) else None
+
+    @staticmethod
+    def _discard(path):
+        if os.path.isfile(path):
+            os.remove(path)
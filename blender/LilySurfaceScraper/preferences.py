@@ -23,6 +23,12 @@
 
 import bpy
 
+from .settings import (
+    CONNECT_TIMEOUT, READ_TIMEOUT, HTTP_CACHE_SIZE, DOWNLOAD_SEGMENTS,
+    HTTP_RETRIES, STALL_TIME, CONTENT_STORE_DIR, TEXTURE_CACHE_QUOTA,
+    PEER_CACHE_PORT, PEER_CACHE_ADDRESS,
+)
+
 addon_idname = __package__.split(".")[0]
 
 # -----------------------------------------------------------------------------
@@ -33,6 +39,10 @@ def getPreferences(context=None):
     addon_preferences = preferences.addons[addon_idname].preferences
     return addon_preferences
 
+def updatePeerCache(self, context):
+    from .cache_utils import updatePeerCacheServer
+    updatePeerCacheServer()
+
 # -----------------------------------------------------------------------------
 
 class LilySurfaceScraperPreferences(bpy.types.AddonPreferences):
@@ -44,12 +54,49 @@ class LilySurfaceScraperPreferences(bpy.types.AddonPreferences):
         default="LilySurface",
     )
 
+    shard_assets: bpy.props.BoolProperty(
+        name="Shard Asset Directories",
+        description="Spread the assets of each provider over 256 subdirectories, which is faster for very large libraries, especially on network drives. Use Migrate Library to move existing assets",
+        default=False,
+    )
+
+    use_content_store: bpy.props.BoolProperty(
+        name="Share Downloads Between Projects",
+        description="Keep downloaded textures in a store common to all projects and link them into texture directories, so that each file is downloaded and stored only once. Textures must then never be edited in place, since all projects share them",
+        default=False,
+    )
+
+    content_store_dir: bpy.props.StringProperty(
+        name="Shared Store Directory",
+        subtype='DIR_PATH',
+        default=CONTENT_STORE_DIR,
+    )
+
+    texture_cache_quota: bpy.props.IntProperty(
+        name="Texture Directory Quota (GB)",
+        description="When the texture directory grows beyond this size, the least recently used variants are removed (0 for no limit)",
+        default=TEXTURE_CACHE_QUOTA,
+        min=0,
+    )
+
+    pinned_assets: bpy.props.StringProperty(
+        name="Pinned Assets",
+        description="Comma separated patterns of variants never removed to enforce the quota, like 'ambientCG/Bricks*/*' or 'hdrihaven/*/*'",
+        default="",
+    )
+
     ieslibrary_apikey: bpy.props.StringProperty(
         name="ieslibrary API-Key",
         subtype='NONE',
         default="",
     )
 
+    verify_checksums: bpy.props.BoolProperty(
+        name="Verify Checksums",
+        description="Check downloaded and cached files against the MD5 hash given by the provider, when it gives one (slower)",
+        default=False,
+    )
+
     use_ao: bpy.props.BoolProperty(
         name="Use AO map",
         default=False,
@@ -85,6 +132,100 @@ class LilySurfaceScraperPreferences(bpy.types.AddonPreferences):
         default=True,
     )
 
+    connect_timeout: bpy.props.FloatProperty(
+        name="Connect Timeout",
+        description="Seconds to wait for a texture provider to accept a connection",
+        default=CONNECT_TIMEOUT,
+        min=1.0,
+    )
+
+    read_timeout: bpy.props.FloatProperty(
+        name="Read Timeout",
+        description="Seconds to wait for a texture provider to send data before giving up",
+        default=READ_TIMEOUT,
+        min=1.0,
+    )
+
+    http_retries: bpy.props.IntProperty(
+        name="Retries",
+        description="Number of times a failed request or an interrupted download is tried again",
+        default=HTTP_RETRIES,
+        min=0,
+        max=10,
+    )
+
+    stall_time: bpy.props.FloatProperty(
+        name="Stall Timeout",
+        description="Restart downloads that remain almost idle for this many seconds (0 to disable)",
+        default=STALL_TIME,
+        min=0.0,
+    )
+
+    hedge_requests: bpy.props.BoolProperty(
+        name="Hedge Slow Requests",
+        description="When a texture provider is slower than usual to list the variants of an asset, send the request a second time and use whichever answer comes first",
+        default=True,
+    )
+
+    http_cache_size: bpy.props.IntProperty(
+        name="Response Cache Size (MB)",
+        description="Maximum size of the cache of texture providers' API responses, stored in the texture directory",
+        default=HTTP_CACHE_SIZE,
+        min=0,
+    )
+
+    peer_cache_serve: bpy.props.BoolProperty(
+        name="Share Downloads on the Network",
+        description="Let other workstations of the local network get the files of the shared store from this one, instead of downloading them from the internet",
+        default=False,
+        update=updatePeerCache,
+    )
+
+    peer_cache_port: bpy.props.IntProperty(
+        name="Port",
+        description="Port on which downloads are shared with other workstations",
+        default=PEER_CACHE_PORT,
+        min=1,
+        max=65535,
+        update=updatePeerCache,
+    )
+
+    peer_cache_address: bpy.props.StringProperty(
+        name="Address",
+        description="Address of the network interface on which downloads are shared (0.0.0.0 for all of them)",
+        default=PEER_CACHE_ADDRESS,
+        update=updatePeerCache,
+    )
+
+    peer_cache_allowed: bpy.props.StringProperty(
+        name="Allowed Networks",
+        description="Only share downloads with workstations of these comma separated addresses or subnets, like 192.168.1.0/24 (empty for any)",
+        default="",
+        update=updatePeerCache,
+    )
+
+    peer_cache_secret: bpy.props.StringProperty(
+        name="Shared Secret",
+        description="Password that all the workstations sharing downloads must use. Downloads are neither shared nor asked for without it",
+        default="",
+        subtype='PASSWORD',
+        update=updatePeerCache,
+    )
+
+    peer_cache_peers: bpy.props.StringProperty(
+        name="Peers",
+        description="Workstations to ask for a file before downloading it from the internet, as comma separated host:port addresses",
+        default="",
+    )
+
+    download_segments: bpy.props.IntProperty(
+        name="Connections per Large File",
+        description="Large files like HDRIs and texture archives are downloaded over this many parallel connections (1 to disable)",
+        default=DOWNLOAD_SEGMENTS,
+        min=1,
+        max=16,
+    )
+
     def draw(self, context):
         layout = self.layout
 
@@ -92,6 +233,26 @@ class LilySurfaceScraperPreferences(bpy.types.AddonPreferences):
         layout.label(text="It can either be relative to the blend file, or global to all files.")
         layout.label(text="If it is relative, you must always save the blend file before importing materials and worlds.")
         layout.prop(self, "texture_dir")
+        row = layout.row()
+        row.prop(self, "shard_assets")
+        row.operator("object.lily_migrate_texture_library")
+        row = layout.row()
+        row.operator("object.lily_export_bundle", text="Export Bundle")
+        row.operator("object.lily_import_bundle", text="Import Bundle")
+
+        layout.label(text="Downloaded files are shared between projects through hard links to a common store.")
+        row = layout.row()
+        row.prop(self, "use_content_store")
+        row.prop(self, "content_store_dir")
+
+        layout.label(text="Variants not used for a long time are removed when the texture directory exceeds its quota.")
+        layout.label(text="Textures used by the open file and pinned assets are always kept.")
+        row = layout.row()
+        row.prop(self, "texture_cache_quota")
+        row.prop(self, "pinned_assets")
+        row = layout.row()
+        row.operator("object.lily_clean_texture_cache", text="Preview Cleaning").dry_run = True
+        row.operator("object.lily_clean_texture_cache", text="Clean Now").dry_run = False
 
         layout.label(text="For the import of lights from ieslibrary a valid API-Key is needed.")
         layout.label(text="Get the API-Key from ieslibrary.com (login needed)")
@@ -136,6 +297,30 @@ class LilySurfaceScraperPreferences(bpy.types.AddonPreferences):
         # textures.separator()
         textures.prop(self, "ies_pack_files")
 
+        network = layout.box()
+        network.label(text="Network settings")
+        network.separator()
+        network.label(text="Requests to texture providers are aborted after these delays.")
+        row = network.row()
+        row.prop(self, "connect_timeout")
+        row.prop(self, "read_timeout")
+        row = network.row()
+        row.prop(self, "http_retries")
+        row.prop(self, "stall_time")
+        network.prop(self, "hedge_requests")
+        network.prop(self, "verify_checksums")
+        network.label(text="Responses of texture providers are cached in the texture directory.")
+        network.prop(self, "http_cache_size")
+        network.prop(self, "download_segments")
+        network.label(text="Workstations of the local network can get files from each other's shared store.")
+        row = network.row()
+        row.prop(self, "peer_cache_serve")
+        row.prop(self, "peer_cache_address")
+        row.prop(self, "peer_cache_port")
+        network.prop(self, "peer_cache_allowed")
+        network.prop(self, "peer_cache_secret")
+        network.prop(self, "peer_cache_peers")
+
 # -----------------------------------------------------------------------------
 
 classes = (LilySurfaceScraperPreferences,)
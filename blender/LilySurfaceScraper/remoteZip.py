@@ -0,0 +1,452 @@
+# Copyright (c) 2019 - 2024 Elie Michel
+#
+# This file is part of LilySurfaceScraper, a Blender add-on to import
+# materials from a single URL. It is released under the terms of the GPLv3
+# license. See the LICENSE.md file for the full text.
+
+"""
+Selective extraction of remote zip archives. Texture zips also contain
+preview renders, .usdc/.mtlx files and maps that we do not use, so rather
+than downloading the whole archive, its central directory is read with HTTP
+Range requests and only the entries that are needed are downloaded.
+
+RemoteFile is a read-only, seekable file object backed by Range requests,
+so that the standard zipfile module does all the parsing (zip64, compression
+methods, CRC checks). Each wanted entry is read through a single streamed
+request covering exactly its bytes.
+
+When the server does not support ranges, the zip is streamed instead: local
+file headers are parsed as bytes arrive and each wanted entry is inflated
+directly to its final file while the download goes on, so that the archive
+itself is never written to disk.
+
+When the whole zip had to be downloaded, extractEntries inflates the wanted
+entries in parallel, zlib releasing the GIL, into preallocated files.
+
+This module must not use the Blender API.
+"""
+
+import concurrent.futures
+import io
+import os
+import re
+import shutil
+import struct
+import zipfile
+import zlib
+
+import requests
+
+from .downloadHandler import DownloadError, TransientDownloadError, RangeNotSupported, StallWatchdog, PART_SUFFIX, preallocate
+from .settings import STALL_TIME
+
+LOCAL_HEADER_SIGNATURE = b"PK\x03\x04"
+DATA_DESCRIPTOR_SIGNATURE = b"PK\x07\x08"
+CENTRAL_DIRECTORY_SIGNATURE = b"PK\x01\x02"
+END_OF_CENTRAL_DIRECTORY_SIGNATURE = b"PK\x05\x06"
+
+
+def entryPath(name):
+    """Path, relative to the extraction directory, where the zip entry
+    called name is extracted. It never points outside of this directory."""
+    parts = [part for part in name.replace("\\", "/").split("/") if part not in ("", ".", "..")]
+    if not parts:
+        raise zipfile.BadZipFile("Invalid entry name {}".format(name))
+    parts[0] = os.path.splitdrive(parts[0])[1] or "_"
+    return os.path.join(*parts)
+
+
+def extractEntry(zip_ref, info, target_dir):
+    """Extract an entry of an open ZipFile and return its path relative to
+    target_dir. The file is written next to its target then renamed, so that
+    an existing file (possibly a link) is replaced rather than overwritten,
+    and nothing is left behind if the entry cannot be read."""
+    if not isinstance(info, zipfile.ZipInfo):
+        info = zip_ref.getinfo(info)
+    relpath = entryPath(info.filename)
+    target = os.path.join(target_dir, relpath)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    try:
+        with zip_ref.open(info) as source, open(target + PART_SUFFIX, "wb") as f:
+            preallocate(f, info.file_size)
+            shutil.copyfileobj(source, f, 1 << 20)
+    except BaseException:
+        try:
+            os.remove(target + PART_SUFFIX)
+        except OSError:
+            pass
+        raise
+    os.replace(target + PART_SUFFIX, target)
+    return relpath
+
+
+def extractEntries(zip_ref, infos, target_dir, max_workers=None):
+    """Extract several entries of a ZipFile opened from a path, in parallel.
+    Return their paths relative to target_dir, in the same order."""
+    infos = list(infos)
+    if len(infos) <= 1:
+        return [extractEntry(zip_ref, info, target_dir) for info in infos]
+    max_workers = min(len(infos), max_workers or os.cpu_count() or 1)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="LilyUnzip") as executor:
+        # largest first, so that they do not end up last on a single thread
+        order = sorted(range(len(infos)), key=lambda i: -infos[i].file_size)
+        futures = {i: executor.submit(extractEntry, zip_ref, infos[i], target_dir) for i in order}
+        return [futures[i].result() for i in range(len(infos))]
+
+
+class RemoteFile(io.RawIOBase):
+    # The end of central directory record is at most this far from the end
+    tail_size = 64 * 1024 + 22
+    # Minimum size of the requests sent to serve reads outside of a stream
+    block_size = 64 * 1024
+
+    def __init__(self, session_handler, url, timeout=None, retries=None, progress_callback=None):
+        self.session_handler = session_handler
+        self.url = url
+        self.timeout = timeout
+        self.retries = retries
+        self.progress_callback = progress_callback
+        self.bytes_received = 0
+        self.validator = None
+        self._pos = 0
+        self._buffer = b""
+        self._buffer_start = 0
+        self._stream = None
+        self._stream_pos = 0
+        self._stream_end = 0
+
+        # Reading the tail tells both the size of the file and whether ranges are supported
+        with self._get("bytes=-{}".format(self.tail_size)) as r:
+            self.size = self._totalSize(r)
+            self.validator = self._validator(r)
+            self._buffer = r.content
+        self._buffer_start = self.size - len(self._buffer)
+        self._received(len(self._buffer))
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += self.size
+        self._pos = max(0, offset)
+        return self._pos
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.size - self._pos
+        size = min(size, self.size - self._pos)
+        if size <= 0:
+            return b""
+
+        offset = self._pos - self._buffer_start
+        if 0 <= offset and offset + size <= len(self._buffer):
+            data = self._buffer[offset:offset + size]
+        elif self._stream is not None and self._stream_pos == self._pos and self._pos + size <= self._stream_end:
+            data = self._readStream(size)
+        else:
+            end = min(self.size, self._pos + max(size, self.block_size))
+            with self._get("bytes={}-{}".format(self._pos, end - 1)) as r:
+                self._buffer = r.content
+            self._buffer_start = self._pos
+            self._received(len(self._buffer))
+            data = self._buffer[:size]
+        self._pos += len(data)
+        return data
+
+    def readinto(self, b):
+        data = self.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+    def stream(self, start, end):
+        """Read bytes from start to end through a single streamed request,
+        for sequential reads of a large span such as a zip entry"""
+        self._closeStream()
+        if start >= self._buffer_start and end <= self._buffer_start + len(self._buffer):
+            return  # already there
+        self._stream = self._get("bytes={}-{}".format(start, end - 1))
+        self._stream_pos = start
+        self._stream_end = end
+
+    def _readStream(self, size):
+        chunks = []
+        remaining = size
+        while remaining > 0:
+            chunk = self._stream.raw.read(remaining)
+            if not chunk:
+                raise DownloadError("Connection closed while reading {}".format(self.url))
+            chunks.append(chunk)
+            remaining -= len(chunk)
+        self._stream_pos += size
+        self._received(size)
+        return b"".join(chunks)
+
+    def close(self):
+        self._closeStream()
+        super().close()
+
+    def _closeStream(self):
+        if self._stream is not None:
+            self._stream.close()
+            self._stream = None
+
+    def _get(self, byte_range):
+        """Send a range request and return the streamed response, that must be
+        closed. Any other answer than a partial one is closed without reading
+        its body, which may be the whole file."""
+        # Compressed transfers would make ranges meaningless
+        headers = {"Range": byte_range, "Accept-Encoding": "identity"}
+        if self.validator is not None:
+            headers["If-Range"] = self.validator
+        r = self.session_handler.get(self.url, headers=headers, stream=True,
+                                     timeout=self.timeout, retries=self.retries)
+        if r.status_code == 206:
+            return r
+        r.close()
+        if r.status_code == 200 and self.validator is not None:
+            raise DownloadError("{} changed while being read".format(self.url))
+        if r.status_code == 200:
+            raise RangeNotSupported("{} does not support range requests".format(self.url))
+        raise DownloadError("Could not fetch {} (status {})".format(self.url, r.status_code))
+
+    def _received(self, byte_count):
+        self.bytes_received += byte_count
+        if self.progress_callback is not None:
+            self.progress_callback(byte_count)
+
+    @staticmethod
+    def _totalSize(response):
+        match = re.match(r"bytes \d+-\d+/(\d+)", response.headers.get("Content-Range", ""))
+        if match is None:
+            raise RangeNotSupported("Missing Content-Range in response to a range request")
+        return int(match.group(1))
+
+    @staticmethod
+    def _validator(response):
+        validator = response.headers.get("ETag", response.headers.get("Last-Modified"))
+        # Weak ETags cannot be used in If-Range
+        if validator is None or validator.startswith("W/"):
+            return None
+        return validator
+
+
+def extractRemoteZip(session_handler, url, target_dir, is_wanted, timeout=None, retries=None, progress_callback=None):
+    """Extract to target_dir the entries of the zip at url whose name satisfies
+    is_wanted(name), downloading only these entries. Return the paths of the
+    extracted files, relative to target_dir. Raise RangeNotSupported when the server cannot serve
+    parts of the file, in which case the whole zip must be downloaded."""
+    with RemoteFile(session_handler, url, timeout, retries, progress_callback) as remote:
+        with zipfile.ZipFile(remote) as zip_ref:
+            infos = zip_ref.infolist()
+            # An entry spans from its local header to the next entry, or to the central directory
+            boundaries = sorted([info.header_offset for info in infos] + [zip_ref.start_dir])
+            wanted = [info for info in infos if not info.is_dir() and is_wanted(info.filename)]
+            wanted.sort(key=lambda info: info.header_offset)
+
+            namelist = []
+            for info in wanted:
+                end = next(b for b in boundaries if b > info.header_offset)
+                remote.stream(info.header_offset, end)
+                namelist.append(extractEntry(zip_ref, info, target_dir))
+
+        print("Extracted {} of {} entries from {} ({} bytes of {} downloaded)".format(
+            len(wanted), len(infos), url, remote.bytes_received, remote.size))
+    return namelist
+
+
+class ZipStreamExtractor():
+    """Extract the entries of a zip while reading it sequentially, using the
+    local file headers only. Entries using a data descriptor (sizes given
+    after the data) are supported when they are deflated, since the deflate
+    stream tells where it ends."""
+    chunk_size = 1 << 20
+
+    def __init__(self, read, target_dir, is_wanted):
+        """read: function returning the next bytes of the zip, b"" at the end"""
+        self._read = read
+        self._pending = b""
+        self.target_dir = target_dir
+        self.is_wanted = is_wanted
+
+    def extractAll(self):
+        """Return the paths of the extracted files, relative to target_dir"""
+        namelist = []
+        signature = self._readSignature()
+        while signature == LOCAL_HEADER_SIGNATURE:
+            name = self._extractEntry()
+            if name is not None:
+                namelist.append(name)
+            signature = self._readSignature()
+        # the central directory follows the entries, it is not needed but
+        # anything else means that entries may be missing
+        if not signature:
+            raise zipfile.BadZipFile("Truncated zip")
+        if signature not in (CENTRAL_DIRECTORY_SIGNATURE, END_OF_CENTRAL_DIRECTORY_SIGNATURE):
+            raise zipfile.BadZipFile("Unexpected data after the entries of the zip")
+        return namelist
+
+    def _extractEntry(self):
+        header = self._readExactly(26)
+        _, flags, method, _, _, crc, compressed_size, size, name_length, extra_length = struct.unpack("<HHHHHIIIHH", header)
+        name = self._readExactly(name_length).decode("utf-8" if flags & 0x800 else "cp437")
+        extra = self._readExactly(extra_length)
+        zip64 = compressed_size == 0xFFFFFFFF or size == 0xFFFFFFFF
+        if zip64:
+            size, compressed_size = self._zip64Sizes(extra, size, compressed_size)
+
+        has_descriptor = flags & 0x08
+        if flags & 0x01:
+            raise zipfile.BadZipFile("Encrypted entry {}".format(name))
+        if method not in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED):
+            raise zipfile.BadZipFile("Unsupported compression method {} for {}".format(method, name))
+        if has_descriptor and method == zipfile.ZIP_STORED:
+            raise zipfile.BadZipFile("Cannot stream stored entry {} without sizes".format(name))
+
+        wanted = not name.endswith("/") and self.is_wanted(name)
+        decompressor = zlib.decompressobj(-15) if method == zipfile.ZIP_DEFLATED else None
+        if not wanted and not has_descriptor:
+            self._skip(compressed_size)
+            return None
+
+        entry_data = self._entryData(decompressor, None if has_descriptor else compressed_size)
+        if not wanted:
+            # deflated data must still be inflated to find where it ends
+            for _ in entry_data:
+                pass
+            if has_descriptor:
+                self._readDescriptor(zip64)
+            return None
+
+        relpath = entryPath(name)
+        target = os.path.join(self.target_dir, relpath)
+        part_path = target + PART_SUFFIX
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        actual_crc = 0
+        with open(part_path, "wb") as f:
+            if not has_descriptor:
+                preallocate(f, size)
+            for data in entry_data:
+                f.write(data)
+                actual_crc = zlib.crc32(data, actual_crc)
+
+        if has_descriptor:
+            crc = self._readDescriptor(zip64)
+        if actual_crc != crc:
+            os.remove(part_path)
+            raise zipfile.BadZipFile("Bad CRC-32 for {}".format(name))
+        os.replace(part_path, target)
+        return relpath
+
+    def _entryData(self, decompressor, compressed_size):
+        """Yield the uncompressed data of an entry. If compressed_size is
+        None, read until the end of the deflate stream."""
+        remaining = compressed_size
+        while remaining is None or remaining > 0:
+            chunk = self._readAtMost(self.chunk_size if remaining is None else min(remaining, self.chunk_size))
+            if not chunk:
+                raise zipfile.BadZipFile("Truncated zip")
+            if remaining is not None:
+                remaining -= len(chunk)
+            if decompressor is None:
+                yield chunk
+                continue
+            yield decompressor.decompress(chunk)
+            if decompressor.eof:
+                # give back what follows the deflate stream
+                self._pending = decompressor.unused_data + self._pending
+                return
+        if decompressor is not None:
+            yield decompressor.flush()
+
+    def _readDescriptor(self, zip64):
+        """Read the data descriptor following an entry and return its CRC"""
+        data = self._readExactly(4)
+        if data == DATA_DESCRIPTOR_SIGNATURE:
+            data = self._readExactly(4)
+        self._readExactly(16 if zip64 else 8)  # sizes
+        return struct.unpack("<I", data)[0]
+
+    @staticmethod
+    def _zip64Sizes(extra, size, compressed_size):
+        offset = 0
+        while offset + 4 <= len(extra):
+            header_id, length = struct.unpack("<HH", extra[offset:offset + 4])
+            if header_id == 0x0001:
+                values = extra[offset + 4:offset + 4 + length]
+                if size == 0xFFFFFFFF:
+                    size, = struct.unpack("<Q", values[:8])
+                    values = values[8:]
+                if compressed_size == 0xFFFFFFFF:
+                    compressed_size, = struct.unpack("<Q", values[:8])
+                break
+            offset += 4 + length
+        return size, compressed_size
+
+    def _skip(self, byte_count):
+        while byte_count > 0:
+            chunk = self._readAtMost(min(byte_count, self.chunk_size))
+            if not chunk:
+                raise zipfile.BadZipFile("Truncated zip")
+            byte_count -= len(chunk)
+
+    def _readAtMost(self, size):
+        if not self._pending:
+            self._pending = self._read()
+        data, self._pending = self._pending[:size], self._pending[size:]
+        return data
+
+    def _readSignature(self):
+        """Read the 4 bytes of a signature, b"" at the end of the zip"""
+        data = self._readAtMost(4)
+        if not data:
+            return b""
+        return data + self._readExactly(4 - len(data))
+
+    def _readExactly(self, size):
+        data = b""
+        while len(data) < size:
+            chunk = self._readAtMost(size - len(data))
+            if not chunk:
+                raise zipfile.BadZipFile("Truncated zip")
+            data += chunk
+        return data
+
+
+def streamExtractZip(session_handler, url, target_dir, is_wanted, timeout=None, retries=None,
+                     progress_callback=None, stall_time=STALL_TIME):
+    """Download the zip at url in a single stream and extract on the fly the
+    entries whose name satisfies is_wanted(name). Return the paths of the
+    extracted files, relative to target_dir."""
+    with session_handler.get(url, stream=True, timeout=timeout, retries=retries) as r:
+        if r.status_code != 200:
+            raise DownloadError("Could not fetch {} (status {})".format(url, r.status_code))
+        with StallWatchdog(r, stall_time=stall_time) as watchdog:
+            chunks = r.iter_content(chunk_size=ZipStreamExtractor.chunk_size)
+
+            def read():
+                data = next(chunks, b"")
+                watchdog.feed(len(data))
+                if progress_callback is not None:
+                    progress_callback(len(data))
+                return data
+
+            try:
+                namelist = ZipStreamExtractor(read, target_dir, is_wanted).extractAll()
+            except (requests.exceptions.RequestException, zipfile.BadZipFile) as err:
+                # an aborted response may also look like a truncated zip
+                if watchdog.stalled:
+                    raise TransientDownloadError("Download of {} stalled".format(url))
+                if isinstance(err, zipfile.BadZipFile):
+                    raise
+                raise TransientDownloadError("Download of {} interrupted: {}".format(url, err))
+    print("Extracted {} entries from {} while downloading it".format(len(namelist), url))
+    return namelist
@@ -0,0 +1,188 @@
+# Copyright (c) 2019 - 2024 Elie Michel
+#
+# This file is part of LilySurfaceScraper, a Blender add-on to import
+# materials from a single URL. It is released under the terms of the GPLv3
+# license. See the LICENSE.md file for the full text.
+
+"""
+On-disk cache of the responses of provider APIs (the JSON, HTML and XML pages
+scrapers parse). Entries are revalidated using ETag/Last-Modified once their
+time to live is over, and the least recently used ones are evicted when the
+cache grows beyond its size limit.
+
+Each entry is stored as two files named after the hash of its URL: <key>.body
+holds the raw content and <key>.json the response headers needed for
+revalidation. The modification time of the .json file is the last access time
+used for LRU eviction. URLs themselves are not written down because some of
+them contain API keys.
+
+This module must not use the Blender API.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+
+import requests
+
+
+class CachedResponse():
+    """Minimal stand-in for requests.Response, built from a cache entry"""
+
+    def __init__(self, content, encoding, headers):
+        self.content = content
+        self.encoding = encoding
+        self.headers = headers
+
+    @property
+    def text(self):
+        return self.content.decode(self.encoding or "utf-8", errors="replace")
+
+    def json(self):
+        return json.loads(self.text)
+
+
+class ResponseCache():
+    _instances = {}
+    _instances_lock = threading.Lock()
+
+    @classmethod
+    def getInstance(cls, cache_dir, max_size):
+        """Get the cache stored in cache_dir, shared by all threads"""
+        with cls._instances_lock:
+            cache = cls._instances.get(cache_dir)
+            if cache is None:
+                cache = cls(cache_dir, max_size)
+                cls._instances[cache_dir] = cache
+            cache.max_size = max_size
+            return cache
+
+    def __init__(self, cache_dir, max_size):
+        """cache_dir: directory where entries are stored
+        max_size: total size of the cached bodies above which entries get evicted, in bytes"""
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def _key(url):
+        return hashlib.sha1(url.encode("utf-8")).hexdigest()
+
+    def _paths(self, url):
+        base = os.path.join(self.cache_dir, self._key(url))
+        return base + ".json", base + ".body"
+
+    def fetch(self, url, send, ttl, revalidate=False):
+        """Response to url, taken from the cache if it was stored (or
+        revalidated) less than ttl seconds ago, unless revalidate is true.
+        Otherwise send(headers) is called to send a GET request with these
+        extra headers, conditional when url is cached, and must return the
+        requests.Response. Return None if the provider did not answer with
+        a success; an outdated cached response is better than nothing when
+        the request fails."""
+        entry, cached = self.lookup(url)
+        if entry is not None and entry["age"] < ttl and not revalidate:
+            return cached
+        try:
+            r = send(self.validationHeaders(entry))
+        except requests.exceptions.RequestException as err:
+            print("Could not fetch {}: {}".format(url, err))
+            return cached
+        if r.status_code == 304 and cached is not None:
+            self.refresh(url)
+            return cached
+        if r.status_code != 200:
+            return None
+        return self.store(url, r)
+
+    def lookup(self, url):
+        """Return the entry header dict (with an 'age' field, in seconds)
+        and its response, or (None, None) if url is not cached"""
+        meta_path, body_path = self._paths(url)
+        with self._lock:
+            try:
+                with open(meta_path, "r") as f:
+                    entry = json.load(f)
+                with open(body_path, "rb") as f:
+                    content = f.read()
+                os.utime(meta_path)  # mark as recently used
+            except (OSError, ValueError):
+                return None, None
+        entry["age"] = time.time() - entry["stored_at"]
+        return entry, CachedResponse(content, entry["encoding"], entry["headers"])
+
+    def validationHeaders(self, entry):
+        """Headers that turn a request into a conditional request for entry"""
+        headers = {}
+        if entry is None:
+            return headers
+        if "ETag" in entry["headers"]:
+            headers["If-None-Match"] = entry["headers"]["ETag"]
+        if "Last-Modified" in entry["headers"]:
+            headers["If-Modified-Since"] = entry["headers"]["Last-Modified"]
+        return headers
+
+    def store(self, url, response):
+        """Save a requests.Response with status 200 and return its cached version"""
+        headers = {k: response.headers[k] for k in ("ETag", "Last-Modified", "Content-Type") if k in response.headers}
+        entry = {
+            "stored_at": time.time(),
+            "encoding": response.encoding or response.apparent_encoding,
+            "headers": headers,
+        }
+        meta_path, body_path = self._paths(url)
+        with self._lock:
+            # The body is written first, an entry is valid once its .json exists
+            self._atomicWrite(body_path, response.content, "wb")
+            self._atomicWrite(meta_path, json.dumps(entry), "w")
+            self._evict()
+        return CachedResponse(response.content, entry["encoding"], headers)
+
+    def refresh(self, url):
+        """Restart the time to live of an entry that the server confirmed (304)"""
+        meta_path, _ = self._paths(url)
+        with self._lock:
+            try:
+                with open(meta_path, "r") as f:
+                    entry = json.load(f)
+                entry["stored_at"] = time.time()
+                self._atomicWrite(meta_path, json.dumps(entry), "w")
+            except (OSError, ValueError):
+                pass
+
+    def _atomicWrite(self, path, data, mode):
+        tmp_path = "{}.{}.tmp".format(path, threading.get_ident())
+        with open(tmp_path, mode) as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def _evict(self):
+        """Remove least recently used entries until the cache fits in max_size"""
+        entries = []
+        total_size = 0
+        for filename in os.listdir(self.cache_dir):
+            if not filename.endswith(".json"):
+                continue
+            meta_path = os.path.join(self.cache_dir, filename)
+            body_path = meta_path[:-len(".json")] + ".body"
+            try:
+                size = os.path.getsize(body_path)
+                last_used = os.path.getmtime(meta_path)
+            except OSError:
+                continue
+            entries.append((last_used, size, meta_path, body_path))
+            total_size += size
+
+        entries.sort()
+        for _, size, meta_path, body_path in entries:
+            if total_size <= self.max_size:
+                break
+            for path in (meta_path, body_path):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            total_size -= size
@@ -0,0 +1,222 @@
+# Copyright (c) 2019 - 2024 Elie Michel
+#
+# This file is part of LilySurfaceScraper, a Blender add-on to import
+# materials from a single URL. It is released under the terms of the GPLv3
+# license. See the LICENSE.md file for the full text.
+
+"""
+In-memory inverted index, to search assets by name, id, provider and tags
+as the user types.
+
+Texts are split into lower case words, camel case and numbers being split
+as well ("WoodFloor041" gives "woodfloor041", "wood", "floor" and "041").
+Each word maps to the set of assets it appears in, and the sorted list of all
+the words gives those starting with a prefix by bisection.
+
+A query matches the assets that match all of its words. A word of the query
+matches the words of the index equal to it, starting with it, or, when it is
+long enough and has no digit, within one typo of it (a letter missing, extra,
+wrong, or swapped with the next one). Typos are found by looking up the words
+obtained by deleting one letter of the query word in a table of the words
+obtained the same way from the indexed words, rather than by comparing the
+query with every indexed word.
+
+Words are also recorded by field: those of the name and id of an asset,
+among which those leading a word of them ("wood" for "WoodFloor041" but not
+for "AsphaltWood"), and the others, e.g. tags. Matching assets are ranked by
+where each word of the query matched, leading words first and tags last, then
+by how well it matched, then by name.
+
+This module must not use the Blender API.
+"""
+
+import bisect
+import functools
+import re
+import threading
+
+WORD_PATTERN = re.compile(r"[^\W_]+")
+SUBWORD_PATTERN = re.compile(r"[A-Z]+(?![a-z])|[A-Z]?[a-z]+|[0-9]+")
+
+# shorter query words only match exactly or as a prefix
+FUZZY_MIN_LENGTH = 4
+
+
+
+@functools.lru_cache(maxsize=1 << 16)
+def tokenize(text):
+    """Set of the words of text, as indexed"""
+    tokens = set()
+    for word in WORD_PATTERN.findall(text):
+        tokens.add(word.lower())
+        tokens.update(part.lower() for part in SUBWORD_PATTERN.findall(word))
+    return frozenset(tokens)
+
+
+@functools.lru_cache(maxsize=1 << 16)
+def leadingTokens(text):
+    """Set of the words of text that lead one of its words"""
+    tokens = set()
+    for word in WORD_PATTERN.findall(text):
+        tokens.add(word.lower())
+        match = SUBWORD_PATTERN.match(word)
+        if match is not None:
+            tokens.add(match.group().lower())
+    return frozenset(tokens)
+
+
+def isFuzzy(word, min_length=FUZZY_MIN_LENGTH):
+    """True if word may be matched with a typo"""
+    return len(word) >= min_length and word.isalpha()
+
+
+def deletions(word):
+    """Words obtained by removing one letter of word"""
+    return {word[:i] + word[i + 1:] for i in range(len(word))}
+
+
+def isOneEditAway(a, b):
+    """True if a and b differ by at most one insertion, deletion,
+    substitution or swap of adjacent letters"""
+    if abs(len(a) - len(b)) > 1:
+        return False
+    if len(a) > len(b):
+        a, b = b, a
+    i = 0
+    while i < len(a) and a[i] == b[i]:
+        i += 1
+    if len(a) == len(b):
+        return a[i + 1:] == b[i + 1:] or (a[i + 2:] == b[i + 2:] and a[i:i + 2] == b[i:i + 2][::-1])
+    return a[i:] == b[i + 1:]
+
+
+class SearchIndex():
+    def __init__(self):
+        self._postings = {}  # word -> set of keys
+        self._name_postings = {}  # word of a name -> set of keys
+        self._leading_postings = {}  # leading word of a name -> set of keys
+        self._keys = {}  # key -> (set of words, of words of names, of leading words of names)
+        self._deletions = {}  # word with one letter removed -> set of words
+        self._vocabulary = []  # sorted words, rebuilt when needed
+        self._vocabulary_dirty = False
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._keys)
+
+    def add(self, key, names, tags=()):
+        """Index key under the words of names (its name, id...) and of tags,
+        replacing what it was indexed under before"""
+        name_tokens = set()
+        leading_tokens = set()
+        for text in names:
+            if text:
+                name_tokens |= tokenize(text)
+                leading_tokens |= leadingTokens(text)
+        tokens = set(name_tokens)
+        for text in tags:
+            if text:
+                tokens |= tokenize(text)
+        with self._lock:
+            self._remove(key)
+            self._keys[key] = (tokens, name_tokens, leading_tokens)
+            for token in name_tokens:
+                self._name_postings.setdefault(token, set()).add(key)
+            for token in leading_tokens:
+                self._leading_postings.setdefault(token, set()).add(key)
+            for token in tokens:
+                keys = self._postings.get(token)
+                if keys is None:
+                    keys = self._postings[token] = set()
+                    # one letter shorter than the shortest query words matched with a typo
+                    if isFuzzy(token, FUZZY_MIN_LENGTH - 1):
+                        for variant in deletions(token):
+                            self._deletions.setdefault(variant, set()).add(token)
+                    self._vocabulary_dirty = True
+                keys.add(key)
+
+    def remove(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def search(self, query, limit=None):
+        """Keys matching all the words of query, best matches first"""
+        words = [word.lower() for word in WORD_PATTERN.findall(query)]
+        if not words:
+            return []
+        with self._lock:
+            if self._vocabulary_dirty:
+                self._vocabulary = sorted(self._postings)
+                self._vocabulary_dirty = False
+            keys = None
+            word_tiers = []
+            for word in words:
+                tiers = self._tiers(word)
+                matched = set().union(*tiers[-3:])
+                keys = matched if keys is None else keys & matched
+                if not keys:
+                    return []
+                word_tiers.append(tiers)
+
+        if len(words) == 1:
+            # ranked with set operations rather than key by key
+            ranked = []
+            seen = set()
+            for tier in word_tiers[0]:
+                tier = tier - seen
+                ranked += sorted(tier)
+                seen |= tier
+        else:
+            def score(key):
+                return sum(next(i for i, tier in enumerate(tiers) if key in tier) for tiers in word_tiers)
+            ranked = sorted(keys, key=lambda key: (score(key), key))
+        return ranked if limit is None else ranked[:limit]
+
+    def _tiers(self, word):
+        """Sets of the keys matching word, from the best matches to the
+        worst: exactly, by prefix and with a typo, in leading words of names,
+        in names, then anywhere. The last three sets hold all the matches."""
+        matches = self._matches(word)
+        # built anew, as ranking happens out of the lock
+        return [set().union(*(postings[token] for token in tokens if token in postings))
+                for postings in (self._leading_postings, self._name_postings, self._postings)
+                for tokens in matches]
+
+    def _matches(self, word):
+        """Lists of the words of the index matching word exactly, by prefix
+        and with a typo"""
+        exact = [word] if word in self._postings else []
+        start = bisect.bisect_left(self._vocabulary, word)
+        end = bisect.bisect_left(self._vocabulary, word + "\U0010ffff", start)
+        prefix = [token for token in self._vocabulary[start:end] if token != word]
+        if not isFuzzy(word):
+            return exact, prefix, []
+        candidates = set(self._deletions.get(word, ()))  # one letter missing from the query
+        for variant in deletions(word):
+            if variant in self._postings:
+                candidates.add(variant)  # one extra letter in the query
+            candidates |= self._deletions.get(variant, set())  # one letter wrong or swapped
+        fuzzy = [token for token in candidates if not token.startswith(word) and isOneEditAway(word, token)]
+        return exact, prefix, fuzzy
+
+    def _remove(self, key):
+        tokens, name_tokens, leading_tokens = self._keys.pop(key, ((), (), ()))
+        for postings, field_tokens in ((self._name_postings, name_tokens), (self._leading_postings, leading_tokens)):
+            for token in field_tokens:
+                keys = postings[token]
+                keys.discard(key)
+                if not keys:
+                    del postings[token]
+        for token in tokens:
+            keys = self._postings[token]
+            keys.discard(key)
+            if keys:
+                continue
+            del self._postings[token]
+            if isFuzzy(token, FUZZY_MIN_LENGTH - 1):
+                for variant in deletions(token):
+                    tokens = self._deletions[variant]
+                    tokens.discard(token)
+                    if not tokens:
+                        del self._deletions[variant]
+            self._vocabulary_dirty = True
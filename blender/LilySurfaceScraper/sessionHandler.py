@@ -0,0 +1,317 @@
+# Copyright (c) 2019 - 2024 Elie Michel
+#
+# This file is part of LilySurfaceScraper, a Blender add-on to import
+# materials from a single URL. It is released under the terms of the GPLv3
+# license. See the LICENSE.md file for the full text.
+
+"""
+Shared HTTP transport used by all scrapers.
+
+A bare requests.get() opens a new connection (TCP + TLS handshake) for each
+call, so importing a single material used to pay one handshake per map. This
+module keeps one connection pool per host alive for the whole Blender session.
+requests.Session objects are not guaranteed to be thread-safe, so each thread
+gets its own Session, but they all share the same HTTPAdapter hence the same
+keep-alive connection pools.
+
+GET requests are idempotent, so they are retried on connection errors and on
+transient server errors (429, 5xx), after a jittered exponential backoff.
+A circuit breaker per host makes requests fail right away while a provider
+is down, rather than having every queued download wait for its own timeout.
+
+Small metadata requests can be hedged: if the response has not arrived after
+the host's 95th percentile latency, an identical request is sent and the
+first answer wins. Hedges are limited by a budget, so that they never exceed
+a small fraction of the requests.
+
+This module must not use the Blender API.
+"""
+
+import bisect
+import concurrent.futures
+import random
+import threading
+import time
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .settings import (
+    CONNECT_TIMEOUT, READ_TIMEOUT, POOL_MAXSIZE,
+    HTTP_RETRIES, RETRY_BACKOFF, RETRY_BACKOFF_MAX,
+    CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_COOLDOWN,
+    HEDGE_QUANTILE, HEDGE_DEFAULT_DELAY, HEDGE_MIN_SAMPLES, HEDGE_BUDGET,
+)
+
+DEFAULT_HEADERS = {"User-Agent": "Mozilla/5.0"}  # fake user agent
+
+# Statuses worth retrying, all other ones are final answers
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+def backoffDelay(attempt, base=RETRY_BACKOFF, maximum=RETRY_BACKOFF_MAX):
+    """Delay before retry number attempt (starting at 0), using exponential
+    backoff with full jitter so that clients failing together do not retry
+    together"""
+    return random.uniform(0, min(maximum, base * 2 ** attempt))
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """Raised without sending anything when a host failed repeatedly"""
+    pass
+
+
+class CircuitBreaker():
+    """Tracks consecutive failures of a host. After failure_threshold of them
+    the circuit opens and requests fail fast for cooldown seconds, after which
+    a single trial request is let through (half-open) to probe the host."""
+
+    def __init__(self, failure_threshold=CIRCUIT_FAILURE_THRESHOLD, cooldown=CIRCUIT_COOLDOWN):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self._trial_thread = None  # thread sending the trial request, if any
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at < self.cooldown or self._trial_thread is not None:
+                return False
+            self._trial_thread = threading.get_ident()
+            return True
+
+    def recordSuccess(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_thread = None
+
+    def recordFailure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_thread = None
+            if self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+    def releaseTrial(self):
+        """Let another trial request through if the calling thread was sending
+        one, whatever happened to it"""
+        with self._lock:
+            if self._trial_thread == threading.get_ident():
+                self._trial_thread = None
+
+
+class LatencyHistogram():
+    """Histogram of response latencies of a host, with logarithmic buckets
+    from 10ms to about 80s"""
+    bounds = [0.01 * 1.25 ** i for i in range(41)]
+
+    def __init__(self):
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.total = 0
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self.counts[bisect.bisect_left(self.bounds, seconds)] += 1
+            self.total += 1
+
+    def quantile(self, q):
+        """Upper bound of the bucket containing quantile q, None if empty"""
+        with self._lock:
+            if self.total == 0:
+                return None
+            rank = q * self.total
+            seen = 0
+            for i, count in enumerate(self.counts):
+                seen += count
+                if seen >= rank:
+                    return self.bounds[min(i, len(self.bounds) - 1)]
+
+
+class HedgeBudget():
+    """Token bucket: each request earns `ratio` token, each hedge costs one"""
+
+    def __init__(self, ratio=HEDGE_BUDGET, burst=2.0):
+        self.ratio = ratio
+        self.burst = burst
+        self.tokens = burst
+        self.hedged = 0
+        self._lock = threading.Lock()
+
+    def earn(self):
+        with self._lock:
+            self.tokens = min(self.burst, self.tokens + self.ratio)
+
+    def spend(self):
+        with self._lock:
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            self.hedged += 1
+            return True
+
+
+class SessionHandler():
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    @classmethod
+    def getInstance(cls):
+        """Return the process wide session handler, creating it on first use"""
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    cls._instance = cls()
+        return cls._instance
+
+    def __init__(self, pool_maxsize=POOL_MAXSIZE, connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT, retries=HTTP_RETRIES):
+        """pool_maxsize: number of keep-alive connections kept per host
+        connect_timeout, read_timeout: default timeouts, in seconds
+        retries: default number of retries of failed requests"""
+        # pool_connections is the number of hosts for which a pool is kept
+        self.adapter = HTTPAdapter(pool_connections=POOL_MAXSIZE, pool_maxsize=pool_maxsize)
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self._local = threading.local()
+        self._breakers = {}
+        self._latencies = {}
+        self._host_lock = threading.Lock()
+        self.hedge_budget = HedgeBudget()
+        self._hedge_executor = concurrent.futures.ThreadPoolExecutor(max_workers=8, thread_name_prefix="LilyHedge")
+
+    def getSession(self):
+        """Get the session of the calling thread"""
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = requests.Session()
+            session.headers.update(DEFAULT_HEADERS)
+            session.mount("https://", self.adapter)
+            session.mount("http://", self.adapter)
+            self._local.session = session
+        return session
+
+    def getCircuitBreaker(self, url):
+        host = urlparse(url).netloc
+        with self._host_lock:
+            if host not in self._breakers:
+                self._breakers[host] = CircuitBreaker()
+            return self._breakers[host]
+
+    def getLatencyHistogram(self, url):
+        host = urlparse(url).netloc
+        with self._host_lock:
+            if host not in self._latencies:
+                self._latencies[host] = LatencyHistogram()
+            return self._latencies[host]
+
+    def hedgeDelay(self, url):
+        """Time after which a request to url is hedged"""
+        histogram = self.getLatencyHistogram(url)
+        if histogram.total < HEDGE_MIN_SAMPLES:
+            return HEDGE_DEFAULT_DELAY
+        return histogram.quantile(HEDGE_QUANTILE)
+
+    def get(self, url, retries=None, **kwargs):
+        """Same as requests.get, but reusing pooled connections, enforcing
+        a timeout and retrying transient failures. Use it as a context
+        manager when stream=True so that the connection gets released to the
+        pool."""
+        return self.request("GET", url, retries=retries, **kwargs)
+
+    def head(self, url, retries=None, **kwargs):
+        return self.request("HEAD", url, retries=retries, **kwargs)
+
+    def request(self, method, url, retries=None, **kwargs):
+        """Send an idempotent request (GET or HEAD), retried at most retries
+        times. The response to the last attempt is returned even if its
+        status is a transient error; connection errors of the last attempt
+        are raised."""
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.timeout
+        retries = self.retries if retries is None else retries
+        breaker = self.getCircuitBreaker(url)
+        session = self.getSession()
+
+        for attempt in range(retries + 1):
+            if not breaker.allow():
+                raise CircuitOpenError("{} is unreachable, not retrying for now".format(urlparse(url).netloc))
+            last_attempt = attempt == retries
+            try:
+                r = session.request(method, url, **kwargs)
+                self.getLatencyHistogram(url).record(r.elapsed.total_seconds())
+            except requests.exceptions.RequestException as err:
+                breaker.recordFailure()
+                if last_attempt or not isinstance(err, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+                    raise
+                delay = backoffDelay(attempt)
+            else:
+                if r.status_code >= 500:
+                    breaker.recordFailure()
+                else:
+                    breaker.recordSuccess()
+                if r.status_code not in RETRY_STATUSES or last_attempt:
+                    return r
+                delay = self._retryAfter(r, backoffDelay(attempt))
+                r.close()
+            finally:
+                # the outcome was recorded above, unless something unexpected was raised
+                breaker.releaseTrial()
+            print("Request to {} failed, retrying in {:.1f}s".format(url, delay))
+            time.sleep(delay)
+
+    def hedgedGet(self, url, **kwargs):
+        """Same as get, for small non-streamed requests. If no response came
+        back after hedgeDelay(), a second identical request is sent, within
+        the limits of the hedge budget, and the first successful one is
+        returned."""
+        self.hedge_budget.earn()
+        primary = self._hedge_executor.submit(self.get, url, **kwargs)
+        try:
+            return primary.result(timeout=self.hedgeDelay(url))
+        except concurrent.futures.TimeoutError:
+            pass
+        if not self.hedge_budget.spend():
+            return primary.result()
+
+        print("Hedging slow request to {}".format(urlparse(url).netloc))
+        hedge = self._hedge_executor.submit(self.get, url, **kwargs)
+        pending = {primary, hedge}
+        error = None
+        while pending:
+            done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    for loser in pending:
+                        loser.add_done_callback(self._closeResponse)
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    @staticmethod
+    def _closeResponse(future):
+        if future.exception() is None:
+            future.result().close()
+
+    @staticmethod
+    def _retryAfter(response, default):
+        """Honor the Retry-After header, within reason"""
+        value = response.headers.get("Retry-After", "")
+        if value.isdigit():
+            return min(float(value), RETRY_BACKOFF_MAX)
+        return default
+
+    def connectionCount(self):
+        """Total number of connections opened so far, i.e. number of
+        handshakes paid (used for benchmarking)"""
+        pools = self.adapter.poolmanager.pools
+        with pools.lock:
+            return sum(pool.num_connections for pool in pools._container.values())
+
+    def close(self):
+        self._hedge_executor.shutdown(wait=False)
+        self.adapter.close()
@@ -25,3 +25,70 @@
 
 TEXTURE_DIR = "LilySurface"
 UNSUPPORTED_PROVIDER_ERR = "provider not supported. See the documentation for a list of supported providers."
+
+# Default network timeouts, in seconds (overridden by add-on preferences)
+CONNECT_TIMEOUT = 10.0
+READ_TIMEOUT = 60.0
+# Number of keep-alive connections kept open per host
+POOL_MAXSIZE = 16
+
+# Directory, inside the texture directory, where API responses are cached
+HTTP_CACHE_DIR = ".http_cache"
+# Default size limit of this cache, in MB
+HTTP_CACHE_SIZE = 64
+
+# Files larger than this (in bytes) are downloaded over several connections
+SEGMENTED_DOWNLOAD_THRESHOLD = 32 * 1024 * 1024
+# Default number of connections used for such files
+DOWNLOAD_SEGMENTS = 4
+
+# Maximum number of downloads running at the same time, over all providers
+SCHEDULER_MAX_WORKERS = POOL_MAXSIZE
+# Maximum number of downloads running at the same time from a single host
+SCHEDULER_PER_HOST = 6
+
+# Default number of retries of failed requests and interrupted downloads
+HTTP_RETRIES = 3
+# Base and maximum delay between two retries, in seconds
+RETRY_BACKOFF = 0.5
+RETRY_BACKOFF_MAX = 10.0
+# A transfer slower than STALL_MIN_SPEED bytes/s during STALL_TIME seconds is restarted
+STALL_MIN_SPEED = 16 * 1024
+STALL_TIME = 20.0
+# A host failing this many times in a row is considered down for CIRCUIT_COOLDOWN seconds
+CIRCUIT_FAILURE_THRESHOLD = 5
+CIRCUIT_COOLDOWN = 30.0
+
+# Metadata requests still pending after this quantile of the host's latency are hedged
+HEDGE_QUANTILE = 0.95
+# Hedging delay used until HEDGE_MIN_SAMPLES latencies were measured for a host, in seconds
+HEDGE_DEFAULT_DELAY = 1.5
+HEDGE_MIN_SAMPLES = 20
+# Maximum ratio of hedged requests
+HEDGE_BUDGET = 0.1
+
+# Machine wide store of downloaded files shared by all projects (~ is the user's home)
+CONTENT_STORE_DIR = "~/.cache/LilySurfaceScraper/store"
+
+# Default size limit of the texture directory, in GB (0 for no limit)
+TEXTURE_CACHE_QUOTA = 0
+# The quota is enforced at most once per this many seconds while textures get loaded
+TEXTURE_QUOTA_CHECK_INTERVAL = 60.0
+# The library index catches up with the changes made to the texture directory
+# by other Blender instances every this many seconds
+LIBRARY_REFRESH_INTERVAL = 5.0
+
+# Lock files shared by Blender instances are renewed by their owner within this
+# many seconds, and considered stale otherwise
+LOCK_LEASE = 30.0
+LOCK_POLL_INTERVAL = 0.5
+
+# Port on which the shared store is served to other workstations, when enabled
+PEER_CACHE_PORT = 8765
+# Address on which it is served, all interfaces by default
+PEER_CACHE_ADDRESS = "0.0.0.0"
+# Peers are on the local network, so they are given up on quickly
+PEER_CONNECT_TIMEOUT = 0.5
+PEER_READ_TIMEOUT = 5.0
+# Threads asking peers for the record of a URL, shared by all lookups
+PEER_LOOKUP_WORKERS = 16
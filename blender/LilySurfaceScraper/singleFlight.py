@@ -0,0 +1,75 @@
+# Copyright (c) 2019 - 2024 Elie Michel
+#
+# This file is part of LilySurfaceScraper, a Blender add-on to import
+# materials from a single URL. It is released under the terms of the GPLv3
+# license. See the LICENSE.md file for the full text.
+
+"""
+Coalescing of identical operations running at the same time. When a thumbnail
+worker and an import, or two operators, ask for the same URL or the same file
+simultaneously, only the first call actually runs and the others wait for it
+and share its result (or its exception).
+
+This module must not use the Blender API.
+"""
+
+import threading
+
+
+class _Call():
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight():
+    _instances = {}
+    _instances_lock = threading.Lock()
+
+    @classmethod
+    def getInstance(cls, name):
+        """Get the process wide group called name (e.g. 'fetch', 'download')"""
+        with cls._instances_lock:
+            if name not in cls._instances:
+                cls._instances[name] = cls()
+            return cls._instances[name]
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        # number of calls that were served by another in-flight call
+        self.suppressed = 0
+
+    def do(self, key, fn, *args, **kwargs):
+        """Run fn(*args, **kwargs) unless a call with the same key is already
+        running, in which case wait for it and return its result"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+            else:
+                self.suppressed += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result
+        except BaseException as err:
+            call.error = err
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def inFlight(self):
+        with self._lock:
+            return len(self._calls)
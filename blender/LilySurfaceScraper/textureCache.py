@@ -0,0 +1,213 @@
+# Copyright (c) 2019 - 2024 Elie Michel
+#
+# This file is part of LilySurfaceScraper, a Blender add-on to import
+# materials from a single URL. It is released under the terms of the GPLv3
+# license. See the LICENSE.md file for the full text.
+
+"""
+Size quota of the texture directory. Downloaded variants are stored in
+<texture_dir>/<home_dir>/<asset>/<variant>, or <texture_dir>/<home_dir>/<shard>/<asset>/<variant>
+when asset directories are sharded, and this module removes whole
+variants, least recently used first, until the directory fits in its quota.
+A variant is either a directory of maps or, like HDRIs and IES profiles, a
+single file of the asset directory, as given by the path of its record in
+the asset's metadata. Asset directories themselves, which hold the metadata
+and the thumbnail used by the panels, are kept.
+
+A variant is used when it is imported or when one of its images is loaded.
+This is recorded by touching a marker file in the variant directory (next
+to the file for single file variants), so that it is shared by all Blender
+instances using the same texture directory.
+Variants that contain a file in use (e.g. by the images of the open .blend)
+or that match a pin pattern are never removed.
+
+This module must not use the Blender API.
+"""
+
+import fnmatch
+import os
+import shutil
+import time
+from collections import namedtuple
+
+from .assetIndex import isShardDir
+from .libraryIndex import LibraryIndex, METADATA_NAME
+from .metadataHandler import Metadata
+
+USAGE_MARKER = ".last_used"
+
+CachedVariant = namedtuple("CachedVariant", ["name", "path", "size", "last_used", "pinned"])
+
+
+def usageMarker(variant_path):
+    """Path of the marker of the variant stored at variant_path, a directory
+    or a single file"""
+    if os.path.isdir(variant_path):
+        return os.path.join(variant_path, USAGE_MARKER)
+    directory, filename = os.path.split(variant_path)
+    return os.path.join(directory, "." + filename + USAGE_MARKER)
+
+
+def markUsed(variant_path):
+    """Record that the variant stored at variant_path, a directory or a
+    single file, has just been used"""
+    marker = usageMarker(variant_path)
+    try:
+        with open(marker, "a"):
+            pass
+        os.utime(marker)
+    except OSError:
+        pass
+
+
+def markFileUsed(path, max_depth=3):
+    """Record that the variant containing the file at path has just been
+    used. Return False if path is not in a variant directory, nor a single
+    file variant."""
+    path = os.path.abspath(path)
+    if os.path.isfile(usageMarker(path)):
+        markUsed(path)
+        return True
+    directory = os.path.dirname(path)
+    for _ in range(max_depth):
+        if os.path.isfile(os.path.join(directory, USAGE_MARKER)):
+            markUsed(directory)
+            return True
+        directory = os.path.dirname(directory)
+    return False
+
+
+class TextureCache():
+    def __init__(self, texture_dir, quota, pinned_files=(), pin_patterns=()):
+        """texture_dir: root of the cache
+        quota: size limit in bytes, 0 for no limit
+        pinned_files: paths of files in use, the variants containing them are kept
+        pin_patterns: variants whose name, like 'ambientCG/Bricks*/*', matches one of these are kept"""
+        self.texture_dir = os.path.abspath(texture_dir)
+        self.quota = quota
+        self.pinned_files = [os.path.normcase(os.path.abspath(path)) for path in pinned_files]
+        self.pin_patterns = [pattern.strip() for pattern in pin_patterns if pattern.strip()]
+
+    def variants(self):
+        """List all the variants stored in the texture directory"""
+        variants = []
+        for home_dir in self._subdirs(self.texture_dir):
+            for asset_dir in self._assetDirs(home_dir):
+                for variant_name, path in self._variantPaths(asset_dir):
+                    # shards are not part of the name, so that pin patterns do not depend on the layout
+                    name = "/".join([os.path.basename(home_dir), os.path.basename(asset_dir), variant_name])
+                    size, last_modified = self._scan(path)
+                    try:
+                        last_used = os.path.getmtime(usageMarker(path))
+                    except OSError:
+                        last_used = last_modified
+                    variants.append(CachedVariant(name, path, size, last_used, self._isPinned(name, path)))
+        return variants
+
+    def plan(self):
+        """Return the variants to remove, least recently used first, and the
+        total size before and after removing them"""
+        variants = self.variants()
+        total = sum(v.size for v in variants)
+        remaining = total
+        to_remove = []
+        if self.quota > 0:
+            for variant in sorted(variants, key=lambda v: v.last_used):
+                if remaining <= self.quota:
+                    break
+                if variant.pinned:
+                    continue
+                to_remove.append(variant)
+                remaining -= variant.size
+        return to_remove, total, remaining
+
+    def evict(self, dry_run=False):
+        """Remove variants until the cache fits in its quota, or only list
+        them if dry_run is True. Return a report, as a list of lines."""
+        to_remove, total, remaining = self.plan()
+        report = []
+        for variant in to_remove:
+            age = (time.time() - variant.last_used) / (24 * 3600)
+            report.append("{} {} ({}, unused for {:.0f} days)".format(
+                "Would remove" if dry_run else "Removing", variant.name, formatSize(variant.size), age))
+            if not dry_run:
+                self._remove(variant.path)
+                LibraryIndex.getInstance(self.texture_dir).setDownloaded(*variant.name.split("/"), downloaded=False)
+        report.append("Texture directory: {} of {} quota, {} after cleaning".format(
+            formatSize(total), formatSize(self.quota) if self.quota > 0 else "no", formatSize(remaining)))
+        return report
+
+    def _isPinned(self, name, variant_path):
+        if any(fnmatch.fnmatch(name, pattern) for pattern in self.pin_patterns):
+            return True
+        variant_path = os.path.normcase(variant_path)
+        prefix = variant_path + os.path.sep
+        return any(path == variant_path or path.startswith(prefix) for path in self.pinned_files)
+
+    @classmethod
+    def _variantPaths(cls, asset_dir):
+        """Names and paths of the variants stored in an asset directory"""
+        records = Metadata.open(os.path.join(asset_dir, METADATA_NAME)).records
+        names = {record.path: record.name for record in records}
+        variants = [(names.get(os.path.basename(d), os.path.basename(d)), d) for d in cls._subdirs(asset_dir)]
+        for record in records:
+            path = os.path.join(asset_dir, record.path)
+            if os.path.isfile(path):
+                variants.append((record.name, path))
+        return variants
+
+    @staticmethod
+    def _remove(variant_path):
+        if os.path.isdir(variant_path):
+            shutil.rmtree(variant_path, ignore_errors=True)
+            return
+        for path in (usageMarker(variant_path), variant_path):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    @classmethod
+    def _assetDirs(cls, home_dir):
+        asset_dirs = []
+        for directory in cls._subdirs(home_dir):
+            if isShardDir(directory):
+                asset_dirs.extend(cls._subdirs(directory))
+            else:
+                asset_dirs.append(directory)
+        return asset_dirs
+
+    @staticmethod
+    def _subdirs(directory):
+        try:
+            entries = list(os.scandir(directory))
+        except OSError:
+            return []
+        # hidden directories like the HTTP cache are not variants
+        return [e.path for e in entries if e.is_dir(follow_symlinks=False) and not e.name.startswith(".")]
+
+    @staticmethod
+    def _scan(directory):
+        """Total size and last modification time of the files in directory,
+        or of the file at this path"""
+        if os.path.isfile(directory):
+            stat = os.lstat(directory)
+            return stat.st_size, stat.st_mtime
+        size = 0
+        last_modified = 0
+        for root, _, files in os.walk(directory):
+            for filename in files:
+                try:
+                    stat = os.lstat(os.path.join(root, filename))
+                except OSError:
+                    continue
+                size += stat.st_size
+                last_modified = max(last_modified, stat.st_mtime)
+        return size, last_modified
+
+
+def formatSize(byte_count):
+    for unit in ("B", "KB", "MB", "GB"):
+        if byte_count < 1024 or unit == "GB":
+            return "{:.1f} {}".format(byte_count, unit) if unit != "B" else "{} B".format(byte_count)
+        byte_count /= 1024
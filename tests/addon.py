@@ -0,0 +1,162 @@
+# Copyright (c) 2019 - 2024 Elie Michel
+#
+# This file is part of LilySurfaceScraper, a Blender add-on to import
+# materials from a single URL. It is released under the terms of the GPLv3
+# license. See the LICENSE.md file for the full text.
+
+"""
+Helpers shared by tests and benchmark scripts. They run outside of Blender,
+so they only import the modules of the add-on that do not depend on bpy,
+without running the add-on's __init__.py.
+"""
+
+import importlib
+import os
+import re
+import sys
+import threading
+import types
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+ADDON_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), "blender", "LilySurfaceScraper")
+ADDON_PACKAGE = "LilySurfaceScraper"
+
+RANGE_PATTERN = re.compile(r"bytes=(\d*)-(\d*)$")
+
+
+def importAddonModule(name):
+    """Import LilySurfaceScraper.<name> without importing the whole add-on"""
+    if ADDON_PACKAGE not in sys.modules:
+        package = types.ModuleType(ADDON_PACKAGE)
+        package.__path__ = [ADDON_DIR]
+        sys.modules[ADDON_PACKAGE] = package
+    return importlib.import_module(ADDON_PACKAGE + "." + name)
+
+
+class RangeServer():
+    """Local keep-alive HTTP server serving files like a CDN does: with an
+    ETag, honoring Range and If-Range headers.
+    files: dict mapping a path to its content (bytes)
+    handshake_delay: seconds spent when accepting a new connection, to emulate
+    the round trips of a TCP + TLS handshake with a remote CDN
+    Attributes can be changed while it runs to emulate a misbehaving server:
+    supports_ranges: when False, Range headers are ignored
+    etag: changing it emulates a file updated on the server
+    cut_after: the next response is interrupted after this many bytes of body
+    fail_next: status of the next responses instead of the file, as many as fail_count
+    Requests are logged as (method, path, headers) tuples."""
+
+    def __init__(self, files, handshake_delay=0.0):
+        self.files = files
+        self.supports_ranges = True
+        self.etag = '"v1"'
+        self.cut_after = None
+        self.fail_next = None
+        self.fail_count = 1
+        self.requests = []
+        self.connections = 0
+        self._lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                with server._lock:
+                    server.connections += 1
+                if handshake_delay > 0:
+                    threading.Event().wait(handshake_delay)
+                super().setup()
+
+            def log_message(self, *args):
+                pass
+
+            def do_HEAD(self):
+                self.respond(send_body=False)
+
+            def do_GET(self):
+                self.respond(send_body=True)
+
+            def respond(self, send_body):
+                with server._lock:
+                    server.requests.append((self.command, self.path, dict(self.headers)))
+                with server._lock:
+                    fail = server.fail_next
+                    if fail is not None:
+                        server.fail_count -= 1
+                        if server.fail_count <= 0:
+                            server.fail_next, server.fail_count = None, 1
+                if fail is not None:
+                    self.send_error(fail)
+                    return
+                data = server.files.get(self.path.split("?")[0])
+                if data is None:
+                    self.send_error(404)
+                    return
+                status, start, end = server._range(self.headers, len(data))
+                if status == 416:
+                    self.send_response(416)
+                    self.send_header("Content-Range", "bytes */{}".format(len(data)))
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                body = data[start:end]
+                self.send_response(status)
+                self.send_header("Content-Type", "application/octet-stream")
+                self.send_header("Content-Length", str(len(body)))
+                self.send_header("ETag", server.etag)
+                if server.supports_ranges:
+                    self.send_header("Accept-Ranges", "bytes")
+                if status == 206:
+                    self.send_header("Content-Range", "bytes {}-{}/{}".format(start, end - 1, len(data)))
+                self.end_headers()
+                if not send_body:
+                    return
+                with server._lock:
+                    cut_after, server.cut_after = server.cut_after, None
+                if cut_after is None:
+                    self.wfile.write(body)
+                    return
+                self.wfile.write(body[:cut_after])
+                self.wfile.flush()
+                self.close_connection = True
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.httpd.daemon_threads = True
+        # clients closing connections before the end of a response are expected
+        self.httpd.handle_error = lambda request, client_address: None
+        self.url = "http://127.0.0.1:{}".format(self.httpd.server_address[1])
+        self._thread = threading.Thread(target=self.httpd.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def resetCounters(self):
+        with self._lock:
+            self.connections = 0
+            del self.requests[:]
+
+    def rangeHeaders(self):
+        """Range headers of the GET requests received so far"""
+        with self._lock:
+            return [headers.get("Range") for method, path, headers in self.requests if method == "GET"]
+
+    def _range(self, headers, size):
+        """Status and byte range [start, end) of the response to a request"""
+        match = RANGE_PATTERN.match(headers.get("Range", ""))
+        if_range = headers.get("If-Range")
+        if not self.supports_ranges or match is None or (if_range is not None and if_range != self.etag):
+            return 200, 0, size
+        first, last = match.groups()
+        if not first:
+            return 206, max(0, size - int(last)), size
+        start = int(first)
+        if start >= size:
+            return 416, 0, 0
+        end = min(size, int(last) + 1) if last else size
+        return 206, start, end
@@ -0,0 +1,38 @@
+# Copyright (c) 2019 - 2024 Elie Michel
+#
+# This file is part of LilySurfaceScraper, a Blender add-on to import
+# materials from a single URL. It is released under the terms of the GPLv3
+# license. See the LICENSE.md file for the full text.
+
+import pytest
+
+from addon import RangeServer
+
+
+class RootDirectory():
+    """The root of the repository has an __init__.py, so that the zip of the
+    repository can be installed as an add-on. Collect it as a plain directory,
+    otherwise pytest imports it, hence the whole add-on and bpy."""
+
+    def pytest_collect_directory(self, path, parent):
+        if path == parent.config.rootpath:
+            return pytest.Dir.from_parent(parent, path=path)
+
+
+def pytest_configure(config):
+    config.pluginmanager.register(RootDirectory(), "lily-root-directory")
+
+
+@pytest.fixture
+def range_server():
+    """Start a RangeServer, given the files it serves"""
+    servers = []
+
+    def start(files):
+        server = RangeServer(files).__enter__()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.__exit__()
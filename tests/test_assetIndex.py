@@ -0,0 +1,83 @@
+# Copyright (c) 2019 - 2024 Elie Michel
+#
+# This file is part of LilySurfaceScraper, a Blender add-on to import
+# materials from a single URL. It is released under the terms of the GPLv3
+# license. See the LICENSE.md file for the full text.
+
+import os
+import threading
+
+from addon import importAddonModule
+
+assetIndex = importAddonModule("assetIndex")
+
+
+def makeAsset(home, relpath, variants=("1K-JPG", "2K-JPG")):
+    for variant in variants:
+        os.makedirs(os.path.join(str(home), *relpath.split("/"), variant))
+
+
+def test_sharded_asset_path(tmp_path):
+    index = assetIndex.AssetIndex(str(tmp_path))
+    path = index.assetPath("Bricks054", sharded=True)
+    shard = assetIndex.shardOf("Bricks054")
+    assert path == os.path.join(str(tmp_path), shard, "Bricks054")
+    assert os.path.isfile(os.path.join(str(tmp_path), shard, assetIndex.SHARD_MARKER))
+    assert assetIndex.isShardDir(os.path.join(str(tmp_path), shard))
+    assert not assetIndex.isShardDir(path)
+    assert assetIndex.AssetIndex(str(tmp_path)).assets() == ["Bricks054"]
+
+
+def test_asset_named_like_a_shard(tmp_path):
+    makeAsset(tmp_path, "ab")
+    makeAsset(tmp_path, "Bricks054")
+    assert not assetIndex.isShardDir(str(tmp_path / "ab"))
+    index = assetIndex.AssetIndex(str(tmp_path))
+    assert index.assets() == ["Bricks054", "ab"]
+    assert index.assetPath("ab", create=False) == str(tmp_path / "ab")
+
+
+def test_unmarked_shard(tmp_path):
+    # shards created before they were marked
+    shard = assetIndex.shardOf("Bricks054")
+    makeAsset(tmp_path, shard + "/Bricks054")
+    assert assetIndex.isShardDir(str(tmp_path / shard))
+    index = assetIndex.AssetIndex(str(tmp_path))
+    assert index.assets() == ["Bricks054"]
+    assert index.assetPath("Bricks054", create=False) == str(tmp_path / shard / "Bricks054")
+
+
+def test_migrate(tmp_path):
+    makeAsset(tmp_path, "ab")
+    makeAsset(tmp_path, "Bricks054")
+    index = assetIndex.AssetIndex(str(tmp_path))
+    moves = index.migrate(sharded=True, keep_links=False)
+    assert len(moves) == 2
+    for name in ("ab", "Bricks054"):
+        shard = assetIndex.shardOf(name)
+        assert index.assetPath(name, create=False) == str(tmp_path / shard / name)
+        assert assetIndex.isShardDir(str(tmp_path / shard))
+    assert assetIndex.AssetIndex(str(tmp_path)).assets() == ["Bricks054", "ab"]
+
+    moves = index.migrate(sharded=False, keep_links=False)
+    assert len(moves) == 2
+    assert sorted(os.listdir(str(tmp_path / "ab"))) == ["1K-JPG", "2K-JPG"]
+    assert sorted(entry.name for entry in assetIndex.AssetIndex._subdirs(str(tmp_path))) == ["Bricks054", "ab"]
+    assert assetIndex.AssetIndex(str(tmp_path)).assets() == ["Bricks054", "ab"]
+
+
+def test_concurrent_records_are_all_kept(tmp_path):
+    # distinct instances, as if in distinct Blender instances
+    indices = [assetIndex.AssetIndex(str(tmp_path)) for _ in range(4)]
+
+    def record(i, index):
+        for j in range(10):
+            index.assetPath("Asset{}_{}".format(i, j), sharded=j % 2 == 0)
+
+    threads = [threading.Thread(target=record, args=(i, index)) for i, index in enumerate(indices)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(assetIndex.AssetIndex(str(tmp_path)).assets()) == 40
+    assert not [name for name in os.listdir(str(tmp_path)) if name.endswith(".tmp")]
@@ -0,0 +1,66 @@
+# Copyright (c) 2019 - 2024 Elie Michel
+#
+# This file is part of LilySurfaceScraper, a Blender add-on to import
+# materials from a single URL. It is released under the terms of the GPLv3
+# license. See the LICENSE.md file for the full text.
+
+import os
+import threading
+
+from addon import importAddonModule
+
+contentStore = importAddonModule("contentStore")
+
+
+def test_add_and_link(tmp_path):
+    store = contentStore.ContentStore(str(tmp_path / "store"))
+    path = tmp_path / "project" / "Wood_Color.jpg"
+    path.parent.mkdir()
+    path.write_bytes(b"color")
+    digest = store.add(str(path), url="https://example.com/Wood_Color.jpg")
+    assert digest == contentStore.fileDigest(str(path))
+    assert os.path.samefile(str(path), store.objectPath(digest))
+
+    other = tmp_path / "other" / "Wood_Color.jpg"
+    other.parent.mkdir()
+    assert store.linkUrl("https://example.com/Wood_Color.jpg", str(other), size=5)
+    assert other.read_bytes() == b"color"
+    assert not store.linkUrl("https://example.com/Wood_Color.jpg", str(other), size=6)
+    assert not store.linkUrl("https://example.com/Wood_Normal.jpg", str(other))
+
+
+def test_concurrent_records_are_all_kept(tmp_path):
+    # distinct instances, as if in distinct Blender instances
+    stores = [contentStore.ContentStore(str(tmp_path)) for _ in range(4)]
+
+    def record(i, store):
+        for j in range(10):
+            store.record("https://example.com/{}/{}".format(i, j), {"hash": str(j)})
+
+    threads = [threading.Thread(target=record, args=(i, store)) for i, store in enumerate(stores)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for i in range(4):
+        for j in range(10):
+            assert stores[0].lookup("https://example.com/{}/{}".format(i, j)) == {"hash": str(j)}
+    assert sorted(os.listdir(tmp_path)) == ["index.json", "objects"]
+
+
+def test_zip_entries_are_merged(tmp_path):
+    store = contentStore.ContentStore(str(tmp_path / "store"))
+    variant = tmp_path / "variant"
+    variant.mkdir()
+    for name in ("Wood_Color.jpg", "Wood_Normal.png"):
+        (variant / name).write_bytes(name.encode())
+    names = ["Wood_Color.jpg", "Wood_Normal.png", "Wood.usdc"]
+    store.addZipEntries("https://example.com/Wood.zip", str(variant), names, ["Wood_Color.jpg"])
+    store.addZipEntries("https://example.com/Wood.zip", str(variant), names, ["Wood_Normal.png"])
+
+    other = tmp_path / "other"
+    other.mkdir()
+    wanted = lambda names: [name for name in names if not name.endswith(".usdc")]
+    assert store.linkZipEntries("https://example.com/Wood.zip", str(other), wanted) == ["Wood_Color.jpg", "Wood_Normal.png"]
+    assert (other / "Wood_Normal.png").read_bytes() == b"Wood_Normal.png"
+    assert store.linkZipEntries("https://example.com/Wood.zip", str(other), lambda names: names) is None
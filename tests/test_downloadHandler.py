@@ -0,0 +1,185 @@
+# Copyright (c) 2019 - 2024 Elie Michel
+#
+# This file is part of LilySurfaceScraper, a Blender add-on to import
+# materials from a single URL. It is released under the terms of the GPLv3
+# license. See the LICENSE.md file for the full text.
+
+import hashlib
+import json
+import os
+import random
+
+import pytest
+
+from addon import importAddonModule
+
+downloadHandler = importAddonModule("downloadHandler")
+sessionHandler = importAddonModule("sessionHandler")
+
+DATA = random.Random(0).randbytes(300000)
+DIGEST = hashlib.sha256(DATA).hexdigest()
+
+
+@pytest.fixture
+def session_handler():
+    handler = sessionHandler.SessionHandler(retries=0)
+    yield handler
+    handler.close()
+
+
+def makeDownloader(session_handler, **kwargs):
+    kwargs.setdefault("segments", 1)
+    kwargs.setdefault("retries", 0)
+    kwargs.setdefault("stall_time", 0)
+    downloader = downloadHandler.Downloader(session_handler, **kwargs)
+    downloader.chunk_size = 4096
+    return downloader
+
+
+def test_download(range_server, session_handler, tmp_path):
+    server = range_server({"/file": DATA})
+    path = str(tmp_path / "file")
+    assert makeDownloader(session_handler).download(server.url + "/file", path) == DIGEST
+    assert open(path, "rb").read() == DATA
+    assert os.listdir(tmp_path) == ["file"]
+
+
+def test_interrupted_download_is_kept_aside(range_server, session_handler, tmp_path):
+    server = range_server({"/file": DATA})
+    server.cut_after = 100000
+    path = str(tmp_path / "file")
+    with pytest.raises(downloadHandler.TransientDownloadError):
+        makeDownloader(session_handler).download(server.url + "/file", path)
+    assert not os.path.exists(path)
+    assert os.path.getsize(path + downloadHandler.PART_SUFFIX) == 100000
+
+
+def test_resume(range_server, session_handler, tmp_path):
+    server = range_server({"/file": DATA})
+    server.cut_after = 100000
+    path = str(tmp_path / "file")
+    downloader = makeDownloader(session_handler)
+    with pytest.raises(downloadHandler.TransientDownloadError):
+        downloader.download(server.url + "/file", path)
+
+    assert downloader.download(server.url + "/file", path) == DIGEST
+    assert open(path, "rb").read() == DATA
+    method, _, headers = server.requests[-1]
+    assert headers["Range"] == "bytes=100000-"
+    assert headers["If-Range"] == server.etag
+    assert os.listdir(tmp_path) == ["file"]
+
+
+def test_resume_after_retry(range_server, session_handler, tmp_path):
+    server = range_server({"/file": DATA})
+    server.cut_after = 100000
+    path = str(tmp_path / "file")
+    assert makeDownloader(session_handler, retries=1).download(server.url + "/file", path) == DIGEST
+    assert server.rangeHeaders() == [None, "bytes=100000-"]
+
+
+def test_restart_when_file_changed(range_server, session_handler, tmp_path):
+    server = range_server({"/file": DATA})
+    server.cut_after = 100000
+    path = str(tmp_path / "file")
+    downloader = makeDownloader(session_handler)
+    with pytest.raises(downloadHandler.TransientDownloadError):
+        downloader.download(server.url + "/file", path)
+
+    # If-Range does not match anymore, the server sends the whole new file
+    server.files["/file"] = DATA[::-1]
+    server.etag = '"v2"'
+    assert downloader.download(server.url + "/file", path) == hashlib.sha256(DATA[::-1]).hexdigest()
+    assert open(path, "rb").read() == DATA[::-1]
+
+
+def test_restart_when_part_file_is_inconsistent(range_server, session_handler, tmp_path):
+    server = range_server({"/file": DATA})
+    path = str(tmp_path / "file")
+    with open(path + downloadHandler.PART_SUFFIX, "wb") as f:
+        f.write(b"x" * (len(DATA) + 10))
+    with open(path + downloadHandler.PART_SUFFIX + ".json", "w") as f:
+        json.dump({"validator": server.etag}, f)
+    assert makeDownloader(session_handler).download(server.url + "/file", path) == DIGEST
+    assert server.rangeHeaders() == ["bytes={}-".format(len(DATA) + 10), None]
+
+
+def test_missing_file(range_server, session_handler, tmp_path):
+    server = range_server({})
+    with pytest.raises(downloadHandler.DownloadError):
+        makeDownloader(session_handler).download(server.url + "/file", str(tmp_path / "file"))
+    assert os.listdir(tmp_path) == []
+
+
+def test_segmented_download(range_server, session_handler, tmp_path):
+    server = range_server({"/file": DATA})
+    path = str(tmp_path / "file")
+    downloader = makeDownloader(session_handler, segments=4, segment_threshold=65536)
+    assert downloader.download(server.url + "/file", path) == DIGEST
+    assert open(path, "rb").read() == DATA
+    # the first request feeds the first segment
+    assert set(server.rangeHeaders()) == {None, "bytes=75000-149999", "bytes=150000-224999", "bytes=225000-299999"}
+    assert os.listdir(tmp_path) == ["file"]
+
+
+def test_segmented_download_resumes_failed_segments(range_server, session_handler, tmp_path):
+    server = range_server({"/file": DATA})
+    server.cut_after = 10000
+    path = str(tmp_path / "file")
+    downloader = makeDownloader(session_handler, segments=4, segment_threshold=65536)
+    with pytest.raises(downloadHandler.TransientDownloadError):
+        downloader.download(server.url + "/file", path)
+    assert not os.path.exists(path)
+
+    del server.requests[:]
+    assert downloader.download(server.url + "/file", path) == DIGEST
+    assert open(path, "rb").read() == DATA
+    assert server.rangeHeaders() == ["bytes=10000-74999"]
+
+
+def test_only_the_downloader_retries(range_server, tmp_path):
+    server = range_server({"/file": DATA})
+    server.fail_next = 503
+    # the session would retry requests on its own
+    session = sessionHandler.SessionHandler(retries=3)
+    try:
+        path = str(tmp_path / "file")
+        with pytest.raises(downloadHandler.TransientDownloadError):
+            makeDownloader(session).download(server.url + "/file", path)
+        assert len(server.requests) == 1
+
+        server.fail_next, server.fail_count = 503, 2
+        del server.requests[:]
+        assert makeDownloader(session, retries=2).download(server.url + "/file", path) == DIGEST
+        assert len(server.requests) == 3
+    finally:
+        session.close()
+
+
+def test_failed_segments_are_retried_with_the_download(range_server, session_handler, tmp_path):
+    server = range_server({"/file": DATA})
+    path = str(tmp_path / "file")
+    downloader = makeDownloader(session_handler, segments=4, segment_threshold=65536, retries=1)
+    server.cut_after = 10000
+    assert downloader.download(server.url + "/file", path) == DIGEST
+    assert open(path, "rb").read() == DATA
+    # one segment was cut, and fetched again from where it stopped
+    assert server.rangeHeaders().count("bytes=10000-74999") == 1
+    assert len(server.requests) == 5
+
+
+def test_small_files_are_not_segmented(range_server, session_handler, tmp_path):
+    server = range_server({"/file": DATA})
+    path = str(tmp_path / "file")
+    downloader = makeDownloader(session_handler, segments=4, segment_threshold=len(DATA) + 1)
+    assert downloader.download(server.url + "/file", path) == DIGEST
+    assert server.rangeHeaders() == [None]
+
+
+def test_segmented_download_without_ranges(range_server, session_handler, tmp_path):
+    server = range_server({"/file": DATA})
+    server.supports_ranges = False
+    path = str(tmp_path / "file")
+    downloader = makeDownloader(session_handler, segments=4, segment_threshold=65536)
+    assert downloader.download(server.url + "/file", path) == DIGEST
+    assert server.rangeHeaders() == [None]
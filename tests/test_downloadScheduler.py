@@ -0,0 +1,203 @@
+# Copyright (c) 2019 - 2024 Elie Michel
+#
+# This file is part of LilySurfaceScraper, a Blender add-on to import
+# materials from a single URL. It is released under the terms of the GPLv3
+# license. See the LICENSE.md file for the full text.
+
+import random
+import threading
+import time
+
+import pytest
+
+from addon import importAddonModule
+
+downloadScheduler = importAddonModule("downloadScheduler")
+downloadHandler = importAddonModule("downloadHandler")
+sessionHandler = importAddonModule("sessionHandler")
+
+PRIORITY_INTERACTIVE = downloadScheduler.PRIORITY_INTERACTIVE
+PRIORITY_THUMBNAIL = downloadScheduler.PRIORITY_THUMBNAIL
+
+
+class ConcurrencyProbe():
+    """Job that records how many jobs run at the same time, and holds its
+    slot until released"""
+
+    def __init__(self):
+        self.running = 0
+        self.max_running = 0
+        self.order = []
+        self.release = threading.Event()
+        self._lock = threading.Lock()
+
+    def __call__(self, name):
+        with self._lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+            self.order.append(name)
+        try:
+            assert self.release.wait(10)
+        finally:
+            with self._lock:
+                self.running -= 1
+        return name
+
+    def waitRunning(self, count):
+        deadline = time.monotonic() + 10
+        while self.running < count:
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+
+
+def test_per_host_cap():
+    scheduler = downloadScheduler.DownloadScheduler(max_workers=8, per_host=2, min_workers=8)
+    probe = ConcurrencyProbe()
+    futures = [scheduler.submit(probe, i, host="a.example.com") for i in range(5)]
+    other = scheduler.submit(probe, "other", host="b.example.com")
+    probe.waitRunning(3)
+    time.sleep(0.1)
+    assert probe.max_running == 3  # two for the first host, one for the other
+    probe.release.set()
+    assert [future.result(10) for future in futures] == list(range(5))
+    assert other.result(10) == "other"
+    assert probe.max_running == 3
+
+
+def test_lanes_are_picked_by_priority():
+    scheduler = downloadScheduler.DownloadScheduler(max_workers=1, min_workers=1)
+    blocker = threading.Event()
+    started = threading.Event()
+
+    def block():
+        started.set()
+        assert blocker.wait(10)
+
+    scheduler.submit(block)
+    assert started.wait(10)
+    order = []
+    futures = [scheduler.submit(order.append, "thumbnail", priority=PRIORITY_THUMBNAIL),
+               scheduler.submit(order.append, "import 1"),
+               scheduler.submit(order.append, "import 2")]
+    blocker.set()
+    for future in futures:
+        future.result(10)
+    assert order == ["import 1", "import 2", "thumbnail"]
+
+
+def test_background_share():
+    scheduler = downloadScheduler.DownloadScheduler(max_workers=4, min_workers=4)
+    probe = ConcurrencyProbe()
+    thumbnails = [scheduler.submit(probe, i, priority=PRIORITY_THUMBNAIL) for i in range(4)]
+    probe.waitRunning(2)
+    time.sleep(0.1)
+    assert probe.running == 2  # half of the slots
+    # an interactive job starts right away nevertheless
+    assert scheduler.submit(lambda: "import").result(10) == "import"
+    probe.release.set()
+    assert [future.result(10) for future in thumbnails] == list(range(4))
+
+
+def test_errors_decrease_the_limit():
+    scheduler = downloadScheduler.DownloadScheduler(max_workers=8, min_workers=2)
+    scheduler.adapt_window = 0
+    assert scheduler.limit == 4
+
+    def fail():
+        raise OSError("connection reset")
+
+    with pytest.raises(OSError):
+        scheduler.run(fail)
+    assert scheduler.limit == 2
+    with pytest.raises(OSError):
+        scheduler.run(fail)
+    assert scheduler.limit == 2  # not below min_workers
+
+
+def adaptAfter(scheduler, byte_count):
+    """Measure throughput over a window in which byte_count bytes were received"""
+    time.sleep(0.05)
+    scheduler.recordBytes(byte_count)
+    with scheduler._cond:
+        scheduler._adapt()
+    return scheduler.limit
+
+
+def test_throughput_tunes_the_limit():
+    scheduler = downloadScheduler.DownloadScheduler(max_workers=8, min_workers=2)
+    scheduler.adapt_window = 0
+    probe = ConcurrencyProbe()
+    futures = [scheduler.submit(probe, i) for i in range(8)]
+    probe.waitRunning(4)
+    # jobs are waiting: the limit grows while throughput improves
+    assert adaptAfter(scheduler, 1 << 20) == 5
+    assert adaptAfter(scheduler, 4 << 20) == 6
+    assert adaptAfter(scheduler, 4 << 20) == 6
+    # and shrinks when it drops
+    assert adaptAfter(scheduler, 1 << 10) == 3
+    probe.release.set()
+    for future in futures:
+        future.result(10)
+
+
+def test_run_from_a_job():
+    scheduler = downloadScheduler.DownloadScheduler(max_workers=1, min_workers=1)
+
+    def outer():
+        # would wait forever for the only slot if it were queued
+        return scheduler.run(lambda: "inner", host="a.example.com")
+
+    assert scheduler.run(outer, host="a.example.com") == "inner"
+
+    def failing():
+        return scheduler.run(lambda: 1 / 0)
+
+    with pytest.raises(ZeroDivisionError):
+        scheduler.run(failing)
+
+
+class CountingSessionHandler():
+    """SessionHandler recording how many responses are open at the same time"""
+
+    def __init__(self, session_handler):
+        self.session_handler = session_handler
+        self.open = 0
+        self.max_open = 0
+        self._lock = threading.Lock()
+
+    def get(self, *args, **kwargs):
+        response = self.session_handler.get(*args, **kwargs)
+        with self._lock:
+            self.open += 1
+            self.max_open = max(self.max_open, self.open)
+        close = response.close
+
+        def countedClose():
+            with self._lock:
+                self.open -= 1
+            close()
+            response.close = close
+
+        response.close = countedClose
+        return response
+
+
+@pytest.mark.parametrize("per_host", [1, 2])
+def test_segments_go_through_the_scheduler(range_server, tmp_path, per_host):
+    data = random.Random(0).randbytes(300000)
+    server = range_server({"/file": data})
+    scheduler = downloadScheduler.DownloadScheduler(max_workers=4, per_host=per_host, min_workers=4)
+    session = sessionHandler.SessionHandler(retries=0)
+    counting_session = CountingSessionHandler(session)
+    try:
+        downloader = downloadHandler.Downloader(counting_session, segments=4, segment_threshold=65536, retries=0,
+                                                stall_time=0, scheduler=scheduler)
+        downloader.chunk_size = 4096
+        path = str(tmp_path / "file")
+        # the download itself holds a slot of the host, that segments must not wait for
+        scheduler.run(downloader.download, server.url + "/file", path, host=downloadScheduler.hostOf(server.url))
+    finally:
+        session.close()
+    assert open(path, "rb").read() == data
+    assert len(server.rangeHeaders()) == 4
+    assert counting_session.max_open <= per_host
@@ -0,0 +1,87 @@
+# Copyright (c) 2019 - 2024 Elie Michel
+#
+# This file is part of LilySurfaceScraper, a Blender add-on to import
+# materials from a single URL. It is released under the terms of the GPLv3
+# license. See the LICENSE.md file for the full text.
+
+import os
+
+from addon import importAddonModule
+
+extractionManifest = importAddonModule("extractionManifest")
+libraryIndex = importAddonModule("libraryIndex")
+
+URL = "https://ambientcg.com/get?file=Wood012_2K-JPG.zip"
+
+
+def writeMap(directory, name, content=b"map", mtime=None):
+    path = directory / name
+    path.write_bytes(content)
+    if mtime is not None:
+        os.utime(str(path), (mtime, mtime))
+    return name
+
+
+def test_missing_manifest(tmp_path):
+    manifest = extractionManifest.ExtractionManifest(str(tmp_path))
+    assert manifest.load() is None
+    assert manifest.maps(URL) is None
+    assert not manifest.isIncomplete()
+
+
+def test_complete_extraction(tmp_path):
+    manifest = extractionManifest.ExtractionManifest(str(tmp_path))
+    assert not manifest.begin(URL)
+    assert manifest.isIncomplete()
+    assert manifest.maps(URL) is None
+    maps = {"baseColor": writeMap(tmp_path, "Wood_Color.jpg"), "normal": writeMap(tmp_path, "Wood_Normal.jpg")}
+    expected = {map_type: str(tmp_path / name) for map_type, name in maps.items()}
+    assert manifest.complete(URL, maps) == expected
+    assert not manifest.isIncomplete()
+    assert manifest.maps(URL) == expected
+    # of another zip, e.g. when the provider updated the asset
+    assert manifest.maps(URL + "&v=2") is None
+    assert [name for name in os.listdir(tmp_path) if name.endswith(".tmp")] == []
+
+
+def test_changed_maps_invalidate_the_manifest(tmp_path):
+    manifest = extractionManifest.ExtractionManifest(str(tmp_path))
+    manifest.begin(URL)
+    manifest.complete(URL, {"baseColor": writeMap(tmp_path, "Wood_Color.jpg")})
+    writeMap(tmp_path, "Wood_Color.jpg", b"painted over")
+    assert manifest.maps(URL) is None
+    # until it is refreshed, e.g. after the maps were copied from the shared store
+    manifest.refresh()
+    assert manifest.maps(URL) == {"baseColor": str(tmp_path / "Wood_Color.jpg")}
+    os.remove(str(tmp_path / "Wood_Color.jpg"))
+    assert manifest.maps(URL) is None
+
+
+def test_interrupted_extraction_resumes(tmp_path):
+    manifest = extractionManifest.ExtractionManifest(str(tmp_path))
+    manifest.begin(URL)
+    started = os.path.getmtime(manifest.path)
+    writeMap(tmp_path, "Wood_Color.jpg", mtime=started + 1)  # extracted before the interruption
+    writeMap(tmp_path, "Wood_Normal.jpg", mtime=started - 60)  # left over from an older extraction
+
+    assert manifest.begin(URL)  # same zip: resuming
+    assert manifest.isExtracted("Wood_Color.jpg")
+    assert not manifest.isExtracted("Wood_Normal.jpg")
+    assert not manifest.isExtracted("Wood_Roughness.jpg")
+    # another zip, or a reinstall, starts over
+    assert not manifest.begin(URL, restart=True)
+    assert not manifest.begin(URL + "&v=2")
+    assert manifest.load()["url"] == URL + "&v=2"
+
+
+def test_interrupted_extraction_is_not_downloaded(tmp_path):
+    variant_dir = tmp_path / "2K-JPG"
+    variant_dir.mkdir()
+    assert libraryIndex.isDownloaded(str(variant_dir))  # e.g. downloaded before manifests existed
+    manifest = extractionManifest.ExtractionManifest(str(variant_dir))
+    manifest.begin(URL)
+    writeMap(variant_dir, "Wood_Color.jpg")
+    assert not libraryIndex.isDownloaded(str(variant_dir))
+    manifest.complete(URL, {"baseColor": "Wood_Color.jpg"})
+    assert libraryIndex.isDownloaded(str(variant_dir))
+    assert not libraryIndex.isDownloaded(str(tmp_path / "4K-JPG"))
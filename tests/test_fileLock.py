@@ -0,0 +1,105 @@
+# Copyright (c) 2019 - 2024 Elie Michel
+#
+# This file is part of LilySurfaceScraper, a Blender add-on to import
+# materials from a single URL. It is released under the terms of the GPLv3
+# license. See the LICENSE.md file for the full text.
+
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+from addon import importAddonModule
+
+fileLock = importAddonModule("fileLock")
+
+
+def makeLock(path, lease=0.5):
+    return fileLock.FileLock(str(path), lease=lease, poll_interval=0.02)
+
+
+def writeOwner(path, host, pid):
+    with open(path, "w") as f:
+        json.dump({"host": host, "pid": pid, "token": "stale"}, f)
+
+
+def test_mutual_exclusion(tmp_path):
+    path = tmp_path / "file.lock"
+    holders = []
+    overlaps = []
+    waited = []
+
+    def work():
+        with makeLock(path) as lock:
+            holders.append(1)
+            if len(holders) > 1:
+                overlaps.append(1)
+            time.sleep(0.01)
+            holders.pop()
+        waited.append(lock.waited)
+
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not overlaps
+    assert waited.count(False) >= 1 and any(waited)
+    assert not path.exists()
+
+
+def test_held_lock_is_renewed(tmp_path):
+    path = tmp_path / "file.lock"
+    holder = makeLock(path, lease=0.2)
+    holder.acquire()
+    released = []
+
+    def release():
+        time.sleep(0.6)
+        released.append(time.monotonic())
+        holder.release()
+
+    thread = threading.Thread(target=release)
+    thread.start()
+    with makeLock(path, lease=0.2) as lock:
+        # not broken although held longer than a lease
+        assert released and lock.waited
+    thread.join()
+
+
+def test_stale_lock_of_another_host_is_broken_after_a_lease(tmp_path):
+    path = tmp_path / "file.lock"
+    writeOwner(path, "another-host", 1)
+    start = time.monotonic()
+    with makeLock(path, lease=0.3) as lock:
+        assert lock.waited
+        assert time.monotonic() - start >= 0.3
+        assert json.load(open(path))["token"] == lock.token
+    assert not path.exists()
+
+
+@pytest.mark.skipif(os.name == "nt", reason="dead processes are not detected on Windows")
+def test_lock_of_a_dead_process_is_broken_right_away(tmp_path):
+    path = tmp_path / "file.lock"
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    writeOwner(path, socket.gethostname(), process.pid)
+    start = time.monotonic()
+    with makeLock(path, lease=30) as lock:
+        assert lock.waited
+    assert time.monotonic() - start < 5
+
+
+def test_release_keeps_the_lock_of_another_owner(tmp_path):
+    path = tmp_path / "file.lock"
+    lock = makeLock(path)
+    lock.acquire()
+    # broken by another instance that believed it stale
+    writeOwner(path, "another-host", 1)
+    lock.release()
+    assert path.exists()
@@ -0,0 +1,125 @@
+# Copyright (c) 2019 - 2024 Elie Michel
+#
+# This file is part of LilySurfaceScraper, a Blender add-on to import
+# materials from a single URL. It is released under the terms of the GPLv3
+# license. See the LICENSE.md file for the full text.
+
+import io
+import json
+import os
+import tarfile
+
+import pytest
+
+from addon import importAddonModule
+
+assetIndex = importAddonModule("assetIndex")
+extractionManifest = importAddonModule("extractionManifest")
+libraryBundle = importAddonModule("libraryBundle")
+
+URL = "https://ambientcg.com/get?file=Wood012_2K-JPG.zip"
+
+
+def makeLibrary(texture_dir, sharded):
+    """Texture directory holding two assets, one of which was extracted from a zip"""
+    index = assetIndex.AssetIndex(os.path.join(str(texture_dir), "ambientCG"))
+    wood_dir = index.assetPath("Wood012", sharded)
+    variant_dir = os.path.join(wood_dir, "2K-JPG")
+    os.makedirs(variant_dir)
+    files = {
+        ".meta": b'{"name": "Wood012"}',
+        "2K-JPG/Wood_Color.jpg": b"color" * 1000,
+        "2K-JPG/Wood_Normal.jpg": b"normal" * 1000,
+    }
+    for relpath, content in files.items():
+        with open(os.path.join(wood_dir, *relpath.split("/")), "wb") as f:
+            f.write(content)
+    manifest = extractionManifest.ExtractionManifest(variant_dir)
+    manifest.begin(URL)
+    manifest.complete(URL, {"baseColor": "Wood_Color.jpg", "normal": "Wood_Normal.jpg"})
+    # specific to this machine or to an ongoing download
+    for name in (".last_used", "4K-JPG.zip.part", "4K-JPG.zip.part.json"):
+        with open(os.path.join(wood_dir, name), "wb") as f:
+            f.write(b"x")
+
+    bricks_dir = index.assetPath("Bricks054", sharded)
+    with open(os.path.join(bricks_dir, ".meta"), "wb") as f:
+        f.write(b'{"name": "Bricks054"}')
+    files[extractionManifest.MANIFEST_NAME] = None
+    return files
+
+
+@pytest.mark.parametrize("source_sharded", [False, True])
+@pytest.mark.parametrize("target_sharded", [False, True])
+def test_round_trip(tmp_path, source_sharded, target_sharded):
+    files = makeLibrary(tmp_path / "source", source_sharded)
+    assets = libraryBundle.listAssetDirectories(str(tmp_path / "source"), ["ambientCG", "polyhaven"])
+    assert [(home_dir, name) for home_dir, name, _ in assets] == [("ambientCG", "Bricks054"), ("ambientCG", "Wood012")]
+    bundle_path = str(tmp_path / ("library" + libraryBundle.BUNDLE_EXTENSION))
+    file_count, size = libraryBundle.exportBundle(bundle_path, assets)
+    assert file_count == 5
+
+    target_dir = tmp_path / "target"
+    imported = libraryBundle.importBundle(bundle_path, str(target_dir), sharded=target_sharded)
+    assert sorted(imported) == ["ambientCG/Bricks054", "ambientCG/Wood012"]
+    index = assetIndex.AssetIndex(str(target_dir / "ambientCG"))
+    assert index.assets() == ["Bricks054", "Wood012"]
+    wood_dir = index.assetPath("Wood012", create=False)
+    assert (os.path.dirname(wood_dir) != str(target_dir / "ambientCG")) == target_sharded
+    for relpath, content in files.items():
+        if content is not None:
+            with open(os.path.join(wood_dir, *relpath.split("/")), "rb") as f:
+                assert f.read() == content
+    assert sorted(os.listdir(wood_dir)) == [".meta", "2K-JPG"]
+    # the extraction is still known to be complete
+    manifest = extractionManifest.ExtractionManifest(os.path.join(wood_dir, "2K-JPG"))
+    assert manifest.maps(URL) == {"baseColor": os.path.join(wood_dir, "2K-JPG", "Wood_Color.jpg"),
+                                  "normal": os.path.join(wood_dir, "2K-JPG", "Wood_Normal.jpg")}
+
+    # importing again keeps the files that did not change
+    mtime = os.path.getmtime(os.path.join(wood_dir, ".meta"))
+    assert sorted(libraryBundle.importBundle(bundle_path, str(target_dir), sharded=not target_sharded)) == imported
+    assert index.assetPath("Wood012", create=False) == wood_dir
+    assert os.path.getmtime(os.path.join(wood_dir, ".meta")) == mtime
+
+
+def writeBundle(path, assets, members):
+    """Write a bundle by hand, given its index and its (name, content) members"""
+    with tarfile.open(path, "w", format=tarfile.PAX_FORMAT) as tar:
+        for name, data in [(libraryBundle.BUNDLE_INDEX, json.dumps({"version": libraryBundle.BUNDLE_VERSION,
+                                                                     "assets": assets}).encode())] + members:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+
+
+@pytest.mark.parametrize("arcname", [
+    "ambientCG/Wood012/../../../evil.txt",
+    "ambientCG/../../evil.txt",
+    "/ambientCG/Wood012/evil.txt",
+    "ambientCG/Wood012/C:/evil.txt",
+    "ambientCG/Wood012\\..\\..\\evil.txt",
+])
+def test_path_traversal_is_refused(tmp_path, arcname):
+    home_dir, asset_name, relpath = (arcname.split("/", 2) + ["", ""])[:3]
+    bundle_path = str(tmp_path / "evil.lilybundle")
+    writeBundle(bundle_path, [{"home_dir": home_dir, "name": asset_name, "files": {relpath: 4}}],
+                [(arcname, b"evil")])
+    target_dir = tmp_path / "nested" / "target"
+    with pytest.raises(libraryBundle.BundleError):
+        libraryBundle.importBundle(bundle_path, str(target_dir))
+    written = [os.path.join(root, name) for root, _, names in os.walk(str(tmp_path)) for name in names]
+    assert written == [bundle_path]
+
+
+def test_unexpected_files_are_refused(tmp_path):
+    bundle_path = str(tmp_path / "other.lilybundle")
+    writeBundle(bundle_path, [{"home_dir": "ambientCG", "name": "Wood012", "files": {".meta": 2}}],
+                [("ambientCG/Wood012/.meta", b"{}"), ("ambientCG/Wood012/other.py", b"pass")])
+    with pytest.raises(libraryBundle.BundleError):
+        libraryBundle.importBundle(bundle_path, str(tmp_path / "target"))
+
+    with open(bundle_path, "wb") as f:
+        f.write(b"not a bundle")
+    with pytest.raises((libraryBundle.BundleError, tarfile.TarError)):
+        libraryBundle.importBundle(bundle_path, str(tmp_path / "target"))
@@ -0,0 +1,99 @@
+# Copyright (c) 2019 - 2024 Elie Michel
+#
+# This file is part of LilySurfaceScraper, a Blender add-on to import
+# materials from a single URL. It is released under the terms of the GPLv3
+# license. See the LICENSE.md file for the full text.
+
+import os
+import shutil
+
+from addon import importAddonModule
+
+assetIndex = importAddonModule("assetIndex")
+libraryIndex = importAddonModule("libraryIndex")
+metadataHandler = importAddonModule("metadataHandler")
+extractionManifest = importAddonModule("extractionManifest")
+
+
+def addAsset(texture_dir, asset_name, variants=("1K-JPG", "2K-JPG"), downloaded=("1K-JPG",), tags=()):
+    """Download an asset as another Blender instance would: the metadata file
+    is written and the asset indexed without this library index knowing"""
+    index = assetIndex.AssetIndex(str(texture_dir / "ambientCG"))
+    asset_dir = index.assetPath(asset_name)
+    metadata = metadataHandler.Metadata(asset_name.replace("0", " 0", 1), asset_name, "AmbientCGScraper",
+                                        "https://ambientcg.com/view?id=" + asset_name, "thumbnail.jpg",
+                                        list(variants))
+    metadata.tags = list(tags)
+    with open(os.path.join(asset_dir, libraryIndex.METADATA_NAME), "w") as f:
+        f.write(metadata.serialize())
+    for variant in downloaded:
+        os.makedirs(os.path.join(asset_dir, variant))
+    return asset_dir
+
+
+def touchAssetIndex(texture_dir):
+    """Make sure the asset index looks changed, even on coarse mtimes"""
+    path = assetIndex.AssetIndex(str(texture_dir / "ambientCG")).index_path
+    mtime = os.path.getmtime(path) + 1
+    os.utime(path, (mtime, mtime))
+
+
+def downloads(index):
+    return {asset.asset: asset.downloaded for asset in index.assets("ambientCG")}
+
+
+def test_listing_does_not_refresh(tmp_path):
+    addAsset(tmp_path, "Bricks054")
+    index = libraryIndex.LibraryIndex(str(tmp_path))
+    assert index.assets("ambientCG") == []
+    assert index.search("ambientCG", "bricks") == []
+    assert index.refresh("ambientCG")
+    assert not index.refresh("ambientCG")  # nothing changed since
+    asset, = index.assets("ambientCG")
+    assert (asset.asset, asset.name, asset.variants, asset.downloaded) == (
+        "Bricks054", "Bricks 054", ["1K-JPG", "2K-JPG"], {"1K-JPG"})
+
+
+def test_refresh_checks_downloads_again(tmp_path):
+    bricks_dir = addAsset(tmp_path, "Bricks054")
+    wood_dir = addAsset(tmp_path, "Wood012", downloaded=("1K-JPG", "2K-JPG"))
+    index = libraryIndex.LibraryIndex(str(tmp_path))
+    index.refresh("ambientCG")
+    assert downloads(index) == {"Bricks054": {"1K-JPG"}, "Wood012": {"1K-JPG", "2K-JPG"}}
+
+    # changed by others, without the metadata being saved again
+    os.makedirs(os.path.join(bricks_dir, "2K-JPG"))
+    shutil.rmtree(os.path.join(wood_dir, "1K-JPG"))
+    extractionManifest.ExtractionManifest(os.path.join(wood_dir, "2K-JPG")).begin("https://example.com/2K.zip")
+    assert not index.refresh("ambientCG")  # until the asset index changes
+    touchAssetIndex(tmp_path)
+    assert index.refresh("ambientCG")
+    assert downloads(index) == {"Bricks054": {"1K-JPG", "2K-JPG"}, "Wood012": set()}
+
+
+def test_refresh_drops_removed_assets(tmp_path):
+    addAsset(tmp_path, "Bricks054", tags=("brick", "wall"))
+    wood_dir = addAsset(tmp_path, "Wood012", tags=("wood",))
+    index = libraryIndex.LibraryIndex(str(tmp_path))
+    index.refresh("ambientCG")
+    assert index.search("ambientCG", "wall") == ["Bricks054"]
+    assert index.search("ambientCG", "wood") == ["Wood012"]
+
+    shutil.rmtree(wood_dir)
+    assetIndex.AssetIndex(str(tmp_path / "ambientCG")).rebuild()
+    touchAssetIndex(tmp_path)
+    assert index.refresh("ambientCG")
+    assert list(downloads(index)) == ["Bricks054"]
+    assert index.asset("ambientCG", "Wood012") is None
+    assert index.search("ambientCG", "wood") == []
+
+
+def test_saved_metadata_is_listed_right_away(tmp_path):
+    asset_dir = addAsset(tmp_path, "Bricks054", downloaded=())
+    metadata = metadataHandler.Metadata.open(os.path.join(asset_dir, libraryIndex.METADATA_NAME))
+    metadata.tags = ["brick"]
+    metadata.save(os.path.join(asset_dir, libraryIndex.METADATA_NAME))
+    index = libraryIndex.LibraryIndex.getInstance(str(tmp_path))
+    asset, = index.assets("ambientCG")
+    assert (asset.asset, asset.tags, asset.downloaded) == ("Bricks054", ["brick"], set())
+    assert index.search("ambientCG", "brick") == ["Bricks054"]
@@ -0,0 +1,253 @@
+# Copyright (c) 2019 - 2024 Elie Michel
+#
+# This file is part of LilySurfaceScraper, a Blender add-on to import
+# materials from a single URL. It is released under the terms of the GPLv3
+# license. See the LICENSE.md file for the full text.
+
+import json
+
+import pytest
+
+from addon import importAddonModule
+
+metadataHandler = importAddonModule("metadataHandler")
+FileRecord = metadataHandler.FileRecord
+VariantRecord = metadataHandler.VariantRecord
+Metadata = metadataHandler.Metadata
+
+
+def metadataPath(tmp_path, asset_name="Bricks054"):
+    asset_dir = tmp_path / "textures" / "ambientCG" / asset_name
+    asset_dir.mkdir(parents=True)
+    return asset_dir / ".meta"
+
+
+def test_parse_labels():
+    assert metadataHandler.parseResolution("2K-JPG") == 2048
+    assert metadataHandler.parseResolution("4k (exr)") == 4096
+    assert metadataHandler.parseResolution("preview") == 0
+    assert metadataHandler.parseFormat("2K-JPG") == "jpg"
+    assert metadataHandler.parseFormat("4k (exr)") == "exr"
+    assert metadataHandler.parseFormat("4k") == ""
+
+
+def test_from_name():
+    record = VariantRecord.fromName("2K-PNG")
+    assert (record.name, record.resolution, record.format, record.path) == ("2K-PNG", 2048, "png", "2K-PNG")
+    assert record.files == {}
+    assert record.resolved is None
+
+
+def test_records_round_trip():
+    url = "https://example.com/a.exr"
+    assert FileRecord.fromJson(FileRecord(url).toJson()) == FileRecord(url)
+    file_record = FileRecord(url, 1234, "0123456789abcdef")
+    assert FileRecord.fromJson(file_record.toJson()) == file_record
+    # older metadata
+    assert FileRecord.fromJson(url) == FileRecord(url)
+    assert FileRecord.fromJson({"url": url, "size": 1234, "md5": "0123456789abcdef"}) == file_record
+
+    record = VariantRecord("4k (exr)", 4096, "exr", {"diffuse": file_record}, "4k_exr",
+                           {"material": "Bricks054 4k", "maps": {"diffuse": "4k_exr/a.exr"}})
+    # through json, as in a metadata file
+    data = json.loads(json.dumps(record.toJson()))
+    copy = VariantRecord.fromJson(data)
+    for name in VariantRecord.__slots__:
+        assert getattr(copy, name) == getattr(record, name), name
+    assert VariantRecord.fromJson("2K-JPG").resolution == 2048
+
+
+def test_save_and_open(tmp_path):
+    path = metadataPath(tmp_path)
+    metadata = Metadata("Bricks 054", "Bricks054", "AmbientCGScraper", "https://ambientcg.com/view?id=Bricks054",
+                        "thumbnail.png", ["1K-JPG", "2K-JPG"])
+    metadata.getVariant("2K-JPG").files = {"zip": FileRecord("https://ambientcg.com/get?file=Bricks054_2K-JPG.zip", 42)}
+    metadata.tags = ["bricks", "wall"]
+    metadata.setCustom("key", "value")
+    assert metadata.save(str(path))
+    assert not metadata.save(str(path))  # unchanged
+
+    copy = Metadata.open(str(path))
+    assert (copy.name, copy.id, copy.scraper, copy.fetchUrl, copy.thumbnail) == \
+        ("Bricks 054", "Bricks054", "AmbientCGScraper", "https://ambientcg.com/view?id=Bricks054", "thumbnail.png")
+    assert copy.variants == ["1K-JPG", "2K-JPG"]
+    assert copy.getVariant("2K-JPG").files == metadata.getVariant("2K-JPG").files
+    assert copy.tags == ["bricks", "wall"]
+    assert copy.getCustom("key") == "value"
+    assert not copy.isDirty(str(path))
+
+
+def makeMetadata():
+    return Metadata("Bricks 054", "Bricks054", "AmbientCGScraper", "https://ambientcg.com/view?id=Bricks054",
+                    "thumbnail.png", ["1K-JPG", "2K-JPG"])
+
+
+def test_batched_writes(tmp_path):
+    path = metadataPath(tmp_path)
+    metadata = makeMetadata()
+    with Metadata.batchedWrites():
+        assert metadata.save(str(path))
+        metadata.tags = ["bricks"]
+        assert metadata.save(str(path))
+        assert not path.exists()  # written once, at the end
+        assert metadata.isDirty(str(path))
+    assert Metadata.open(str(path)).tags == ["bricks"]
+    assert not metadata.isDirty(str(path))
+
+    # changed then changed back within a batch: the last content is written
+    with Metadata.batchedWrites():
+        metadata.tags = ["wall"]
+        assert metadata.save(str(path))
+        metadata.tags = ["bricks"]
+        metadata.save(str(path))
+    assert Metadata.open(str(path)).tags == ["bricks"]
+    assert not metadata.isDirty(str(path))
+
+
+def test_failed_batched_write(tmp_path, monkeypatch):
+    path = metadataPath(tmp_path)
+    metadata = makeMetadata()
+    other_path = metadataPath(tmp_path, "Wood012")
+    other = makeMetadata()
+    write = Metadata._write
+
+    def failingWrite(metadata_filepath, content):
+        if metadata_filepath == str(path):
+            raise OSError("disk full")
+        return write(metadata_filepath, content)
+
+    monkeypatch.setattr(Metadata, "_write", staticmethod(failingWrite))
+    with pytest.raises(OSError):
+        with Metadata.batchedWrites():
+            metadata.save(str(path))
+            other.save(str(other_path))
+    assert other_path.exists()
+    assert not path.exists()
+    # not considered saved, so saving again writes it
+    assert metadata.isDirty(str(path))
+    monkeypatch.setattr(Metadata, "_write", staticmethod(write))
+    assert metadata.save(str(path))
+    assert path.exists()
+
+
+def test_open_unreadable(tmp_path):
+    path = metadataPath(tmp_path)
+    assert Metadata.open(str(path)).variants == []
+    path.write_text('{"name": "Bricks')
+    assert Metadata.open(str(path)).variants == []
+
+
+def writeLegacy(path, variants, custom):
+    path.write_text(json.dumps({"name": "Asset", "id": "Asset", "scraper": "Scraper", "fetchUrl": "",
+                                "thumbnail": None, "variants": variants, "custom": custom}))
+
+
+def test_upgrade_poly_haven_hdri(tmp_path):
+    path = metadataPath(tmp_path)
+    writeLegacy(path, ["1k (hdr)", "4k (exr)"], {"variant_data": [
+        ["1k", "hdr", {"url": "https://dl.polyhaven.org/1k.hdr", "size": 10, "md5": "aa"}],
+        ["4k", "exr", "https://dl.polyhaven.org/4k.exr"],
+    ]})
+    metadata = Metadata.open(str(path))
+    first, second = metadata.records
+    assert (first.resolution, first.format, first.path) == (1024, "hdr", "1k.hdr")
+    assert first.files == {"hdri": FileRecord("https://dl.polyhaven.org/1k.hdr", 10, "aa")}
+    assert (second.resolution, second.format, second.path) == (4096, "exr", "4k.exr")
+    assert second.files == {"hdri": FileRecord("https://dl.polyhaven.org/4k.exr")}
+    assert "variant_data" not in metadata.custom
+
+
+def test_upgrade_poly_haven_texture(tmp_path):
+    path = metadataPath(tmp_path)
+    writeLegacy(path, ["2k (jpg)"], {"variant_data": [
+        ["2k", "jpg", {"diffuse": {"url": "https://dl.polyhaven.org/diff.jpg", "size": 10, "md5": "aa"},
+                       "normal": {"url": "https://dl.polyhaven.org/nor.jpg"}}],
+    ]})
+    record, = Metadata.open(str(path)).records
+    assert (record.resolution, record.format, record.path) == (2048, "jpg", "2k (jpg)")
+    assert record.files == {"diffuse": FileRecord("https://dl.polyhaven.org/diff.jpg", 10, "aa"),
+                            "normal": FileRecord("https://dl.polyhaven.org/nor.jpg")}
+
+
+def test_upgrade_ambient_cg(tmp_path):
+    path = metadataPath(tmp_path)
+    writeLegacy(path, ["1K-JPG", "2K-PNG"], {"variants_urls": ["https://ambientcg.com/1K-JPG.zip",
+                                                                "https://ambientcg.com/2K-PNG.zip"],
+                                              "other": 1})
+    metadata = Metadata.open(str(path))
+    assert [record.files for record in metadata.records] == [{"zip": FileRecord("https://ambientcg.com/1K-JPG.zip")},
+                                                              {"zip": FileRecord("https://ambientcg.com/2K-PNG.zip")}]
+    assert [record.resolution for record in metadata.records] == [1024, 2048]
+    assert metadata.custom == {"other": 1}
+    # written in the new format once saved
+    assert metadata.save(str(path))
+    assert "variants_urls" not in json.loads(path.read_text())["custom"]
+    assert Metadata.open(str(path)).records[1].files == metadata.records[1].files
+
+
+def test_upgrade_cgbookcase(tmp_path):
+    path = metadataPath(tmp_path)
+    writeLegacy(path, ["1K (double-sided)", "2K (double-sided)", "1K (front only)", "2K (front only)"],
+                {"resolutions": ["1K", "2K"], "doublesided": True,
+                 "files": {"1K": "https://cgbookcase.com/1K.zip", "2K": "https://cgbookcase.com/2K.zip"}})
+    metadata = Metadata.open(str(path))
+    assert [record.files["zip"].url for record in metadata.records] == [
+        "https://cgbookcase.com/1K.zip", "https://cgbookcase.com/2K.zip"] * 2
+    assert [record.resolution for record in metadata.records] == [1024, 2048] * 2
+    assert [record.path for record in metadata.records] == metadata.variants
+    assert metadata.custom == {}
+
+
+def makeResolvedRecord(asset_dir):
+    variant_dir = asset_dir / "2k (jpg)"
+    variant_dir.mkdir(parents=True)
+    for name in ("diff.jpg", "nor.jpg"):
+        (variant_dir / name).write_bytes(b"jpg")
+    record = VariantRecord("2k (jpg)", 2048, "jpg")
+    maps = {"diffuse": str(variant_dir / "diff.jpg"), "normal": str(variant_dir / "nor.jpg"), "energy": 2.5}
+    assert record.resolve(str(asset_dir), "polyhaven/Bricks/2k (jpg)", maps, "arm")
+    return record, maps
+
+
+def test_resolved_round_trip(tmp_path):
+    path = metadataPath(tmp_path, "Bricks")
+    record, maps = makeResolvedRecord(path.parent)
+    assert record.resolved["maps"] == {"diffuse": "2k (jpg)/diff.jpg", "normal": "2k (jpg)/nor.jpg"}
+    assert record.resolved["values"] == {"energy": 2.5}
+
+    metadata = Metadata("Bricks", "bricks", "PolyHavenTextureScraper", "", None, list())
+    metadata.records = [record]
+    assert metadata.save(str(path))
+    copy = Metadata.open(str(path)).records[0]
+    assert copy.resolvedMaps(str(path.parent), "arm") == ("polyhaven/Bricks/2k (jpg)", maps)
+
+
+def test_resolved_options_changed(tmp_path):
+    record, _ = makeResolvedRecord(tmp_path)
+    assert record.resolvedMaps(str(tmp_path), "") is None
+
+
+def test_resolved_file_missing(tmp_path):
+    record, maps = makeResolvedRecord(tmp_path)
+    (tmp_path / "2k (jpg)" / "nor.jpg").unlink()
+    assert record.resolvedMaps(str(tmp_path), "arm") is None
+
+
+def test_partial_result_not_resolved(tmp_path):
+    record, maps = makeResolvedRecord(tmp_path)
+    resolved = record.resolved
+    # a map failed to download
+    assert not record.resolve(str(tmp_path), "polyhaven/Bricks/2k (jpg)", {**maps, "roughness": None}, "arm")
+    assert record.resolved is resolved
+    # a file that is not in the asset directory
+    assert not record.resolve(str(tmp_path / "Other"), "polyhaven/Bricks/2k (jpg)", maps, "arm")
+    assert record.resolved is resolved
+
+
+def test_resolved_without_expected_maps(tmp_path):
+    record, _ = makeResolvedRecord(tmp_path)
+    # recorded by an older version, maybe missing maps that failed to download
+    del record.resolved["expected"]
+    assert record.resolvedMaps(str(tmp_path), "arm") is None
+    record.resolved["expected"] = ["diffuse", "normal", "roughness", "energy"]
+    assert record.resolvedMaps(str(tmp_path), "arm") is None
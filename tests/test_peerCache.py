@@ -0,0 +1,105 @@
+# Copyright (c) 2019 - 2024 Elie Michel
+#
+# This file is part of LilySurfaceScraper, a Blender add-on to import
+# materials from a single URL. It is released under the terms of the GPLv3
+# license. See the LICENSE.md file for the full text.
+
+import os
+
+import pytest
+
+from addon import importAddonModule
+
+peerCache = importAddonModule("peerCache")
+contentStore = importAddonModule("contentStore")
+sessionHandler = importAddonModule("sessionHandler")
+
+URL = "https://example.com/Wood_Color.jpg"
+SECRET = "correct horse"
+
+
+@pytest.fixture
+def session_handler():
+    handler = sessionHandler.SessionHandler(retries=0)
+    yield handler
+    handler.close()
+
+
+@pytest.fixture
+def peer(tmp_path):
+    """Store holding a file for URL, served on the loopback interface"""
+    servers = []
+
+    def start(secret=SECRET, allowed_networks=None):
+        store = contentStore.ContentStore(str(tmp_path / "store"))
+        path = tmp_path / "Wood_Color.jpg"
+        path.write_bytes(b"color" * 1000)
+        digest = store.add(str(path), url=URL)
+        server = peerCache.PeerCacheServer(store, 0, secret, "127.0.0.1", allowed_networks)
+        server.start()
+        servers.append(server)
+        return "127.0.0.1:{}".format(server.port), store, digest
+
+    yield start
+    for server in servers:
+        server.stop()
+
+
+def test_fetch_from_peer(peer, session_handler, tmp_path):
+    address, store, digest = peer()
+    client = peerCache.PeerClient(session_handler, ["127.0.0.1:1", address], SECRET)
+    found = client.findRecord(URL)
+    assert found is not None
+    assert found[0] == "http://" + address
+    assert found[1]["hash"] == digest
+    assert client.findRecord("https://example.com/other.jpg") is None
+
+    path = str(tmp_path / "received.jpg")
+    assert client.fetchObject(found[0], digest, path)
+    assert open(path, "rb").read() == b"color" * 1000
+    assert not client.fetchObject(found[0], "0" * 64, path)
+
+
+def test_corrupted_object_is_rejected(peer, session_handler, tmp_path):
+    address, store, digest = peer()
+    object_path = store.objectPath(digest)
+    os.chmod(object_path, 0o644)
+    with open(object_path, "wb") as f:
+        f.write(b"corrupted")
+    client = peerCache.PeerClient(session_handler, [address], SECRET)
+    path = tmp_path / "received.jpg"
+    assert not client.fetchObject("http://" + address, digest, str(path))
+    assert not path.exists()
+    assert sorted(os.listdir(tmp_path)) == ["Wood_Color.jpg", "store"]
+
+
+def test_wrong_secret(peer, session_handler):
+    address, store, digest = peer()
+    client = peerCache.PeerClient(session_handler, [address], "wrong")
+    assert client.findRecord(URL) is None
+    r = session_handler.get("http://{}/lily/v1/object/{}".format(address, digest), retries=0)
+    assert r.status_code == 403
+
+
+def test_allowed_networks(peer, session_handler):
+    address, _, _ = peer(allowed_networks=peerCache.parseNetworks("192.168.1.0/24, 10.0.0.12"))
+    assert peerCache.PeerClient(session_handler, [address], SECRET).findRecord(URL) is None
+
+    address, _, _ = peer(allowed_networks=peerCache.parseNetworks("192.168.1.0/24, 127.0.0.0/8"))
+    assert peerCache.PeerClient(session_handler, [address], SECRET).findRecord(URL) is not None
+
+
+def test_secret_is_required(tmp_path):
+    store = contentStore.ContentStore(str(tmp_path / "store"))
+    with pytest.raises(ValueError):
+        peerCache.PeerCacheServer(store, 0, "", "127.0.0.1")
+    with pytest.raises(ValueError):
+        peerCache.parseNetworks("192.168.1.0/24, render01")
+
+
+def test_only_store_paths_are_served(peer, session_handler):
+    address, _, _ = peer()
+    headers = peerCache.authorizationHeaders(SECRET)
+    for path in ("/", "/lily/v1/object/../index.json", "/index.json", "/lily/v1/record/" + "0" * 40):
+        r = session_handler.get("http://{}{}".format(address, path), headers=headers, retries=0)
+        assert r.status_code == 404, path
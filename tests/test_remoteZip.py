@@ -0,0 +1,251 @@
+# Copyright (c) 2019 - 2024 Elie Michel
+#
+# This file is part of LilySurfaceScraper, a Blender add-on to import
+# materials from a single URL. It is released under the terms of the GPLv3
+# license. See the LICENSE.md file for the full text.
+
+import io
+import os
+import random
+import zipfile
+
+import pytest
+
+from addon import importAddonModule
+
+downloadHandler = importAddonModule("downloadHandler")
+remoteZip = importAddonModule("remoteZip")
+sessionHandler = importAddonModule("sessionHandler")
+
+rng = random.Random(0)
+ENTRIES = {
+    "Wood_Color.jpg": rng.randbytes(200000),
+    "Wood_Normal.png": rng.randbytes(300000),
+    "Wood_Roughness.jpg": b"rough" * 20000,
+    "preview/Wood.png": rng.randbytes(400000),
+    "Wood.usdc": b"usd" * 1000,
+}
+# small enough to be read byte by byte
+SMALL_ENTRIES = {name: content[:3000] for name, content in ENTRIES.items()}
+
+
+def makeZip(entries, compression=zipfile.ZIP_DEFLATED):
+    data = io.BytesIO()
+    with zipfile.ZipFile(data, "w", compression) as zip_ref:
+        for name, content in entries.items():
+            zip_ref.writestr(name, content)
+    return data.getvalue()
+
+
+class SpySessionHandler():
+    """Forward requests to a SessionHandler, recording their arguments"""
+
+    def __init__(self, on_request=None):
+        self.session_handler = sessionHandler.SessionHandler(retries=0)
+        self.on_request = on_request
+        self.calls = []
+
+    def get(self, url, **kwargs):
+        self.calls.append(kwargs)
+        if self.on_request is not None:
+            self.on_request(len(self.calls))
+        return self.session_handler.get(url, **kwargs)
+
+
+@pytest.fixture
+def spy():
+    spy = SpySessionHandler()
+    yield spy
+    spy.session_handler.close()
+
+
+def test_only_wanted_entries_are_downloaded(range_server, spy, tmp_path):
+    data = makeZip(ENTRIES, zipfile.ZIP_STORED)
+    server = range_server({"/wood.zip": data})
+    received = []
+    namelist = remoteZip.extractRemoteZip(spy, server.url + "/wood.zip", str(tmp_path),
+                                          lambda name: name.endswith("_Normal.png"), progress_callback=received.append)
+    assert namelist == ["Wood_Normal.png"]
+    assert (tmp_path / "Wood_Normal.png").read_bytes() == ENTRIES["Wood_Normal.png"]
+    assert os.listdir(tmp_path) == ["Wood_Normal.png"]
+    assert sum(received) < len(ENTRIES["Wood_Normal.png"]) + 2 * remoteZip.RemoteFile.tail_size
+
+
+def test_range_requests_are_streamed_and_not_compressed(range_server, spy, tmp_path):
+    server = range_server({"/wood.zip": makeZip(ENTRIES)})
+    remoteZip.extractRemoteZip(spy, server.url + "/wood.zip", str(tmp_path), lambda name: name.startswith("Wood_"))
+    assert sorted(os.listdir(tmp_path)) == ["Wood_Color.jpg", "Wood_Normal.png", "Wood_Roughness.jpg"]
+    assert all(call["stream"] for call in spy.calls)
+    for method, path, headers in server.requests:
+        assert headers["Range"].startswith("bytes=")
+        assert headers["Accept-Encoding"] == "identity"
+
+
+def test_server_without_ranges(range_server, spy, tmp_path):
+    server = range_server({"/wood.zip": makeZip(ENTRIES)})
+    server.supports_ranges = False
+    with pytest.raises(downloadHandler.RangeNotSupported):
+        remoteZip.extractRemoteZip(spy, server.url + "/wood.zip", str(tmp_path), lambda name: True)
+    # the probe is answered with the whole file, that must not be read
+    assert len(spy.calls) == 1 and spy.calls[0]["stream"]
+    assert os.listdir(tmp_path) == []
+
+
+def test_file_changed_while_read(range_server, spy, tmp_path):
+    server = range_server({"/wood.zip": makeZip(ENTRIES, zipfile.ZIP_STORED)})
+
+    def update(request_count):
+        if request_count == 2:
+            server.etag = '"v2"'
+
+    spy.on_request = update
+    with pytest.raises(downloadHandler.DownloadError):
+        remoteZip.extractRemoteZip(spy, server.url + "/wood.zip", str(tmp_path), lambda name: True)
+
+
+def test_entry_paths_stay_inside_the_target_directory():
+    assert remoteZip.entryPath("maps/Wood.png") == os.path.join("maps", "Wood.png")
+    assert remoteZip.entryPath("../../Wood.png") == "Wood.png"
+    assert remoteZip.entryPath("/etc/Wood.png") == os.path.join("etc", "Wood.png")
+    with pytest.raises(zipfile.BadZipFile):
+        remoteZip.entryPath("../")
+
+
+class UnseekableFile():
+    """Written to by zipfile, that then follows entries with data descriptors"""
+
+    def __init__(self):
+        self.data = io.BytesIO()
+
+    def write(self, data):
+        return self.data.write(data)
+
+    def flush(self):
+        pass
+
+
+def chunkedReader(data, sizes):
+    """read function returning data in chunks of the given sizes, in turn"""
+    chunks = []
+    offset = 0
+    while offset < len(data):
+        size = sizes[len(chunks) % len(sizes)]
+        chunks.append(data[offset:offset + size])
+        offset += size
+    chunks = iter(chunks)
+    return lambda: next(chunks, b"")
+
+
+@pytest.mark.parametrize("sizes", [[1], [3, 7], [4096], [1 << 20]])
+@pytest.mark.parametrize("compression", [zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED])
+def test_stream_extraction(tmp_path, sizes, compression):
+    read = chunkedReader(makeZip(SMALL_ENTRIES, compression), sizes)
+    extractor = remoteZip.ZipStreamExtractor(read, str(tmp_path), lambda name: not name.endswith(".usdc"))
+    assert extractor.extractAll() == ["Wood_Color.jpg", "Wood_Normal.png", "Wood_Roughness.jpg",
+                                      os.path.join("preview", "Wood.png")]
+    for name, content in SMALL_ENTRIES.items():
+        if not name.endswith(".usdc"):
+            assert (tmp_path / name).read_bytes() == content
+    assert not (tmp_path / "Wood.usdc").exists()
+
+
+@pytest.mark.parametrize("sizes", [[1], [5, 13], [1 << 20]])
+def test_stream_extraction_with_data_descriptors(tmp_path, sizes):
+    output = UnseekableFile()
+    with zipfile.ZipFile(output, "w", zipfile.ZIP_DEFLATED) as zip_ref:
+        for name, content in SMALL_ENTRIES.items():
+            zip_ref.writestr(name, content)
+    read = chunkedReader(output.data.getvalue(), sizes)
+    extractor = remoteZip.ZipStreamExtractor(read, str(tmp_path), lambda name: name.startswith("Wood_"))
+    assert extractor.extractAll() == ["Wood_Color.jpg", "Wood_Normal.png", "Wood_Roughness.jpg"]
+    assert (tmp_path / "Wood_Normal.png").read_bytes() == SMALL_ENTRIES["Wood_Normal.png"]
+
+
+def test_stream_extraction_of_an_empty_zip(tmp_path):
+    extractor = remoteZip.ZipStreamExtractor(chunkedReader(makeZip({}), [2]), str(tmp_path), lambda name: True)
+    assert extractor.extractAll() == []
+
+
+def test_stream_extraction_ignores_the_central_directory(tmp_path):
+    data = makeZip(SMALL_ENTRIES)
+    extractor = remoteZip.ZipStreamExtractor(chunkedReader(data[:-10], [3]), str(tmp_path), lambda name: True)
+    assert len(extractor.extractAll()) == len(SMALL_ENTRIES)
+
+
+def centralDirectoryOffset(data):
+    with zipfile.ZipFile(io.BytesIO(data)) as zip_ref:
+        return zip_ref.start_dir
+
+
+@pytest.mark.parametrize("sizes", [[1], [2], [3, 7]])
+def test_truncated_stream(tmp_path, sizes):
+    data = makeZip(SMALL_ENTRIES)
+    start_dir = centralDirectoryOffset(data)
+    for cut in (start_dir - 100, start_dir, start_dir + 2):
+        extractor = remoteZip.ZipStreamExtractor(chunkedReader(data[:cut], sizes), str(tmp_path), lambda name: True)
+        with pytest.raises(zipfile.BadZipFile):
+            extractor.extractAll()
+
+
+def test_garbage_after_entries(tmp_path):
+    data = makeZip(SMALL_ENTRIES)
+    start_dir = centralDirectoryOffset(data)
+    data = data[:start_dir] + b"garbage" + data[start_dir:]
+    extractor = remoteZip.ZipStreamExtractor(chunkedReader(data, [4096]), str(tmp_path), lambda name: True)
+    with pytest.raises(zipfile.BadZipFile):
+        extractor.extractAll()
+
+
+def test_corrupted_entry(tmp_path):
+    data = bytearray(makeZip({"Wood_Color.jpg": SMALL_ENTRIES["Wood_Color.jpg"]}, zipfile.ZIP_STORED))
+    data[1000] ^= 0xFF
+    extractor = remoteZip.ZipStreamExtractor(chunkedReader(bytes(data), [4096]), str(tmp_path), lambda name: True)
+    with pytest.raises(zipfile.BadZipFile):
+        extractor.extractAll()
+    assert os.listdir(tmp_path) == []
+
+
+def test_stream_extract_zip_without_ranges(range_server, spy, tmp_path):
+    server = range_server({"/wood.zip": makeZip(ENTRIES)})
+    server.supports_ranges = False
+    namelist = remoteZip.streamExtractZip(spy, server.url + "/wood.zip", str(tmp_path),
+                                          lambda name: name.endswith("_Color.jpg"), stall_time=0)
+    assert namelist == ["Wood_Color.jpg"]
+    assert (tmp_path / "Wood_Color.jpg").read_bytes() == ENTRIES["Wood_Color.jpg"]
+
+
+def openZip(tmp_path, data):
+    path = tmp_path / "wood.zip"
+    path.write_bytes(data)
+    return zipfile.ZipFile(str(path))
+
+
+def test_extract_entries(tmp_path):
+    target_dir = tmp_path / "2K-JPG"
+    with openZip(tmp_path, makeZip(ENTRIES)) as zip_ref:
+        infos = zip_ref.infolist()
+        relpaths = remoteZip.extractEntries(zip_ref, infos, str(target_dir), max_workers=3)
+    # in the order of the entries, whatever the order of extraction
+    assert relpaths == [remoteZip.entryPath(info.filename) for info in infos]
+    for name, content in ENTRIES.items():
+        assert (target_dir / name).read_bytes() == content
+    assert sorted(os.listdir(target_dir)) == sorted(["Wood_Color.jpg", "Wood_Normal.png", "Wood_Roughness.jpg",
+                                                     "preview", "Wood.usdc"])
+
+
+def test_extract_entries_with_a_corrupted_one(tmp_path):
+    data = bytearray(makeZip(ENTRIES, zipfile.ZIP_STORED))
+    with zipfile.ZipFile(io.BytesIO(bytes(data))) as zip_ref:
+        info = zip_ref.getinfo("Wood_Normal.png")
+    # the CRC is only checked once the whole entry was read
+    data[info.header_offset + 30 + len(info.filename) + info.file_size // 2] ^= 0xFF
+    target_dir = tmp_path / "2K-JPG"
+    target_dir.mkdir()
+    (target_dir / "Wood_Normal.png").write_bytes(b"previous version")
+    with openZip(tmp_path, bytes(data)) as zip_ref:
+        with pytest.raises(zipfile.BadZipFile):
+            remoteZip.extractEntries(zip_ref, zip_ref.infolist(), str(target_dir), max_workers=3)
+    assert (target_dir / "Wood_Normal.png").read_bytes() == b"previous version"
+    assert not [name for name in os.listdir(target_dir) if name.endswith(downloadHandler.PART_SUFFIX)]
+    # the other entries are complete
+    assert (target_dir / "Wood_Color.jpg").read_bytes() == ENTRIES["Wood_Color.jpg"]
@@ -0,0 +1,146 @@
+# Copyright (c) 2019 - 2024 Elie Michel
+#
+# This file is part of LilySurfaceScraper, a Blender add-on to import
+# materials from a single URL. It is released under the terms of the GPLv3
+# license. See the LICENSE.md file for the full text.
+
+import json
+import os
+
+import requests
+
+from addon import importAddonModule
+
+responseCache = importAddonModule("responseCache")
+
+URL = "https://api.example.com/assets?id=Bricks054"
+
+
+class FakeResponse():
+    """The parts of requests.Response that the cache uses"""
+
+    def __init__(self, status_code, content=b"", headers=None):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers if headers is not None else {}
+        self.encoding = "utf-8"
+        self.apparent_encoding = "utf-8"
+
+
+class Provider():
+    """Answers requests like a provider supporting conditional requests, and
+    records the extra headers of each request"""
+
+    def __init__(self, content=b'{"name": "Bricks 054"}', etag='"v1"', last_modified=None):
+        self.content = content
+        self.etag = etag
+        self.last_modified = last_modified
+        self.requests = []
+        self.error = None
+
+    def __call__(self, headers):
+        self.requests.append(headers)
+        if self.error is not None:
+            raise self.error
+        if self.etag is not None and headers.get("If-None-Match") == self.etag:
+            return FakeResponse(304)
+        if self.last_modified is not None and headers.get("If-Modified-Since") == self.last_modified:
+            return FakeResponse(304)
+        response_headers = {"Content-Type": "application/json"}
+        if self.etag is not None:
+            response_headers["ETag"] = self.etag
+        if self.last_modified is not None:
+            response_headers["Last-Modified"] = self.last_modified
+        return FakeResponse(200, self.content, response_headers)
+
+
+def makeOlder(cache, url, seconds):
+    """Pretend that the entry of url was stored seconds earlier"""
+    meta_path, _ = cache._paths(url)
+    with open(meta_path) as f:
+        entry = json.load(f)
+    entry["stored_at"] -= seconds
+    with open(meta_path, "w") as f:
+        json.dump(entry, f)
+
+
+def test_fresh_entries_are_used_as_is(tmp_path):
+    cache = responseCache.ResponseCache(str(tmp_path), 1 << 20)
+    provider = Provider()
+    assert cache.fetch(URL, provider, ttl=3600).json() == {"name": "Bricks 054"}
+    assert cache.fetch(URL, provider, ttl=3600).json() == {"name": "Bricks 054"}
+    assert provider.requests == [{}]
+    # unless asked to revalidate them
+    cache.fetch(URL, provider, ttl=3600, revalidate=True)
+    assert provider.requests[1] == {"If-None-Match": '"v1"'}
+    # the URL is only stored hashed
+    assert not any("example" in name for name in os.listdir(tmp_path))
+
+
+def test_revalidation_with_etag(tmp_path):
+    cache = responseCache.ResponseCache(str(tmp_path), 1 << 20)
+    provider = Provider()
+    cache.fetch(URL, provider, ttl=3600)
+    makeOlder(cache, URL, 7200)
+    assert cache.fetch(URL, provider, ttl=3600).json() == {"name": "Bricks 054"}
+    assert provider.requests[1] == {"If-None-Match": '"v1"'}
+    # the 304 restarted the time to live
+    cache.fetch(URL, provider, ttl=3600)
+    assert len(provider.requests) == 2
+
+    makeOlder(cache, URL, 7200)
+    provider.content, provider.etag = b'{"name": "Bricks 054 v2"}', '"v2"'
+    assert cache.fetch(URL, provider, ttl=3600).json() == {"name": "Bricks 054 v2"}
+    assert cache.lookup(URL)[0]["headers"]["ETag"] == '"v2"'
+
+
+def test_revalidation_with_last_modified(tmp_path):
+    cache = responseCache.ResponseCache(str(tmp_path), 1 << 20)
+    provider = Provider(etag=None, last_modified="Wed, 01 May 2024 10:00:00 GMT")
+    cache.fetch(URL, provider, ttl=3600)
+    makeOlder(cache, URL, 7200)
+    assert cache.fetch(URL, provider, ttl=3600).json() == {"name": "Bricks 054"}
+    assert provider.requests[1] == {"If-Modified-Since": "Wed, 01 May 2024 10:00:00 GMT"}
+
+
+def test_time_to_live_per_provider(tmp_path):
+    cache = responseCache.ResponseCache(str(tmp_path), 1 << 20)
+    provider = Provider()
+    cache.fetch(URL, provider, ttl=24 * 3600)
+    makeOlder(cache, URL, 2 * 3600)
+    cache.fetch(URL, provider, ttl=24 * 3600)  # e.g. Poly Haven
+    assert len(provider.requests) == 1
+    cache.fetch(URL, provider, ttl=3600)  # the default
+    assert len(provider.requests) == 2
+
+
+def test_outdated_entries_when_offline(tmp_path):
+    cache = responseCache.ResponseCache(str(tmp_path), 1 << 20)
+    provider = Provider()
+    cache.fetch(URL, provider, ttl=3600)
+    makeOlder(cache, URL, 7200)
+    provider.error = requests.exceptions.ConnectionError("offline")
+    assert cache.fetch(URL, provider, ttl=3600).json() == {"name": "Bricks 054"}
+    assert cache.fetch(URL + "&other", provider, ttl=3600) is None
+
+
+def test_errors_are_not_cached(tmp_path):
+    cache = responseCache.ResponseCache(str(tmp_path), 1 << 20)
+    assert cache.fetch(URL, lambda headers: FakeResponse(404), ttl=3600) is None
+    assert cache.lookup(URL) == (None, None)
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = responseCache.ResponseCache(str(tmp_path), 25)
+    urls = [URL + str(i) for i in range(3)]
+    for url in urls[:2]:
+        cache.store(url, FakeResponse(200, b"x" * 10))
+    for i, url in enumerate(urls[:2]):
+        os.utime(cache._paths(url)[0], (1000 + i, 1000 + i))
+    # using the oldest entry makes the other one the least recently used
+    assert cache.lookup(urls[0])[1].content == b"x" * 10
+    cache.store(urls[2], FakeResponse(200, b"x" * 10))
+    assert cache.lookup(urls[1]) == (None, None)
+    assert cache.lookup(urls[0])[0] is not None
+    assert cache.lookup(urls[2])[0] is not None
+    assert len(os.listdir(tmp_path)) == 4
@@ -0,0 +1,75 @@
+# Copyright (c) 2019 - 2024 Elie Michel
+#
+# This file is part of LilySurfaceScraper, a Blender add-on to import
+# materials from a single URL. It is released under the terms of the GPLv3
+# license. See the LICENSE.md file for the full text.
+
+from addon import importAddonModule
+
+searchIndex = importAddonModule("searchIndex")
+
+ASSETS = {
+    "AsphaltWood001": ["outdoor", "wood", "road"],
+    "Bricks054": ["outdoor", "wall", "red"],
+    "FloorWood003": ["indoor", "parquet"],
+    "Wood012": ["natural", "planks"],
+    "WoodFloor041": ["indoor", "parquet", "floor"],
+    "Marble006": ["indoor", "polished"],
+}
+
+
+def makeIndex():
+    index = searchIndex.SearchIndex()
+    for name, tags in ASSETS.items():
+        index.add(name, [name], ["ambientCG", *tags])
+    return index
+
+
+def test_tokenize():
+    assert searchIndex.tokenize("WoodFloor041") == {"woodfloor041", "wood", "floor", "041"}
+    assert searchIndex.leadingTokens("WoodFloor041 PBR") == {"woodfloor041", "wood", "pbr"}
+
+
+def test_names_rank_above_tags():
+    index = makeIndex()
+    assert index.search("wood") == ["Wood012", "WoodFloor041", "AsphaltWood001", "FloorWood003"]
+    assert index.search("parquet") == ["FloorWood003", "WoodFloor041"]
+    assert index.search("marble") == ["Marble006"]
+
+
+def test_prefix():
+    index = makeIndex()
+    assert index.search("woo") == ["Wood012", "WoodFloor041", "AsphaltWood001", "FloorWood003"]
+    # "wood" is also one letter away from "woodf"
+    assert index.search("woodf")[0] == "WoodFloor041"
+    assert index.search("woodfl") == ["WoodFloor041"]
+    assert index.search("w", limit=2) == ["Wood012", "WoodFloor041"]
+
+
+def test_typos():
+    index = makeIndex()
+    for query in ("brics", "bricsk", "bricks", "brickss", "brikcs", "bracks"):
+        assert index.search(query) == ["Bricks054"], query
+    # short words and numbers must match exactly or as a prefix
+    assert index.search("rad") == []
+    assert index.search("055") == []
+
+
+def test_several_words():
+    index = makeIndex()
+    assert index.search("wood floor") == ["FloorWood003", "WoodFloor041"]
+    assert index.search("indoor wood") == ["WoodFloor041", "FloorWood003"]
+    assert index.search("wood zzz") == []
+    assert index.search("") == []
+
+
+def test_add_and_remove():
+    index = makeIndex()
+    index.add("Bricks054", ["Bricks054"], ["yellow"])
+    assert index.search("red") == []
+    assert index.search("yellow") == ["Bricks054"]
+    index.remove("Bricks054")
+    assert index.search("bricks") == []
+    assert len(index) == len(ASSETS) - 1
+    index.remove("Marble006")
+    assert index.search("polished") == []
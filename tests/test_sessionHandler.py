@@ -0,0 +1,164 @@
+# Copyright (c) 2019 - 2024 Elie Michel
+#
+# This file is part of LilySurfaceScraper, a Blender add-on to import
+# materials from a single URL. It is released under the terms of the GPLv3
+# license. See the LICENSE.md file for the full text.
+
+import socket
+import threading
+
+import pytest
+import requests
+
+from addon import importAddonModule
+
+sessionHandler = importAddonModule("sessionHandler")
+
+
+def test_connections_are_reused(range_server):
+    server = range_server({"/a": b"a" * 100, "/b": b"b" * 100})
+    handler = sessionHandler.SessionHandler()
+    for path in ("/a", "/b", "/a"):
+        assert handler.get(server.url + path).content == server.files[path]
+    assert server.connections == 1
+    handler.close()
+
+
+def test_threads_share_the_connection_pool(range_server):
+    server = range_server({"/a": b"a" * 100})
+    handler = sessionHandler.SessionHandler(pool_maxsize=2)
+    sessions = []
+
+    def fetch():
+        sessions.append(handler.getSession())
+        for _ in range(5):
+            handler.get(server.url + "/a").content
+
+    threads = [threading.Thread(target=fetch) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sessions[0] is not sessions[1]
+    assert server.connections <= 2
+    handler.close()
+
+
+def test_default_timeout_is_set(range_server):
+    server = range_server({"/a": b"a"})
+    handler = sessionHandler.SessionHandler(connect_timeout=1.0, read_timeout=2.0)
+    sent = {}
+    session = handler.getSession()
+    send = session.send
+
+    def spy(request, **kwargs):
+        sent.update(kwargs)
+        return send(request, **kwargs)
+
+    session.send = spy
+    handler.get(server.url + "/a")
+    assert sent["timeout"] == (1.0, 2.0)
+    handler.close()
+
+
+def test_circuit_opens_after_consecutive_failures():
+    breaker = sessionHandler.CircuitBreaker(failure_threshold=3, cooldown=60)
+    for _ in range(2):
+        breaker.recordFailure()
+        assert breaker.allow()
+    breaker.recordSuccess()
+    for _ in range(3):
+        assert breaker.allow()
+        breaker.recordFailure()
+    assert not breaker.allow()
+
+
+def test_half_open_circuit_lets_a_single_trial_through():
+    breaker = sessionHandler.CircuitBreaker(failure_threshold=1, cooldown=0)
+    breaker.recordFailure()
+    assert breaker.allow()
+    assert not breaker.allow()  # the trial is still running
+
+    # a failed trial opens the circuit again
+    breaker.recordFailure()
+    assert breaker.allow()
+    # a successful one closes it
+    breaker.recordSuccess()
+    assert breaker.allow()
+    assert breaker.allow()
+
+
+def test_half_open_circuit_waits_for_the_cooldown():
+    breaker = sessionHandler.CircuitBreaker(failure_threshold=1, cooldown=60)
+    breaker.recordFailure()
+    assert not breaker.allow()
+    breaker.opened_at -= 60
+    assert breaker.allow()
+
+
+def test_trial_is_released_by_its_thread_only():
+    breaker = sessionHandler.CircuitBreaker(failure_threshold=1, cooldown=0)
+    breaker.recordFailure()
+    assert breaker.allow()
+    other = threading.Thread(target=breaker.releaseTrial)
+    other.start()
+    other.join()
+    assert not breaker.allow()
+    breaker.releaseTrial()
+    assert breaker.allow()
+
+
+def closedPortUrl():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return "http://127.0.0.1:{}/".format(sock.getsockname()[1])
+
+
+def test_connection_errors_are_retried(monkeypatch):
+    monkeypatch.setattr(sessionHandler, "backoffDelay", lambda attempt: 0)
+    handler = sessionHandler.SessionHandler(retries=2)
+    url = closedPortUrl()
+    with pytest.raises(requests.exceptions.ConnectionError):
+        handler.get(url)
+    assert handler.getCircuitBreaker(url).failures == 3
+    handler.close()
+
+
+def test_open_circuit_fails_fast(monkeypatch):
+    handler = sessionHandler.SessionHandler(retries=0)
+    url = closedPortUrl()
+    breaker = handler.getCircuitBreaker(url)
+    breaker.failures = breaker.failure_threshold
+    breaker.opened_at = sessionHandler.time.monotonic()
+    monkeypatch.setattr(handler.getSession(), "request", None)  # nothing must be sent
+    with pytest.raises(sessionHandler.CircuitOpenError):
+        handler.get(url)
+    handler.close()
+
+
+@pytest.mark.parametrize("error", [requests.exceptions.TooManyRedirects, ValueError, KeyboardInterrupt])
+def test_failed_trial_is_released(range_server, error):
+    server = range_server({"/a": b"a"})
+    handler = sessionHandler.SessionHandler(retries=3)
+    breaker = handler.getCircuitBreaker(server.url)
+    breaker.cooldown = 0
+    breaker.failures = breaker.failure_threshold
+    breaker.opened_at = sessionHandler.time.monotonic()
+    session = handler.getSession()
+    request = session.request
+    calls = []
+
+    def failingRequest(*args, **kwargs):
+        calls.append(args)
+        raise error()
+
+    session.request = failingRequest
+    with pytest.raises(error):
+        handler.get(server.url + "/a")
+    assert len(calls) == 1  # only connection errors and timeouts are retried
+
+    # the next request is a new trial, that closes the circuit
+    session.request = request
+    assert handler.get(server.url + "/a").content == b"a"
+    assert breaker.opened_at is None
+    handler.close()
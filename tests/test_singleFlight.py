@@ -0,0 +1,92 @@
+# Copyright (c) 2019 - 2024 Elie Michel
+#
+# This file is part of LilySurfaceScraper, a Blender add-on to import
+# materials from a single URL. It is released under the terms of the GPLv3
+# license. See the LICENSE.md file for the full text.
+
+import threading
+
+import pytest
+
+from addon import importAddonModule
+
+singleFlight = importAddonModule("singleFlight")
+
+
+def runConcurrently(group, key, fn, count):
+    """Call group.do(key, fn) from count threads while fn blocks, and return
+    the results (or exceptions) of all calls"""
+    results = [None] * count
+
+    def call(i):
+        try:
+            results[i] = group.do(key, fn)
+        except Exception as err:
+            results[i] = err
+
+    threads = [threading.Thread(target=call, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=10)
+    return results
+
+
+class BlockingCall():
+    """Function that blocks until all the expected callers are waiting for it"""
+
+    def __init__(self, group, waiting, result=None, error=None):
+        self.group = group
+        self.waiting = waiting
+        self.result = result
+        self.error = error
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        while self.group.suppressed < self.waiting:
+            threading.Event().wait(0.001)
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+def test_identical_calls_are_coalesced():
+    group = singleFlight.SingleFlight()
+    fn = BlockingCall(group, waiting=4, result="data")
+    assert runConcurrently(group, "url", fn, 5) == ["data"] * 5
+    assert fn.calls == 1
+    assert group.suppressed == 4
+    assert group.inFlight() == 0
+
+
+def test_exceptions_are_shared():
+    group = singleFlight.SingleFlight()
+    error = ValueError("failed")
+    fn = BlockingCall(group, waiting=2, error=error)
+    assert runConcurrently(group, "url", fn, 3) == [error] * 3
+    assert fn.calls == 1
+    assert group.inFlight() == 0
+
+
+def test_different_keys_are_not_coalesced():
+    group = singleFlight.SingleFlight()
+    assert group.do("a", lambda: 1) == 1
+    assert group.do("b", lambda: 2) == 2
+    assert group.suppressed == 0
+
+
+def test_sequential_calls_run_again():
+    group = singleFlight.SingleFlight()
+    calls = []
+    for _ in range(2):
+        group.do("url", calls.append, 1)
+    assert calls == [1, 1]
+    with pytest.raises(KeyError):
+        group.do("url", {}.__getitem__, "missing")
+    assert group.do("url", lambda: "recovered") == "recovered"
+
+
+def test_instances_are_shared_by_name():
+    assert singleFlight.SingleFlight.getInstance("test") is singleFlight.SingleFlight.getInstance("test")
+    assert singleFlight.SingleFlight.getInstance("test") is not singleFlight.SingleFlight.getInstance("other")
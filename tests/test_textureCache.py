@@ -0,0 +1,91 @@
+# Copyright (c) 2019 - 2024 Elie Michel
+#
+# This file is part of LilySurfaceScraper, a Blender add-on to import
+# materials from a single URL. It is released under the terms of the GPLv3
+# license. See the LICENSE.md file for the full text.
+
+import os
+import time
+
+import pytest
+
+from addon import importAddonModule
+
+metadataHandler = importAddonModule("metadataHandler")
+textureCache = importAddonModule("textureCache")
+
+
+def writeFile(path, size, age=0):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(b"x" * size)
+    mtime = time.time() - age
+    os.utime(path, (mtime, mtime))
+
+
+def writeMetadata(asset_dir, records):
+    metadata = metadataHandler.Metadata.createBlank()
+    metadata.name = os.path.basename(asset_dir)
+    metadata.records = records
+    os.makedirs(asset_dir, exist_ok=True)
+    metadata.save(os.path.join(asset_dir, ".meta"))
+
+
+@pytest.fixture
+def texture_dir(tmp_path):
+    """A texture directory with variant directories and single file variants"""
+    wood = tmp_path / "ambientCG" / "Wood001"
+    writeMetadata(str(wood), [metadataHandler.VariantRecord("1K-JPG"), metadataHandler.VariantRecord("2K-JPG")])
+    writeFile(str(wood / "1K-JPG" / "Wood001_Color.jpg"), 1000, age=300)
+    writeFile(str(wood / "2K-JPG" / "Wood001_Color.jpg"), 4000, age=200)
+
+    sky = tmp_path / "polyhaven" / "sky"
+    records = [metadataHandler.VariantRecord("{} (exr)".format(res), path="{}.exr".format(res)) for res in ("1k", "4k")]
+    writeMetadata(str(sky), records)
+    writeFile(str(sky / "1k.exr"), 2000, age=400)
+    writeFile(str(sky / "4k.exr"), 8000, age=100)
+    writeFile(str(sky / "thumbnail.png"), 100, age=500)
+    return tmp_path
+
+
+def test_single_file_variants_are_listed(texture_dir):
+    variants = {v.name: v for v in textureCache.TextureCache(str(texture_dir), 0).variants()}
+    assert sorted(variants) == ["ambientCG/Wood001/1K-JPG", "ambientCG/Wood001/2K-JPG",
+                                "polyhaven/sky/1k (exr)", "polyhaven/sky/4k (exr)"]
+    assert variants["polyhaven/sky/4k (exr)"].path == str(texture_dir / "polyhaven" / "sky" / "4k.exr")
+    assert variants["polyhaven/sky/4k (exr)"].size == 8000
+    assert variants["ambientCG/Wood001/2K-JPG"].size == 4000
+
+
+def test_least_recently_used_variants_are_evicted(texture_dir):
+    cache = textureCache.TextureCache(str(texture_dir), 13000)
+    to_remove, total, remaining = cache.plan()
+    assert [v.name for v in to_remove] == ["polyhaven/sky/1k (exr)"]
+    assert (total, remaining) == (15000, 13000)
+
+    cache.evict()
+    sky = texture_dir / "polyhaven" / "sky"
+    assert sorted(os.listdir(sky)) == [".meta", "4k.exr", "thumbnail.png"]
+
+
+def test_single_file_variants_are_marked_used(texture_dir):
+    sky = texture_dir / "polyhaven" / "sky"
+    textureCache.markUsed(str(sky / "1k.exr"))
+    wood = texture_dir / "ambientCG" / "Wood001"
+    textureCache.markUsed(str(wood / "1K-JPG"))
+    # loading an image of a variant marks it used again
+    assert textureCache.markFileUsed(str(sky / "1k.exr"))
+    assert textureCache.markFileUsed(str(wood / "1K-JPG" / "Wood001_Color.jpg"))
+    assert not textureCache.markFileUsed(str(sky / "thumbnail.png"))
+
+    cache = textureCache.TextureCache(str(texture_dir), 9000)
+    assert [v.name for v in cache.plan()[0]] == ["ambientCG/Wood001/2K-JPG", "polyhaven/sky/4k (exr)"]
+    cache.evict()
+    assert sorted(os.listdir(sky)) == [".1k.exr.last_used", ".meta", "1k.exr", "thumbnail.png"]
+
+
+def test_pinned_variants_are_kept(texture_dir):
+    sky = texture_dir / "polyhaven" / "sky"
+    cache = textureCache.TextureCache(str(texture_dir), 1, pinned_files=[str(sky / "1k.exr")],
+                                      pin_patterns=["ambientCG/*/2K-*"])
+    assert sorted(v.name for v in cache.plan()[0]) == ["ambientCG/Wood001/1K-JPG", "polyhaven/sky/4k (exr)"]